@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+"""Rough timings for the grading hot paths.
+
+Run directly (`python benchmarks.py`) to print a table for each benchmark,
+or `python benchmarks.py --suite -o results.json` to run the full suite on
+synthetic courses and write the results as JSON for comparing commits
+(see run_suite).
+"""
+
+import resource,timeit,random,time,json,sys,platform,subprocess,argparse
+from StringIO import StringIO
+
+import grading
+
+
+def make_gradebook(n_grades,n_categories=4):
+    """Builds a Gradebook with n_grades Grades spread over n_categories."""
+    gb = grading.Gradebook('Course','student')
+    cats = []
+    for c in range(n_categories):
+        cat = grading.Category('cat-%d'%c,controls_maximum=True,grade_maximum=10)
+        gb.add_category(cat)
+        cats.append(cat)
+    for i in range(n_grades):
+        gr = grading.Grade('grade-%d'%i,score=i%11)
+        cats[i%n_categories].grades.add_grades(gr)
+    return gb
+
+
+def bench_lookup(sizes=(10,100,1000,10000),number=10000):
+    """Name lookups on a Category gradelist and on the whole Gradebook."""
+    print 'lookup by name (usec/call)'
+    print '{:>8} {:>12} {:>12} {:>12}'.format('grades','cat.get','book.get','book.in')
+    for n in sizes:
+        gb = make_gradebook(n)
+        name = 'grade-%d'%(n-1)
+        cat = gb.get_category('cat-%d'%((n-1)%4))
+        res = []
+        for fn in (lambda: cat.grades.get_grade(name),
+                   lambda: gb.get_grade(name),
+                   lambda: name in gb):
+            res.append(1e6*min(timeit.repeat(fn,number=number,repeat=3))/number)
+        print '{:>8} {:>12.3f} {:>12.3f} {:>12.3f}'.format(n,*res)
+
+
+def bench_stats(sizes=(10,100,1000,10000),number=20):
+    """Uncached get_stat('points') with the object path and NumPy columns."""
+    print 'get_stat points, weighted+counted, cache cleared (usec/call)'
+    print '{:>8} {:>12} {:>12}'.format('grades','objects','columnar')
+    for n in sizes:
+        gb = make_gradebook(n,1)
+        cat = gb.get_category('cat-0')
+        cat.use_best_count = True
+        cat.element_count = -1
+        res = []
+        default = grading.COLUMNAR
+        for columnar in (False,True):
+            grading.COLUMNAR = columnar
+            def fn():
+                cat.grades._invalidate()
+                cat.grades.get_stat('points',weighted=True,counted=True)
+            res.append(1e6*min(timeit.repeat(fn,number=number,repeat=3))/number)
+        grading.COLUMNAR = default
+        print '{:>8} {:>12.1f} {:>12.1f}'.format(n,*res)
+
+
+def bench_select(sizes=(100,1000,10000),number=50):
+    """A narrow range select, compiled once, on a single Category."""
+    print 'select GTEscore=10 with a reused Query (usec/call)'
+    print '{:>8} {:>12}'.format('grades','select')
+    query = grading.Query(GTEscore=10)
+    for n in sizes:
+        gb = make_gradebook(n,1)
+        fn = lambda: gb.select(query=query)
+        print '{:>8} {:>12.1f}'.format(n,
+                    1e6*min(timeit.repeat(fn,number=number,repeat=3))/number)
+
+
+def bench_attributes(number=200000):
+    """Grade.getWeight/getMaximum through a controlling Category."""
+    cat = grading.Category('c',controls_weight=True,grade_weight=2,
+                           controls_maximum=True,grade_maximum=10)
+    gr = grading.Grade('g',score=5)
+    cat.grades.add_grades(gr)
+    print 'attribute resolution (calls/sec)'
+    for label,fn in (('getWeight',gr.getWeight),('getMaximum',gr.getMaximum),
+                     ('cat.grade_maximum',lambda: cat.grade_maximum)):
+        best = min(timeit.repeat(fn,number=number,repeat=3))
+        print '{:>20} {:>12,.0f}'.format(label,number/best)
+
+
+def bench_memory(n=200000):
+    """Resident memory per Grade, from the growth of peak RSS."""
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    grades = [grading.Grade('grade-%d'%i,score=i%11,maximum=10,
+                            timestamp=1500000000+i) for i in xrange(n)]
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print 'memory: {} Grades, ~{:.0f} bytes each (incl. name and score)'.format(
+                n,1024.0*(after-before)/n)
+    return grades
+
+
+#Full suite: synthetic courses and machine-readable results
+
+def make_course(n_grades,n_categories=4,seed=0,user='student'):
+    """Builds a Gradebook resembling a real course.
+    
+    Categories alternate between controlling weight/maximum and leaving
+    them to each Grade, and the last one uses a best-N count. Grades get
+    mixed int/float scores (a few unscored), timestamps and an 'lms_id'
+    identifier (every tenth also has a 'section').
+    """
+    rnd = random.Random(seed)
+    gb = grading.Gradebook('Course',user)
+    cats = []
+    for c in range(n_categories):
+        kw = {'cat_weight':1.0/n_categories}
+        if c%2:
+            kw.update(controls_weight=True,grade_weight=1,
+                      controls_maximum=True,grade_maximum=10)
+        if c == n_categories-1:
+            kw.update(use_best_count=True,element_count=-1)
+        cat = grading.Category('cat-%d'%c,**kw)
+        gb.add_category(cat)
+        cats.append(cat)
+    per_cat = [[] for c in cats]
+    for i in xrange(n_grades):
+        per_cat[i%n_categories].append(make_grade(i,rnd))
+    for cat,grades in zip(cats,per_cat):
+        cat.grades.add_grades_bulk(grades)
+    return gb
+
+def make_grade(i,rnd):
+    """One synthetic Grade, as used by make_course."""
+    maximum = rnd.choice((10,20,100))
+    score = None
+    if rnd.random() > 0.05:
+        score = rnd.randint(0,maximum) if i%3 else round(rnd.uniform(0,maximum),2)
+    identifiers = {'lms_id':'lms-%d'%i}
+    if not i%10:
+        identifiers['section'] = 'sec-%d'%(i%7)
+    return grading.Grade('grade-%d'%i,score=score,maximum=maximum,
+                         weight=rnd.choice((1,1,2)),timestamp=1500000000+60*i,
+                         identifiers=identifiers)
+
+def make_courses(n_books,n_grades,n_categories=4,seed=0):
+    """Yields n_books courses of n_grades Grades, one per student."""
+    for b in xrange(n_books):
+        yield make_course(n_grades,n_categories,seed+b,'student-%d'%b)
+
+def _best(fn,number,repeat=3,setup=None):
+    """Best usec per call of fn() (or fn(setup()) with setup untimed)."""
+    best = None
+    for r in range(repeat):
+        if setup is None:
+            t = min(timeit.repeat(fn,number=number,repeat=1))
+        else:
+            t = 0
+            for n in range(number):
+                arg = setup()
+                start = time.time()
+                fn(arg)
+                t += time.time()-start
+        if best is None or t < best:
+            best = t
+    return 1e6*best/number
+
+def _invalidate_all(gb):
+    for cat in gb._Gradebook__categories.values():
+        cat.grades._invalidate()
+
+def _suite_course(n,results):
+    """Benchmarks on a single course of n Grades."""
+    number = max(1,min(1000,20000//n))
+    rnd = random.Random(n)
+    record = lambda bench,usec,**extra: results.append(
+                    dict(benchmark=bench,grades=n,usec=usec,**extra))
+    
+    record('Grade()',_best(lambda: make_grade(n,rnd),1000),per='grade')
+    grades = lambda: [grading.Grade('g-%d'%i,score=i%11) for i in xrange(n)]
+    def add_grades(grs):
+        grading.Category('c').grades.add_grades(*grs)
+    record('add_grades',_best(add_grades,3,setup=grades)/n,per='grade')
+    def add_grade(grs):
+        gb = grading.Gradebook('b','u')
+        gb.add_category(grading.Category('c'))
+        for gr in grs:
+            gb.add_grade('c',gr)
+    record('Gradebook.add_grade',_best(add_grade,3,setup=grades)/n,per='grade')
+    
+    gb = make_course(n)
+    cat = gb.get_category('cat-3')
+    hit,miss = 'grade-%d'%(n-1),'nothing'
+    record('Gradebook.__contains__',_best(lambda: hit in gb,10000),case='hit')
+    record('Gradebook.__contains__',_best(lambda: miss in gb,10000),case='miss')
+    
+    for stat in ('elements','score','maximum','points','weights'):
+        for weighted in (False,True):
+            for counted in (False,True):
+                def fn():
+                    cat.grades._invalidate()
+                    cat.grades.get_stat(stat,weighted=weighted,counted=counted)
+                record('get_stat',_best(fn,number),stat=stat,
+                       weighted=weighted,counted=counted)
+    for stat in ('score','maximum','percent'):
+        def fn():
+            _invalidate_all(gb)
+            gb.get_weighted_stat(stat)
+        record('get_weighted_stat',_best(fn,number),stat=stat,cache='cold')
+        record('get_weighted_stat',_best(lambda: gb.get_weighted_stat(stat),
+                    10000),stat=stat,cache='warm')
+    
+    for kw in ({'score':7},{'Nscore':7},{'GTscore':8},{'LTscore':2},
+               {'GTEscore':9},{'LTEscore':1},{'BTWNscore':(3,5)},
+               {'INidentifiers':'section'},{'NINidentifiers':'section'}):
+        query = grading.Query(**kw)
+        record('select',_best(lambda: gb.select(query=query),number),
+               query=kw.keys()[0])
+    record('identifier_select',_best(lambda: gb.identifier_select(
+                lms_id='lms-%d'%(n//2)),10000),case='unique')
+    record('identifier_select',_best(lambda: gb.identifier_select(
+                section='sec-3'),number),case='shared')
+    
+    out = StringIO()
+    grading.json_export(out,gb)
+    text = out.getvalue()
+    record('json_export',_best(lambda: grading.json_export(StringIO(),gb),
+                max(1,number//10))/n,per='grade')
+    record('json_import',_best(lambda: grading.json_import(StringIO(text),
+                inherit=True),max(1,number//10))/n,per='grade')
+
+def _suite_books(n_books,n_grades,results):
+    """Benchmarks over n_books courses of n_grades Grades each."""
+    record = lambda bench,usec,**extra: results.append(dict(benchmark=bench,
+                    gradebooks=n_books,grades=n_grades,usec=usec,**extra))
+    start = time.time()
+    books = list(make_courses(n_books,n_grades))
+    record('make_courses',1e6*(time.time()-start)/n_books,per='gradebook')
+    out = StringIO()
+    record('json_iterexport',_best(lambda: grading.json_iterexport(
+                StringIO(),books),1,repeat=1)/n_books,per='gradebook')
+    grading.json_iterexport(out,books)
+    text = out.getvalue()
+    record('json_iterimport',_best(lambda: list(grading.json_iterimport(
+                StringIO(text),inherit=True)),1,repeat=1)/n_books,
+           per='gradebook')
+    roster = grading.Roster('term',*books)
+    record('Roster.get_stat',_best(lambda: list(roster.get_stat('percent',
+                processes=1)),1,repeat=1)/n_books,per='gradebook',
+           processes=1)
+
+def run_suite(grade_sizes=(10,1000,100000),book_counts=(1,1000),
+              book_grades=40):
+    """Runs the full suite and returns a list of result dicts.
+    
+    Each result names its benchmark, the scale (grades and, for multi-
+    course benchmarks, gradebooks) and the best time in usec, per call
+    unless it has a 'per' key.
+    """
+    results = []
+    for n in grade_sizes:
+        _suite_course(n,results)
+    for b in book_counts:
+        _suite_books(b,book_grades,results)
+    return results
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git','rev-parse','HEAD'],
+                    stderr=subprocess.STDOUT).strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def write_results(results,output):
+    """Writes suite results, with the environment they ran in, as JSON."""
+    doc = {'revision':_git_revision(),
+           'time':time.strftime('%Y-%m-%dT%H:%M:%SZ',time.gmtime()),
+           'python':platform.python_version(),
+           'platform':platform.platform(),
+           'numpy':getattr(grading.numpy,'__version__',None),
+           'results':results}
+    json.dump(doc,output,indent=1,sort_keys=True)
+    output.write('\n')
+
+
+def _sizes(arg):
+    return tuple(int(x) for x in arg.split(',') if x)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--suite',action='store_true',
+                        help='run the full suite instead of the tables')
+    parser.add_argument('-o','--output',type=argparse.FileType('w'),
+                        default=sys.stdout,help='suite results file (JSON)')
+    parser.add_argument('--grades',type=_sizes,default=(10,1000,100000),
+                        help='course sizes, e.g. 10,1000,100000')
+    parser.add_argument('--books',type=_sizes,default=(1,1000),
+                        help='gradebook counts, e.g. 1,1000,50000')
+    parser.add_argument('--book-grades',type=int,default=40,
+                        help='grades per gradebook for --books')
+    args = parser.parse_args()
+    if args.suite:
+        write_results(run_suite(args.grades,args.books,args.book_grades),
+                      args.output)
+    else:
+        bench_lookup()
+        bench_stats()
+        bench_select()
+        bench_attributes()
+        bench_memory()
@@ -1,9 +1,19 @@
 #!/usr/bin/env python
 
-import datetime,numbers,warnings,re,copy,weakref,os,calendar
+import datetime,numbers,warnings,re,copy,weakref,os,calendar,heapq,operator
+import collections,itertools,bisect,struct,timeit,sys
+
+try:
+    import numpy
+except ImportError: #columnar statistics are optional
+    numpy = None
 
 
 DEBUG=False
+#use NumPy-backed columns for gradelist statistics when NumPy is available.
+#Off by default: building the columns costs more than the object path saves
+#at every size benchmarks.bench_stats measures (10 to 10000 Grades).
+COLUMNAR=False
 
 def dbg(*args):
     if not DEBUG: return
@@ -12,22 +22,386 @@ def dbg(*args):
         print i,
     print ""
 
+#set while instrumentation is enabled; guards the item counters
+_INSTRUMENTING=False
+
+class Instrumentation(object):
+    """Call counters, cumulative wall time and item counts for the public
+    entry points (see ENTRY_POINTS), plus user hooks.
+    
+    Use the module's `instrumentation` instance:
+        instrumentation.add_hook(lambda name,seconds: log(name,seconds))
+        instrumentation.enable()
+        ...
+        print instrumentation.report()
+    enable() swaps timing wrappers into the classes and module, and
+    disable() puts the original functions back, so a disabled
+    instrumentation costs nothing beyond a flag test where items are
+    counted. Other names bound to an entry point in the same class or
+    module (e.g. _gradelist_for_Category.add, an alias of add_grades) get
+    the same wrapper and count under the entry point's name. Names copied
+    elsewhere before enable() (`from grading import json_import`, or a
+    saved bound method) still refer to the original function and aren't
+    counted; call through the module (grading.json_import) instead.
+    Times are inclusive (a Gradebook.select also counts its Query.select
+    calls); generators are timed across their iteration.
+    Hooks are called as hook(name,seconds) after every instrumented call.
+    """
+    ENTRY_POINTS = ('Grade.getWeight','Grade.getMaximum','Grade.getPercent',
+                    'Grade.snapshot',
+                    '_gradelist_for_Category.add_grades',
+                    '_gradelist_for_Category.add_grades_bulk',
+                    '_gradelist_for_Category.remove_grades',
+                    '_gradelist_for_Category.get_grade',
+                    '_gradelist_for_Category.get_stat',
+                    '_gradelist_for_Category.select',
+                    '_gradelist_for_Category.identifier_select',
+                    'Query.select',
+                    'Gradebook.__contains__','Gradebook.get_grade',
+                    'Gradebook.add_grade','Gradebook.add_grades_bulk',
+                    'Gradebook.update_scores','Gradebook.project',
+                    'Gradebook.required_score','RosterStats.add_gradebook',
+                    'RosterStats.update_gradebook',
+                    'Gradebook.get_weighted_stat','Gradebook.select',
+                    'Gradebook.identifier_select',
+                    'Gradebook.timestamp_select','Roster.get_stat',
+                    'json_import','json_export','json_iterimport',
+                    'json_iterexport','json_iterimport_files',
+                    'csv_iterimport','csv_export',
+                    'snapshot_export','snapshot_open','SQLiteStore.save',
+                    'StoredGradebook.select','StoredGradebook.identifier_select',
+                    'StoredGradebook.get_weighted_stat','Journal.record',
+                    'Journal.compact','journal_replay')
+    
+    def __init__(self):
+        object.__init__(self)
+        self.hooks = []
+        self._originals = {}
+        self.reset()
+    
+    enabled = property(lambda self: bool(self._originals))
+    
+    def reset(self):
+        """Zeroes all counters."""
+        self.calls = collections.defaultdict(int)
+        self.seconds = collections.defaultdict(float)
+        self.items = collections.defaultdict(int)
+    
+    def add_hook(self,hook):
+        self.hooks.append(hook)
+    
+    def remove_hook(self,hook):
+        self.hooks.remove(hook)
+    
+    def count(self,item,n=1):
+        """Adds n to an item counter (e.g. 'grades_scanned')."""
+        self.items[item] += n
+    
+    def report(self):
+        """The counters as a plain dict: {'calls':{name:n},
+        'seconds':{name:s},'items':{item:n}}."""
+        return {'calls':dict(self.calls),'seconds':dict(self.seconds),
+                'items':dict(self.items)}
+    
+    def enable(self):
+        global _INSTRUMENTING
+        if self._originals:
+            return
+        import inspect
+        for name in self.ENTRY_POINTS:
+            owner,attr = self._resolve(name)
+            orig = owner.__dict__[attr]
+            #the entry point and its aliases in the same class or module
+            attrs = [alias for alias,value in vars(owner).items()
+                     if value is orig]
+            self._originals[name] = (orig,owner,attrs)
+            if inspect.isgeneratorfunction(orig):
+                wrapper = self._wrap_generator(name,orig)
+            else:
+                wrapper = self._wrap(name,orig)
+            for alias in attrs:
+                setattr(owner,alias,wrapper)
+        _INSTRUMENTING = True
+    
+    def disable(self):
+        global _INSTRUMENTING
+        _INSTRUMENTING = False
+        for orig,owner,attrs in self._originals.values():
+            for alias in attrs:
+                setattr(owner,alias,orig)
+        self._originals = {}
+    
+    @staticmethod
+    def _resolve(name):
+        if '.' not in name:
+            return sys.modules[__name__],name
+        cls,attr = name.split('.')
+        return globals()[cls],attr
+    
+    def _record(self,name,start):
+        elapsed = _timer()-start
+        self.calls[name] += 1
+        self.seconds[name] += elapsed
+        for hook in self.hooks:
+            hook(name,elapsed)
+    
+    def _wrap(self,name,func):
+        def wrapper(*args,**kwargs):
+            start = _timer()
+            try:
+                return func(*args,**kwargs)
+            finally:
+                self._record(name,start)
+        wrapper.__name__,wrapper.__doc__ = func.__name__,func.__doc__
+        return wrapper
+    
+    def _wrap_generator(self,name,func):
+        def wrapper(*args,**kwargs):
+            start = _timer()
+            gen = func(*args,**kwargs)
+            elapsed = _timer()-start
+            try:
+                while True:
+                    start = _timer()
+                    try:
+                        item = next(gen)
+                    finally:
+                        elapsed += _timer()-start
+                    yield item
+            finally:
+                self._record(name,_timer()-elapsed)
+        wrapper.__name__,wrapper.__doc__ = func.__name__,func.__doc__
+        return wrapper
+
+_timer = timeit.default_timer
+instrumentation = Instrumentation()
+
 def list_to_str(listy,spaces=' ',combiner=',',conjunction='and'):
     if not listy:
         return ''
     if not spaces: spaces=''
     if not combiner: combiner=''
     if not conjunction: conjunction=''
-    if len(listy)>2:
+    ret = ''
+    if len(listy)>=2:
         if len(listy)==2:
-            ret += listy[0]+spaces
+            ret += '{0}{1}'.format(listy[0],spaces)
         else:
             for e in listy[:-1]:
                 ret += '{0}{1}{2}'.format(e,combiner,spaces)
-        ret += '{0}{1}'.format(conjunciton,spaces)
+        ret += '{0}{1}'.format(conjunction,spaces)
     ret+='{}'.format(listy[-1])
     return ret
 
+def _best_of(pairs,count):
+    """Trims a list of (grade,value) pairs to the best `count` by value.
+    
+    Ties keep list order, matching a stable descending sort followed by
+    pairs[0:count], but only a heap of min(count,-count) items is kept, so
+    this costs O(n log k). Negative counts drop the lowest -count pairs.
+    The order of the returned pairs is unspecified. count=None keeps all.
+    """
+    if count is None:
+        return pairs
+    if count >= 0:
+        return heapq.nlargest(count,pairs,key=operator.itemgetter(1))
+    #the pairs a stable descending sort would put last
+    dropped = heapq.nsmallest(-count,xrange(len(pairs)),
+                              key=lambda i: (pairs[i][1],-i))
+    dropped = set(dropped)
+    return [p for i,p in enumerate(pairs) if i not in dropped]
+
+def _stat_value(score,maximum,weight,weighted):
+    """The value Grades are ranked by for best-count (None if unscored)."""
+    val=None
+    if score is not None:
+        val=score
+        if maximum:
+            val/=1.0*maximum
+        if weight and weighted:
+            val*=weight
+    return val
+
+def _stat_of(rows,stat,weighted,count):
+    """Computes stat (1-4, as in _gradelist_for_Category._compute_stat)
+    from (score,maximum,weight,extra_credit) rows, keeping the best
+    `count` of them (see _best_of)."""
+    listy = [(row,_stat_value(row[0],row[1],row[2],weighted)) for row in rows]
+    listy = _best_of(listy,count)
+    
+    #building current score, maximum, points, and weight
+    curScore = 0
+    curMax = 0
+    curPoints = 0
+    curWeight = 0
+    for (scr,mx,wgt,xtra),val in listy:
+        if scr is None:
+            continue
+        if wgt and weighted:
+            scr=scr*wgt
+        if mx:
+            if weighted:
+                curMax += mx*wgt
+            else: curMax += mx
+            curPoints+= 1.0*scr/mx
+        else:
+            curPoints+= scr
+        if not xtra:
+            curWeight+=wgt
+        curScore += scr
+    
+    if stat is 1:
+        return curScore
+    if stat is 2:
+        return curMax
+    if stat is 3:
+        if curMax:
+            return 1.0*curPoints
+        return None
+    if stat is 4:
+        return curWeight
+
+class _Identifiers(dict):
+    """A Grade's identifiers dict (what Grade.identifiers returns).
+    
+    Edits made in place are applied through the Grade's gradelist, which
+    keeps the gradelist's and Gradebook's identifier indexes current.
+    Copies, deep copies and pickles are plain dicts.
+    """
+    __slots__ = ('_grade',)
+    
+    def __init__(self,grade,items=()):
+        dict.__init__(self,items)
+        self._grade = weakref.ref(grade)
+    
+    def _edit(self,method,*args):
+        gr = self._grade()
+        if gr is None or gr._identifiers is not self:
+            return method(self,*args)
+        return gr._edit_identifiers(lambda idents: method(idents,*args))
+    
+    def __setitem__(self,key,value):
+        self._edit(dict.__setitem__,key,value)
+    
+    def __delitem__(self,key):
+        self._edit(dict.__delitem__,key)
+    
+    def update(self,*args,**kwargs):
+        self._edit(lambda idents: dict.update(idents,*args,**kwargs))
+    
+    def pop(self,*args):
+        return self._edit(dict.pop,*args)
+    
+    def popitem(self):
+        return self._edit(dict.popitem)
+    
+    def setdefault(self,key,default=None):
+        return self._edit(dict.setdefault,key,default)
+    
+    def clear(self):
+        self._edit(dict.clear)
+    
+    def copy(self):
+        return dict(self)
+    
+    __copy__ = copy
+    
+    def __deepcopy__(self,memo):
+        return copy.deepcopy(dict(self),memo)
+    
+    def __reduce__(self):
+        return (dict,(dict(self),))
+
+def _plain_set(method):
+    """Wraps a set operation so _Overrides returns plain sets from it."""
+    def operation(self,*args):
+        result = method(self,*args)
+        if isinstance(result,set):
+            return set(result)
+        return result
+    return operation
+
+def _in_place(method):
+    """Wraps an augmented assignment (|= etc.) of set as an _Overrides edit."""
+    def operation(self,other):
+        if self._edit(method,other) is NotImplemented:
+            return NotImplemented
+        return self
+    return operation
+
+class _Overrides(set):
+    """A Grade's overrides set (what Grade.overrides returns).
+    
+    Edits made in place go through the Grade, which invalidates its
+    gradelist's aggregates and reports the change, as mod_overrides does.
+    Copies, results of set operations, deep copies and pickles are plain
+    sets.
+    """
+    __slots__ = ('_grade',)
+    
+    def __init__(self,grade,items=()):
+        set.__init__(self,items)
+        self._grade = weakref.ref(grade)
+    
+    def _edit(self,method,*args):
+        gr = self._grade()
+        if gr is None or gr._overrides is not self:
+            return method(self,*args)
+        return gr._edit_overrides(lambda ovrrds: method(ovrrds,*args))
+    
+    def add(self,elem):
+        self._edit(set.add,elem)
+    
+    def discard(self,elem):
+        self._edit(set.discard,elem)
+    
+    def remove(self,elem):
+        self._edit(set.remove,elem)
+    
+    def pop(self):
+        return self._edit(set.pop)
+    
+    def clear(self):
+        self._edit(set.clear)
+    
+    def update(self,*others):
+        self._edit(set.update,*others)
+    
+    def difference_update(self,*others):
+        self._edit(set.difference_update,*others)
+    
+    def intersection_update(self,*others):
+        self._edit(set.intersection_update,*others)
+    
+    def symmetric_difference_update(self,other):
+        self._edit(set.symmetric_difference_update,other)
+    
+    __ior__ = _in_place(set.__ior__)
+    __iand__ = _in_place(set.__iand__)
+    __isub__ = _in_place(set.__isub__)
+    __ixor__ = _in_place(set.__ixor__)
+    
+    copy = _plain_set(set.copy)
+    union = _plain_set(set.union)
+    intersection = _plain_set(set.intersection)
+    difference = _plain_set(set.difference)
+    symmetric_difference = _plain_set(set.symmetric_difference)
+    __or__ = __ror__ = _plain_set(set.__or__)
+    __and__ = __rand__ = _plain_set(set.__and__)
+    __xor__ = __rxor__ = _plain_set(set.__xor__)
+    __sub__ = _plain_set(set.__sub__)
+    __rsub__ = _plain_set(set.__rsub__)
+    __copy__ = copy
+    
+    def __repr__(self):
+        return repr(set(self))
+    
+    def __deepcopy__(self,memo):
+        return set(self)
+    
+    def __reduce__(self):
+        return (set,(list(self),))
+
 class Grade(object):
     """A single Grade for assignment/test/etc. 
     
@@ -66,50 +440,179 @@ class Grade(object):
                         attributes (strings) to protect from the parent 
                         Category that would (if configured as such) usually
                         do so.
-                        Changes made via Grade.mod_overrides function.
-        timestamp   For use by external resources. (datetime.datetime)
+                        Changes made via Grade.mod_overrides function or
+                        by editing the set in place update cached stats.
+        timestamp   For use by external resources. (datetime.datetime;
+                        numeric (epoch) timestamps are converted when
+                        first read.)
         identifiers Dictionary of values defined as needed. Useful for
                         attaching Grades to external resources.
+                        Changes made via Grade.mod_identifiers function,
+                        by assigning a new dict or by editing the dict
+                        in place keep identifier_select indexes current.
+    -
+    Grades use __slots__ to stay small: 'overrides' and 'identifiers' are
+    only allocated when first accessed (internal reads use the private
+    slots and treat None as empty), and timestamps are kept as given.
+    Copies (see snapshot) share those containers until either Grade's
+    are accessed through the public attributes.
     """
+    __slots__ = ('name','parent','score','maximum','weight','extra_credit',
+                 '_overrides','_identifiers','_timestamp','_shared','inited',
+                 '__weakref__')
+    #public attributes (e.g. for mod_overrides)
+    _ATTRIBUTES = frozenset(['name','parent','score','maximum','weight',
+                             'extra_credit','overrides','identifiers',
+                             'timestamp','inited'])
+    #attributes that feed Category/Gradebook aggregates
+    _AGGREGATED = frozenset(['score','maximum','weight','extra_credit'])
+    #attributes whose assignment is reported to Gradebook observers
+    _OBSERVED = _AGGREGATED|frozenset(['timestamp'])
+    
     def __init__(self,name,**kwargs):
         object.__init__(self)
+        object.__setattr__(self,'inited',False)
+        object.__setattr__(self,'_shared',False)
         self.name = name
         self.parent = kwargs.get('parent',None)
         self.score = kwargs.get('score',None)
         self.maximum = kwargs.get('maximum',None)
         self.weight = kwargs.get('weight',1)
-        self.overrides = kwargs.get('overrides',set())
-        if not isinstance(self.overrides,set):
-            if isinstance(self.overrides,list):
-                self.overrides = set(self.overrides)
-            else: self.overrides = set()
+        self.overrides = kwargs.get('overrides',None)
         self.timestamp = kwargs.get('timestamp',None)
-        if not isinstance(self.timestamp,datetime.datetime):
-            if not isinstance(self.timestamp,numbers.Real):
-                self.timestamp = None
-            else:
-                self.timestamp = datetime.datetime.utcfromtimestamp(self.timestamp)
-        self.identifiers = kwargs.get('identifiers',{})
+        self.identifiers = kwargs.get('identifiers',None)
         self.extra_credit = kwargs.get('extra_credit',False)
         
         self.inited=True
     
+    def _unshare(self):
+        """Gives this Grade its own copies of containers shared by snapshot."""
+        object.__setattr__(self,'_shared',False)
+        object.__setattr__(self,'_overrides',copy.deepcopy(self._overrides))
+        object.__setattr__(self,'_identifiers',copy.deepcopy(self._identifiers))
+    
+    def _get_overrides(self):
+        if self._shared:
+            self._unshare()
+        ovrrds = self._overrides
+        if type(ovrrds) is not _Overrides or ovrrds._grade() is not self:
+            ovrrds = _Overrides(self,ovrrds or ())
+            object.__setattr__(self,'_overrides',ovrrds)
+        return ovrrds
+    
+    def _set_overrides(self,value):
+        if self._shared:
+            self._unshare()
+        if not isinstance(value,set):
+            if isinstance(value,list) and value:
+                value = set(value)
+            else: value = None
+        object.__setattr__(self,'_overrides',value)
+    
+    overrides = property(_get_overrides,_set_overrides)
+    
+    def _get_identifiers(self):
+        if self._shared:
+            self._unshare()
+        idents = self._identifiers
+        if type(idents) is not _Identifiers or idents._grade() is not self:
+            idents = _Identifiers(self,idents or ())
+            object.__setattr__(self,'_identifiers',idents)
+        return idents
+    
+    def _set_identifiers(self,value):
+        if self._shared:
+            self._unshare()
+        object.__setattr__(self,'_identifiers',value)
+    
+    identifiers = property(_get_identifiers,_set_identifiers)
+    
+    def _get_timestamp(self):
+        if isinstance(self._timestamp,numbers.Real):
+            object.__setattr__(self,'_timestamp',
+                        datetime.datetime.utcfromtimestamp(self._timestamp))
+        return self._timestamp
+    
+    def _set_timestamp(self,value):
+        if not isinstance(value,(datetime.datetime,numbers.Real)):
+            value = None
+        object.__setattr__(self,'_timestamp',value)
+    
+    timestamp = property(_get_timestamp,_set_timestamp)
+    
+    def _timestamp_epoch(self):
+        """The timestamp as whole UTC epoch seconds (None if unset), without
+        converting a numeric timestamp to a datetime."""
+        tmstmp = self._timestamp
+        if isinstance(tmstmp,numbers.Integral):
+            return int(tmstmp)
+        if isinstance(tmstmp,numbers.Real):
+            tmstmp = datetime.datetime.utcfromtimestamp(tmstmp)
+        if isinstance(tmstmp,datetime.datetime):
+            return calendar.timegm(tmstmp.utctimetuple())
+        return None
+    
     def mod_overrides(self,remove=False,*args):
-        if type(remove) is not bool and remove in self.__dict__:
-            args.append(remove)
+        if type(remove) is not bool and remove in Grade._ATTRIBUTES:
+            args = (remove,)+args
             remove=False
-        for arg in args:
-            arg=str(arg.lower())
-            if arg not in self.__dict__:
-                err = '\'%s\' cannot be overridden because it is not an ' \
-                        'attribute.'%arg
-                raise KeyError(err)
-            if arg in ['parent','overrides']:
-                continue
-            if remove:
-                self.overrides.discard(arg)
-            else:
-                self.overrides.add(arg)
+        def edit(ovrrds):
+            for arg in args:
+                arg=str(arg.lower())
+                if arg not in Grade._ATTRIBUTES:
+                    err = '\'%s\' cannot be overridden because it is not an ' \
+                            'attribute.'%arg
+                    raise KeyError(err)
+                if arg in ['parent','overrides']:
+                    continue
+                if remove:
+                    set.discard(ovrrds,arg)
+                else:
+                    set.add(ovrrds,arg)
+        self._edit_overrides(edit)
+    
+    def _edit_overrides(self,edit):
+        """Applies edit(overrides set), then has the gradelist, if any,
+        invalidate its aggregates and report the change; returns what
+        edit returns."""
+        result = edit(self.overrides)
+        gradelist = self._gradelist()
+        if gradelist is not None:
+            gradelist._invalidate()
+            gradelist._notify('set',self.name,'overrides',set(self._overrides))
+        return result
+    
+    def _gradelist(self):
+        """The gradelist this Grade is a member of, or None. Snapshots
+        keep their original's parent, but aren't members of it, so their
+        changes don't reach its caches or observers."""
+        parent = self.parent
+        if isinstance(parent,Category) and \
+                    parent.grades._index.get(self.name) is self:
+            return parent.grades
+        return None
+    
+    def _edit_identifiers(self,edit):
+        """Applies edit(identifiers dict) through the gradelist, if any, so
+        its indexes stay current; returns what edit returns."""
+        gradelist = self._gradelist()
+        if gradelist is None:
+            return edit(self.identifiers)
+        result = []
+        gradelist._reindex_identifiers(self,
+                    edit=lambda idents: result.append(edit(idents)))
+        return result[0]
+    
+    def mod_identifiers(self,*remove,**kwargs):
+        """Sets identifiers from kwargs and deletes those named in remove.
+        
+        e.g. grade.mod_identifiers('old_id',submission_id=1234)
+        """
+        def edit(idents):
+            for key in remove:
+                dict.pop(idents,key,None)
+            dict.update(idents,kwargs)
+        self._edit_identifiers(edit)
     
     def __str__(self):
         stry = '{0}.{1}('.format(self.__module__,self.__class__.__name__)
@@ -153,17 +656,19 @@ class Grade(object):
         return stry
     
     def getWeight(self):
-        if self.parent and 'weight' not in self.overrides and \
-                    self.parent.controls_weight and self.\
-                    parent.get_grade_weight():
-            return self.parent.get_grade_weight()
+        parent = self.parent
+        if parent and not (self._overrides and 'weight' in self._overrides) and \
+                    parent.controls_weight:
+            wgt = parent.get_grade_weight()
+            if wgt:
+                return wgt
         return self.weight
     
     def getMaximum(self):
-        if self.parent and 'maximum' not in self.overrides and \
-                    hasattr(self.parent,'controls_maximum') and \
-                    self.parent.controls_maximum:
-            return self.parent.get_grade_maximum()
+        parent = self.parent
+        if parent and not (self._overrides and 'maximum' in self._overrides) and \
+                    getattr(parent,'controls_maximum',False):
+            return parent.get_grade_maximum()
         return self.maximum
     
     def getPercent(self):
@@ -174,23 +679,84 @@ class Grade(object):
         return None
     
     def __setattr__(self,name,value):
-        if name != 'overrides' or 'inited' not in self.__dict__:
+        if not self.inited:
             object.__setattr__(self,name,value)
+            return
+        if name == 'overrides':
+            return
+        gradelist = self._gradelist()
+        if name == 'name' and gradelist is not None:
+            gradelist._rename_grade(self,value)
+        if name == 'identifiers' and gradelist is not None:
+            gradelist._reindex_identifiers(self,replace=value)
+            return
+        object.__setattr__(self,name,value)
+        if name in Grade._OBSERVED and gradelist is not None:
+            if name in Grade._AGGREGATED:
+                gradelist._invalidate()
+            elif name == 'timestamp':
+                gradelist._invalidate_times()
+            gradelist._notify('set',self.name,name,value)
+    
+    def snapshot(self):
+        """A copy of this Grade with its weight and maximum resolved.
+        
+        The copy shares overrides and identifiers with this Grade until
+        either one reads or replaces them through the public attributes,
+        when that Grade takes its own (deep) copy. Used for docopy=True.
+        """
+        if _INSTRUMENTING:
+            instrumentation.count('grades_copied')
+        return self._shared_copy(self.parent,self.score,self.getMaximum(),
+                                 self.getWeight())
+    
+    def _shared_copy(self,parent,score,maximum,weight):
+        """A copy sharing overrides/identifiers, with the given values."""
+        shared = self._overrides is not None or self._identifiers is not None
+        if shared:
+            object.__setattr__(self,'_shared',True)
+        return Grade._from_slots(self.name,parent,score,maximum,weight,
+                                 self.extra_credit,self._timestamp,
+                                 self._overrides,self._identifiers,shared)
+    
+    @staticmethod
+    def _from_slots(name,parent,score,maximum,weight,extra_credit,timestamp,
+                    overrides,identifiers,shared=False):
+        """Builds a Grade from already-valid slot values, skipping the
+        checks of __init__ and __setattr__."""
+        gr = Grade.__new__(Grade)
+        setter = object.__setattr__
+        setter(gr,'inited',False)
+        setter(gr,'name',name)
+        setter(gr,'parent',parent)
+        setter(gr,'score',score)
+        setter(gr,'maximum',maximum)
+        setter(gr,'weight',weight)
+        setter(gr,'extra_credit',extra_credit)
+        setter(gr,'_timestamp',timestamp)
+        setter(gr,'_overrides',overrides)
+        setter(gr,'_identifiers',identifiers)
+        setter(gr,'_shared',shared)
+        setter(gr,'inited',True)
+        return gr
     
     def __deepcopy__(self,memo={}):
-        ma_dict = dict(self.__dict__)
-        ma_dict['overrides'] = copy.deepcopy(ma_dict['overrides'],memo)
-        ma_dict['identifiers']=copy.deepcopy(ma_dict['identifiers'],memo)
-        name=copy.deepcopy(ma_dict.pop('name'))
-        ma_dict['weight']=self.getWeight()
-        ma_dict['maximum']=self.getMaximum()
-        copeh = Grade(name,**ma_dict)
-        return copeh
+        return self.snapshot()
+    
+    def __reduce__(self):
+        #pickled as its snapshot, without the parent (e.g. for results
+        #sent back from process pools)
+        identifiers = self._identifiers
+        if identifiers is not None:
+            identifiers = dict(identifiers)
+        return (_restore_grade,(self.name,self.score,self.getMaximum(),
+                        self.getWeight(),self.extra_credit,self._timestamp,
+                        self._overrides,identifiers))
     
     def __eq__(self,other):
         if not isinstance(other,Grade):
             return False
-        for i in ['name','score','overrides','identifiers']:
+        for i in ['name','score','_overrides','_identifiers']:
             x = object.__getattribute__(self,i)
             y = object.__getattribute__(other,i)
             if not (x == y or (x!=0 and y!=0 and not x and not y)):
@@ -202,92 +768,404 @@ class Grade(object):
         return True
     
     def compare(self,op,key,VALUE):
-        attr=None
-        if key in ['weight','maximum','percent']:
-            if key == 'weight':  attr=self.getWeight()
-            if key == 'maximum': attr=self.getMaximum()
-            if key == 'percent': attr=self.getPercent()
-        else:
-            try:
-                attr = object.__getattribute__(self,key)
-            except AttributeError:
-                return False
-        
-        attr_type = type(attr)
-        val_type = type(VALUE)
-        if key == 'overrides' and val_type is list:
-            VALUE = set(VALUE)
-            val_type = set
-        if op in ['GT','GTE','LT','LTE']:
-            if (attr_type is None)^(val_type is None): pass
-            elif (attr_type is set)^(val_type is set): return False
-            elif (attr_type is dict)^(val_type is dict): return False
-            
-        if not op:
-            if not attr and not VALUE:
-                return True
-            return (attr is VALUE or attr==VALUE)
-        elif op=='N':
-            if bool(attr)^bool(VALUE):
-                return True
-            return not (attr is VALUE or attr==VALUE)
-        elif op=='GT':
-            if attr > VALUE:
-                return True
-        elif op=='GTE':
-            if not attr and not VALUE:
-                return True
-            if attr >= VALUE:
-                return True
-        elif op=='LT':
-            if attr < VALUE:
-                return True
-        elif op=='LTE':
-            if not attr and not VALUE:
-                return True
-            if attr <= VALUE:
-                return True
-        elif op=='BTWN':
-            if val_type is not tuple or len(val_type) < 2:
-                return False
-            if VALUE[0] < attr < VALUE[1]:
+        """Tests one select() predicate, e.g. compare('GT','score',12)."""
+        return _compile_predicate(op,key,VALUE)(self)
+
+def _restore_grade(name,*values):
+    """Unpickles a Grade from the state built by Grade.__reduce__."""
+    return Grade._from_slots(name,None,*values)
+
+#grammar of select() keywords, e.g. 'GTEscore' -> ('GTE','score')
+_SELECT_KEYWORD = re.compile('^(?P<op>[A-Z]+)?(?P<attr>[a-z_]+)$')
+_SELECT_OPS = [None,'N','GT','LT','GTE','LTE','BTWN','IN','NIN']
+#attributes resolved through Grade methods rather than read directly
+#(looked up on each call, so instrumentation's wrappers are seen)
+_GRADE_GETTERS = {'weight':  lambda gr: gr.getWeight(),
+                  'maximum': lambda gr: gr.getMaximum(),
+                  'percent': lambda gr: gr.getPercent(),
+                  #the raw slots, since the properties unshare snapshot copies
+                  'identifiers': lambda gr: gr._identifiers or {},
+                  'overrides': lambda gr: gr._overrides or set()}
+#attributes that gradelists keep sorted indexes of for range predicates
+_RANGE_INDEXED = frozenset(['score','maximum','percent'])
+
+def _compile_predicate(op,key,VALUE):
+    """Returns a function(grade) that tests one select() predicate.
+    
+    The op string is dispatched once here instead of on every Grade.
+    """
+    if key in _GRADE_GETTERS:
+        getter = _GRADE_GETTERS[key]
+    elif key == 'timestamp':
+        #epoch seconds, leaving numeric timestamps unconverted
+        getter = lambda gr: _timestamp_key(gr._timestamp)
+        VALUE = _timestamp_key(VALUE)
+    else:
+        getter = lambda gr: object.__getattribute__(gr,key)
+    val_type = type(VALUE)
+    if key == 'overrides' and val_type is list:
+        VALUE = set(VALUE)
+        val_type = set
+    
+    if not op:
+        test = lambda attr: (not attr and not VALUE) or attr is VALUE or \
+                            attr==VALUE
+    elif op=='N':
+        test = lambda attr: bool(bool(attr)^bool(VALUE)) or \
+                            not (attr is VALUE or attr==VALUE)
+    elif op in ['GT','GTE','LT','LTE']:
+        compar = {'GT':operator.gt,'GTE':operator.ge,
+                  'LT':operator.lt,'LTE':operator.le}[op]
+        falsy_ok = op in ['GTE','LTE'] and not VALUE
+        def test(attr):
+            if (type(attr) is set)^(val_type is set): return False
+            if isinstance(attr,dict)^(val_type is dict): return False
+            if falsy_ok and not attr:
                 return True
-        elif op in ['IN','NIN']:
+            return bool(compar(attr,VALUE))
+    elif op=='BTWN':
+        if val_type is not tuple or len(VALUE) < 2:
+            return lambda gr: False
+        low,high = VALUE[0],VALUE[1]
+        test = lambda attr: bool(low < attr < high)
+    elif op in ['IN','NIN']:
+        negate = op!='IN'
+        def test(attr):
             try:
-                if (op!='IN')^(VALUE in attr):
-                    return True
+                return bool(negate^(VALUE in attr))
             except:
                 return False
-        return False
+    else:
+        return lambda gr: False
+    if key == 'timestamp' and op in ['GT','GTE','LT','LTE','BTWN']:
+        #untimed Grades never match a range, as with the timestamp index
+        ranged = test
+        test = lambda attr: attr is not None and ranged(attr)
+    
+    def predicate(gr):
+        try:
+            attr = getter(gr)
+        except AttributeError:
+            return False
+        return test(attr)
+    return predicate
+
+class Query(object):
+    """A select() query, compiled once from its keyword arguments.
+    
+    Takes the keyword syntax of _gradelist_for_Category.select (e.g.
+    Query(GTEscore=5,INidentifiers='lms_id')) and can be reused with any
+    number of gradelists or Gradebooks:
+        q = Query(GTpercent=0.9)
+        gradebook.select(query=q)
+    Range predicates (GT/GTE/LT/LTE/BTWN) on score, maximum or percent with
+    numeric values, or on timestamp, are answered from each gradelist's
+    sorted indexes; the remaining predicates only test the Grades that
+    range selects.
+    """
+    def __init__(self,**kwargs):
+        object.__init__(self)
+        self.terms = []
+        self._predicates = []
+        self._ranged = []
+        for kw in kwargs:
+            reggy_res = _SELECT_KEYWORD.match(kw)
+            if not reggy_res:
+                raise ValueError,'Keyword in _gradelist[..].select invalid: %s'%kw
+            op = reggy_res.group('op')
+            attr = reggy_res.group('attr')
+            if op not in _SELECT_OPS:
+                raise ValueError,'%s is not a valid operator.\nOperators: %s'%(op,_SELECT_OPS)
+            VALUE = kwargs[kw]
+            self.terms.append( (op,attr,VALUE) )
+            self._predicates.append(_compile_predicate(op,attr,VALUE))
+            if attr in _RANGE_INDEXED and _range_bounds(op,VALUE):
+                self._add_range(attr,op,VALUE)
+            elif attr == 'timestamp' and _range_bounds(op,
+                        _timestamp_key(VALUE),float):
+                self._add_range(attr,op,_timestamp_key(VALUE))
+    
+    def _add_range(self,attr,op,VALUE):
+        #terms on the same attribute share one bisected slice of its index
+        for attr_,terms in self._ranged:
+            if attr_ == attr:
+                terms.append( (op,VALUE) )
+                return
+        self._ranged.append( (attr,[(op,VALUE)]) )
+    
+    def matches(self,grade):
+        for pred in self._predicates:
+            if not pred(grade):
+                return False
+        return True
+    
+    def select(self,gradelist):
+        """Returns the set of Grades in gradelist matching the query."""
+        candidates = gradelist._grades
+        for attr,terms in self._ranged:
+            ranged = gradelist._range_select(attr,*terms)
+            if len(ranged) < len(candidates):
+                candidates = ranged
+        if _INSTRUMENTING:
+            instrumentation.count('grades_scanned',len(candidates))
+        return set(gr for gr in candidates if self.matches(gr))
+
+def _range_bounds(op,VALUE,kind=numbers.Real):
+    """Returns the (low,high) bisect functions for an index-backed range
+    predicate, or None if the predicate can't be answered by an index."""
+    real = lambda v: isinstance(v,kind) and v == v
+    if op in ['GT','GTE','LT','LTE'] and real(VALUE):
+        return {'GT': ((bisect.bisect_right,VALUE),None),
+                'GTE':((bisect.bisect_left,VALUE),None),
+                'LT': (None,(bisect.bisect_left,VALUE)),
+                'LTE':(None,(bisect.bisect_right,VALUE))}[op]
+    if op == 'BTWN' and type(VALUE) is tuple and len(VALUE) >= 2 and \
+                real(VALUE[0]) and real(VALUE[1]):
+        return ((bisect.bisect_right,VALUE[0]),(bisect.bisect_left,VALUE[1]))
+    return None
+
+def _range_slice(keys,terms,kind=numbers.Real):
+    """The (start,end) slice of sorted keys matching every (op,VALUE)."""
+    start,end = 0,len(keys)
+    for op,VALUE in terms:
+        low,high = _range_bounds(op,VALUE,kind)
+        if low:
+            start = max(start,low[0](keys,low[1]))
+        if high:
+            end = min(end,high[0](keys,high[1]))
+    return start,end
+
+def _timestamp_key(value):
+    """A timestamp, window bound or select() VALUE as float UTC epoch
+    seconds, the way Grade.timestamp reads numbers. Tuples (for BTWN) are
+    converted element-wise; anything else is returned unchanged."""
+    if isinstance(value,tuple):
+        return tuple(_timestamp_key(v) for v in value)
+    if isinstance(value,datetime.datetime):
+        return calendar.timegm(value.utctimetuple())+value.microsecond/1e6
+    if isinstance(value,numbers.Real) and not isinstance(value,bool):
+        return float(value)
+    return value
+
+def _time_index(grades):
+    """([epoch seconds],[Grade]) of the timestamped Grades, in time order.
+    
+    Keys are read from the stored timestamps, so numeric ones are left
+    unconverted (see Grade.timestamp).
+    """
+    pairs = []
+    for gr in grades:
+        tmstmp = gr._timestamp
+        if tmstmp is not None:
+            pairs.append( (_timestamp_key(tmstmp),gr) )
+    pairs.sort(key=operator.itemgetter(0))
+    return [p[0] for p in pairs],[p[1] for p in pairs]
+
+def _time_window(index,start,end):
+    """Grades of a _time_index with start <= timestamp < end."""
+    keys,grades = index
+    first = 0 if start is None else \
+                bisect.bisect_left(keys,_timestamp_key(start))
+    last = len(keys) if end is None else \
+                bisect.bisect_left(keys,_timestamp_key(end))
+    return grades[first:last]
+
+def _index_identifiers(index,loose,gr,container=set):
+    """Adds gr to an inverted index of (identifier key,value) -> Grades.
+    
+    Grades with unhashable identifier values go in `loose` instead, and
+    are always treated as candidates by _identifier_matches.
+    """
+    for key,val in (gr._identifiers or {}).iteritems():
+        try:
+            index.setdefault((key,val),container()).add(gr)
+        except TypeError:
+            loose.add(gr)
+
+def _unindex_identifiers(index,loose,gr):
+    loose.discard(gr)
+    for key,val in (gr._identifiers or {}).iteritems():
+        try:
+            grs = index.get((key,val))
+        except TypeError:
+            continue
+        if grs is not None:
+            grs.discard(gr)
+            if not grs:
+                del index[(key,val)]
+
+def _identifier_matches(index,loose,everything,kwargs):
+    """Grades whose identifiers match all of kwargs, via set intersection.
+    
+    Candidates are re-checked against the Grade's identifiers, so entries
+    left stale by in-place edits of a Grade's identifiers are dropped.
+    """
+    try:
+        sets = sorted([index.get((kw,kwargs[kw]),()) for kw in kwargs],key=len)
+    except TypeError: #unhashable value, has to be a scan
+        candidates = everything
+    else:
+        candidates = [gr for gr in sets[0] if all(gr in x for x in sets[1:])]
+        candidates.extend(loose)
+    found = set()
+    for gr in candidates:
+        if not isinstance(gr,Grade):
+            continue
+        idents = gr._identifiers or {}
+        for kw in kwargs:
+            if not (kw in idents and idents[kw]==kwargs[kw]):
+                break
+        else:
+            found.add(gr)
+    return found
+
+#largest integer every double can hold exactly
+_EXACT_INT = 2**53
+
+class _ScoreColumns(object):
+    """NumPy columns of a gradelist's scores, maxima, weights and flags.
+    
+    Built from the gradelist's current iteration order, so that sums are
+    accumulated in the same order (with sequential cumsums) as the object
+    path in _gradelist_for_Category._compute_stat, and results match it
+    exactly: a sum is returned as an int when every value it adds is an
+    integer, as it would be in Python. build() returns None if a value
+    isn't a plain real number (or None score/maximum), or is an integer
+    too large for a double to hold exactly, in which case the object path
+    must be used.
+    """
+    def __init__(self,grades,score,has_score,maximum,weight,extra,integral):
+        self.grades = grades
+        self.score = score
+        self.has_score = has_score
+        self.maximum = maximum
+        self.weight = weight
+        self.extra = extra
+        #(score,maximum,weight) columns of flags: value is an integer
+        self.integral = integral
+    
+    @classmethod
+    def build(cls,grades):
+        if numpy is None:
+            return None
+        grades = list(grades)
+        rows = []
+        for gr in grades:
+            scr,mx,wgt = gr.score,gr.getMaximum(),gr.getWeight()
+            if not (scr is None or isinstance(scr,numbers.Real)) or \
+                    not (mx is None or isinstance(mx,numbers.Real)) or \
+                    not isinstance(wgt,numbers.Real):
+                return None
+            ints = [isinstance(v,numbers.Integral) for v in (scr,mx,wgt)]
+            for v,is_int in zip((scr,mx,wgt),ints):
+                if is_int and abs(v) > _EXACT_INT:
+                    return None
+            rows.append((0.0 if scr is None else scr,scr is not None,
+                         mx or 0.0,wgt,bool(gr.extra_credit),
+                         ints[0],ints[1] or not mx,ints[2]))
+        if not rows:
+            rows = numpy.zeros((0,8))
+        cols = numpy.array(rows,dtype=float).reshape(-1,8).T
+        return cls(grades,cols[0],cols[1].astype(bool),cols[2],cols[3],
+                   cols[4].astype(bool),cols[5:8].astype(bool))
+    
+    def values(self,weighted):
+        """Per-grade ordering values (nan where there is no score)."""
+        val = numpy.where(self.maximum!=0,self.score/numpy.where(
+                          self.maximum!=0,self.maximum,1.0),self.score)
+        if weighted:
+            val = numpy.where(self.weight!=0,val*self.weight,val)
+        return numpy.where(self.has_score,val,numpy.nan)
+    
+    def stat(self,stat,weighted,count):
+        """Computes stat (1-4, as in _compute_stat) for the best `count`."""
+        rows = numpy.arange(len(self.grades))
+        if count is not None:
+            val = self.values(weighted)
+            val = numpy.where(numpy.isnan(val),-numpy.inf,val)
+            order = numpy.argsort(-val,kind='mergesort')
+            if count >= 0:
+                rows = order[0:count]
+            else:
+                rows = numpy.sort(order[0:count])
+        rows = rows[self.has_score[rows]]
+        scr,mx,wgt = self.score[rows],self.maximum[rows],self.weight[rows]
+        scr_int,mx_int,wgt_int = self.integral[:,rows]
+        if weighted:
+            scr = numpy.where(wgt!=0,scr*wgt,scr)
+            scr_int = scr_int & (wgt_int | (wgt==0))
+            mx_int = mx_int & (wgt_int | (mx==0))
+        def total(arr,ints):
+            #the sum as Python would have typed it (0 if nothing is added)
+            if not len(arr):
+                return 0
+            value = float(numpy.cumsum(arr)[-1])
+            return int(value) if ints.all() else value
+        if stat is 1:
+            return total(scr,scr_int)
+        if stat is 2:
+            return total(numpy.where(mx!=0,mx*wgt if weighted else mx,0.0),mx_int)
+        if stat is 3:
+            if not total(numpy.where(mx!=0,mx*wgt if weighted else mx,0.0),mx_int):
+                return None
+            pts = numpy.where(mx!=0,scr/numpy.where(mx!=0,mx,1.0),scr)
+            return 1.0*total(pts,scr_int & (mx==0))
+        if stat is 4:
+            extra = self.extra[rows]
+            return total(numpy.where(extra,0.0,wgt),wgt_int | extra)
 
 class _gradelist_for_Category(object):
     def __init__(self,parentCategory):
         object.__init__(self)
         self.parentCategory=parentCategory
         self._grades = set()
-        self.add_grade = self.add = self.add_grades
-        self.remove_grade = self.remove = self.remove_grades
+        self._index = {}
+        self._statcache = {}
+        self._columns = None
+        self._sortindex = {}
+        self._timeindex = None
+        self._identindex = {}
+        self._identloose = set()
     
     def add_grades(self,docopy=False,*grades):
         if type(docopy) is Grade:
             grades = [docopy]+list(grades)
             docopy=False
+        self.add_grades_bulk([gr for gr in grades if type(gr) is Grade],docopy)
+    
+    def add_grades_bulk(self,grades,docopy=False):
+        """Adds an iterable of Grades (or Grade names) in a single pass.
+        
+        Names are checked against the Gradebook's (or gradelist's) name
+        index, so loading N Grades costs O(N). As with add_grades, Grades
+        whose names are already taken are skipped, and a NameError listing
+        them is raised after the rest have been added.
+        """
         errList=[]
+        gradebook = self.parentCategory.parent
+        if type(gradebook) is not Gradebook:
+            gradebook = None
+        index = self._index
+        taken = gradebook._Gradebook__gradeindex if gradebook else index
+        observed = gradebook and gradebook._observers
         for gr in grades:
-            if type(gr) is Grade:
-                if self.parentCategory.parent:
-                    if gr in self.parentCategory.parent._Gradebook__weakgradeset:
-                        errList.append(gr.name)
-                        continue
-                elif gr.name in self:
-                    errList.append(gr.name)
-                    continue
-                if docopy:
-                    gr = copy.deepcopy(gr)
-                gr.parent=self.parentCategory
-                self._grades.add(gr)
-                if type(self.parentCategory.parent) is Gradebook:
-                    self.parentCategory.parent._Gradebook__weakgradeset.add(gr)
+            if type(gr) is not Grade:
+                gr = Grade(gr)
+            if gr.name in taken or gr.name in index:
+                errList.append(gr.name)
+                continue
+            if docopy:
+                gr = gr.snapshot()
+            gr.parent=self.parentCategory
+            self._grades.add(gr)
+            index[gr.name]=gr
+            _index_identifiers(self._identindex,self._identloose,gr)
+            if gradebook:
+                gradebook._register_grade(gr)
+            if observed:
+                gradebook._notify( ('add',self.parentCategory.name,gr) )
+        self._invalidate()
+        self._invalidate_times()
         if errList:
             err = 'Attempt to add Grade(s) named '
             err += list_to_str(errList)
@@ -295,18 +1173,99 @@ class _gradelist_for_Category(object):
             raise NameError,err
     
     def remove_grades(self,*grades):
-        rem_list=[]
-        allgone=True
-        for gr in self._grades:
-            if any([True for x in grades if gr==x or gr.name==x]):
-                rem_list.append(gr)
-            else:
-                allgone=False
-        for i in rem_list:
-            self._grades.remove(i)
-        if not allgone:
-            return False
-        return True
+        """Removes Grades (or Grades by name) from the gradelist.
+        
+        Returns True if the gradelist is empty afterwards.
+        """
+        gradebook = self.parentCategory.parent
+        for x in grades:
+            gr = self.get_grade(x.name if isinstance(x,Grade) else x)
+            if gr is None or not (gr is x or gr == x or gr.name == x):
+                continue
+            self._grades.discard(gr)
+            del self._index[gr.name]
+            _unindex_identifiers(self._identindex,self._identloose,gr)
+            if type(gradebook) is Gradebook:
+                gradebook._unregister_grade(gr)
+            self._notify('remove',self.parentCategory.name,gr.name)
+        self._invalidate()
+        self._invalidate_times()
+        return not self._grades
+    
+    add_grade = add = add_grades
+    remove_grade = remove = remove_grades
+    
+    def _reindex_identifiers(self,gr,remove=(),update=None,replace=None,
+                             edit=None):
+        """Changes a member Grade's identifiers, keeping indexes current.
+        
+        edit, if given, is called with the identifiers dict and must
+        change it with dict's own methods (see _Identifiers)."""
+        gradebook = self.parentCategory.parent
+        if type(gradebook) is not Gradebook or gradebook.get_grade(gr.name) is not gr:
+            gradebook = None
+        _unindex_identifiers(self._identindex,self._identloose,gr)
+        if gradebook:
+            gradebook._unindex_identifiers(gr)
+        try:
+            if replace is not None:
+                object.__setattr__(gr,'identifiers',replace)
+            idents = gr.identifiers
+            for key in remove:
+                dict.pop(idents,key,None)
+            if update:
+                dict.update(idents,update)
+            if edit is not None:
+                edit(idents)
+        finally: #e.g. a KeyError from del
+            if self._index.get(gr.name) is gr:
+                _index_identifiers(self._identindex,self._identloose,gr)
+            if gradebook:
+                gradebook._index_identifiers(gr)
+        self._notify('set',gr.name,'identifiers',dict(gr._identifiers or {}))
+    
+    def _notify(self,*change):
+        """Reports a change to the Gradebook's observers, if it has any."""
+        gradebook = self.parentCategory.parent
+        if type(gradebook) is Gradebook and gradebook._observers:
+            gradebook._notify(change)
+    
+    def _invalidate(self):
+        """Marks cached aggregates of the Category (and Gradebook) dirty."""
+        self._statcache.clear()
+        self._columns = None
+        self._sortindex.clear()
+        gradebook = self.parentCategory.parent
+        if type(gradebook) is Gradebook:
+            gradebook._invalidate()
+    
+    def _invalidate_times(self):
+        """Drops the timestamp indexes of the Category (and Gradebook)."""
+        self._timeindex = None
+        gradebook = self.parentCategory.parent
+        if type(gradebook) is Gradebook:
+            gradebook._invalidate_times()
+    
+    def _time_index(self):
+        if self._timeindex is None:
+            self._timeindex = _time_index(self._grades)
+        return self._timeindex
+    
+    def _rename_grade(self,gr,new_name):
+        """Keeps the name indexes current when a member Grade is renamed."""
+        if self._index.get(gr.name) is not gr or gr.name == new_name:
+            return
+        gradebook = self.parentCategory.parent
+        if new_name in self._index or (type(gradebook) is Gradebook and \
+                                        gradebook.get_grade(new_name)):
+            raise NameError,'Cannot rename Grade \'{}\' to \'{}\'; name ' \
+                    'already in Gradebook or gradelist.'.format(gr.name,new_name)
+        del self._index[gr.name]
+        self._index[new_name]=gr
+        if type(gradebook) is Gradebook:
+            gradebook._unregister_grade(gr)
+            gradebook._register_grade(gr,new_name)
+        self._notify('rename',gr.name,new_name)
     
     def isin(self,grade_obj):
         """Checks if a specific Grade instance is in the gradelist"""
@@ -320,24 +1279,20 @@ class _gradelist_for_Category(object):
         To check for an exact object, use isin() function.
         """
         dbg('_gradelist[..].__contains__(',x,')')
-        nems = self._grades #assuming x is a Grade
-        if not isinstance(x,Grade): 
+        if not isinstance(x,Grade):
             #probably looking for a name!
-            nems = [q.name for q in self._grades]
-        dbg('_gradelist[..].__contains__.nems = ',*nems)
-        for i in nems:
-            if x==i:
-                return True
-        return False
+            return self.get_grade(x) is not None
+        gr = self.get_grade(x.name)
+        return gr is not None and (gr is x or gr == x)
     
     def __iter__(self):
         return iter(self._grades)
     
     def get_grade(self,gr_name):
-        for gr in self._grades:
-            if gr.name == gr_name:
-                return gr
-        return None
+        try:
+            return self._index.get(gr_name)
+        except TypeError: #unhashable, so it can't be a name
+            return None
     
     def __getitem__(self,key):
         gr = self.get_grade(key)
@@ -345,6 +1300,17 @@ class _gradelist_for_Category(object):
             raise KeyError, 'Grade name \'{}\' not in gradelist'.format(key)
         return gr
     
+    def _best_count(self):
+        """Returns the Category's best-count limit, or None if not used.
+        
+        A negative value means 'drop the lowest N'.
+        """
+        cat = self.parentCategory
+        if not cat.use_best_count or cat.element_count is None or \
+                    cat.element_count == float('inf'):
+            return None
+        return cat.element_count
+    
     def get_stat(self,stat,**kwargs):
         """Get information about the Category's Grades.
         
@@ -354,7 +1320,14 @@ class _gradelist_for_Category(object):
             weighted    Boolean. Should weight factor into calculating stat.
             counted     Boolean. if True and Category.use_best_count, only 
                             looks at the highest N grades (where N is 
-                            elements_counted)
+                            element_count), or drops the lowest -N grades
+                            if element_count is negative.
+            as_of       datetime (or epoch seconds). Only counts Grades
+                            timestamped at or before it, found through
+                            the Category's timestamp index.
+        Results are cached until a member Grade's score, maximum, weight,
+        extra_credit or overrides, or an attribute of the Category, changes.
+        as_of results aren't cached.
         """
         stat=stat.lower()
         if stat.startswith('elem'):     stat = 0#'elements'
@@ -367,79 +1340,75 @@ class _gradelist_for_Category(object):
         counted = kwargs.get('counted',False)
         weighted,counted = map(bool,[weighted,counted])
         
-        #generating ordered list of grades
-        listy = []
-        for gr in self._grades:
-            val=None
-            if gr.score is not None:
-                val=gr.score
-                if gr.getMaximum():
-                    val/=1.0*gr.getMaximum()
-                if gr.getWeight() and weighted:
-                    val*=gr.getWeight()
-            listy.append( (gr,val) )
-        
-        listy.sort(lambda a,b: cmp(a[1],b[1]),None,True)
-        
-        #trimming list (if counted)
-        if counted and self.parentCategory.use_best_count and \
-                        self.parentCategory.element_count is not None:
-            listy = listy[0:self.parentCategory.element_count]
-        listy = [x[0] for x in listy]
+        as_of = kwargs.get('as_of')
+        if as_of is not None:
+            keys,grades = self._time_index()
+            grades = grades[0:bisect.bisect_right(keys,_timestamp_key(as_of))]
+            return self._compute_stat(stat,weighted,counted,grades)
         
+        key = (stat,weighted,counted)
+        if key not in self._statcache:
+            self._statcache[key] = self._compute_stat(stat,weighted,counted)
         if stat is 0:
-            return listy
+            return list(self._statcache[key])
+        return self._statcache[key]
+    
+    def _compute_stat(self,stat,weighted,counted,grades=None):
+        """stat (0-4) of the gradelist, or of a subset of its grades."""
+        if grades is None:
+            grades = self._grades
+        if _INSTRUMENTING:
+            instrumentation.count('grades_scanned',len(grades))
+        count = self._best_count() if counted else None
+        if stat is not 0 and COLUMNAR and numpy is not None and \
+                    grades is self._grades:
+            if self._columns is None:
+                self._columns = _ScoreColumns.build(self._grades) or False
+            if self._columns:
+                return self._columns.stat(stat,weighted,count)
         
-        #building current score, maximum, points, and weight
-        curScore = 0
-        curMax = 0
-        curPoints = 0
-        curWeight = 0
-        for gr in listy:
-            if gr.score is None:
-                continue
-            scr,mx,wgt,xtra = gr.score,gr.getMaximum(),gr.getWeight(),gr.extra_credit
-            if wgt and weighted:
-                scr=scr*wgt
-            if mx:
-                if weighted:
-                    curMax += mx*wgt
-                else: curMax += mx
-                curPoints+= 1.0*scr/mx
-            else:
-                curPoints+= scr
-            if not xtra:
-                curWeight+=wgt
-            curScore += scr
+        if stat is not 0:
+            return _stat_of([(gr.score,gr.getMaximum(),gr.getWeight(),
+                              gr.extra_credit) for gr in grades],
+                            stat,weighted,count)
         
-        if stat is 1:
-            return curScore
-        if stat is 2:
-            return curMax
-        if stat is 3:
-            if curMax:
-                return 1.0*curPoints
-            return None
-        if stat is 4:
-            return curWeight
+        #only 'elements' promises an order
+        listy = [(gr,_stat_value(gr.score,gr.getMaximum(),gr.getWeight(),
+                                 weighted)) for gr in grades]
+        listy.sort(key=operator.itemgetter(1),reverse=True)
+        if count is not None:
+            listy = listy[0:count]
+        return [x[0] for x in listy]
     
     def identifier_select(self,**kwargs):
+        """Grades whose identifiers include every key=value in kwargs.
+        
+        Answered from an inverted (key,value) index by set intersection.
+        Returns None if nothing matched.
+        """
         if not kwargs:
             return None
-        working_set=set()
-        for gradeobj in self._grades:
-            isGood=True
-            for kw in kwargs:
-                if not isGood or not (kw in gradeobj.identifiers and gradeobj.identifiers[kw]==kwargs[kw]):
-                    isGood=False
-            if isGood is True:
-                working_set.add(gradeobj)
+        working_set = _identifier_matches(self._identindex,self._identloose,
+                                          self._grades,kwargs)
         if not working_set:
             return None
         return working_set
     
-    def select(self,docopy=False,aslist=False,**kwargs):
-        """Retrieves Grades from gradelist according to kwargs.
+    def timestamp_select(self,start=None,end=None,docopy=False):
+        """Grades with start <= timestamp < end, in timestamp order.
+        
+        start and end are datetimes (or epoch seconds); None leaves that
+        side open. Answered by bisecting the Category's timestamp index,
+        which is rebuilt only after Grades are added or removed or a
+        timestamp is assigned. Untimed Grades are never returned.
+        """
+        found = _time_window(self._time_index(),start,end)
+        if docopy:
+            return [gr.snapshot() for gr in found]
+        return found
+    
+    def select(self,docopy=False,aslist=False,query=None,**kwargs):
+        """Retrieves Grades from gradelist according to kwargs (or a Query).
         
         If multiple kwargs are provided, all will be required for a Grade
         to be returned. 
@@ -469,9 +1438,9 @@ class _gradelist_for_Category(object):
             [S] Works for string attributes
             [L] Works for list/set attributes
             [D] Works for dict/mapping attributes
+        -
+        A precompiled Query may be passed as 'query' instead of kwargs.
         """
-        OP_LIST = [None,'N','GT','LT','GTE','LTE','BTWN','IN','NIN']
-        reggy = re.compile('^(?P<op>[A-Z]+)?(?P<attr>[a-z_]+)$')
         working_set = set()
         if 'docopy' in kwargs:
             docopy = kwargs['docopy']
@@ -479,33 +1448,54 @@ class _gradelist_for_Category(object):
         if 'aslist' in kwargs:
             aslist = kwargs['aslist']
             del kwargs['aslist']
+        if query is None:
+            query = Query(**kwargs)
+        elif kwargs:
+            raise ValueError,'_gradelist[..].select takes a query or ' \
+                    'keywords, not both.'
         
-        op_attr_value = []
-        for kw in kwargs:
-            reggy_res = reggy.match(kw)
-            if not reggy_res: 
-                raise ValueError,'Keyword in _gradelist[..].select invalid: %s'%kw
-                return None
-            op = reggy_res.group('op')
-            attr = reggy_res.group('attr')
-            if op not in OP_LIST:
-                raise ValueError,'%s is not a valid operator.\nOperators: %s'%(op,OP_LIST)
-                return None
-            op_attr_value.append( (op,attr,kwargs[kw]) )
-        for gradeobj in self._grades:
-            isGood=True
-            for op_set in op_attr_value:
-                if isGood and not gradeobj.compare(op_set[0],op_set[1],op_set[2]):
-                    isGood=False
-            if isGood:
-                if docopy:
-                    gradeobj = copy.deepcopy(gradeobj)
-                working_set.add(gradeobj)
+        for gradeobj in query.select(self):
+            if docopy:
+                gradeobj = gradeobj.snapshot()
+            working_set.add(gradeobj)
         if working_set and aslist:
             return list(working_set)
         elif working_set:
             return working_set
         return None
+    
+    def _range_select(self,attr,*terms):
+        """Grades matching range predicates, given as (op,VALUE) pairs on
+        one attribute, found through a sorted index.
+        
+        The index for attr is built on first use and dropped whenever the
+        gradelist's aggregates are invalidated. Grades whose value isn't a
+        real number (e.g. a None score) are tested directly. Timestamps
+        use the timestamp index; untimed Grades never match a range.
+        """
+        if attr == 'timestamp':
+            keys,grades = self._time_index()
+            start,end = _range_slice(keys,terms,float)
+            return grades[start:end] if start < end else []
+        if attr not in self._sortindex:
+            getter = _GRADE_GETTERS.get(attr,operator.attrgetter(attr))
+            pairs,others = [],[]
+            for gr in self._grades:
+                val = getter(gr)
+                if isinstance(val,numbers.Real) and val == val:
+                    pairs.append( (val,gr) )
+                else:
+                    others.append(gr)
+            pairs.sort(key=operator.itemgetter(0))
+            self._sortindex[attr] = ([p[0] for p in pairs],
+                                     [p[1] for p in pairs],others)
+        keys,grades,others = self._sortindex[attr]
+        start,end = _range_slice(keys,terms)
+        found = grades[start:end] if start < end else []
+        if others:
+            preds = [_compile_predicate(op,attr,VALUE) for op,VALUE in terms]
+            found = found+[gr for gr in others if all(p(gr) for p in preds)]
+        return found
 
 class Category(object):
     """A grouping of Grades that can help organize and modify scores.
@@ -543,6 +1533,12 @@ class Category(object):
     """
     #Alternatives: Have different implementation settings, such as:
     #  * 
+    __slots__ = ('name','parent','grades','inited','__values','__weakref__')
+    #the attributes held in __values (exposed read-only below)
+    _ATTRIBS = frozenset(['controls_weight','grade_weight','controls_maximum',
+                          'grade_maximum','cat_weight','element_count',
+                          'use_best_count'])
+    
     def __init__(self,cat_name,**kwargs):
         
         #############
@@ -562,8 +1558,8 @@ class Category(object):
         grade_maximum = kwargs.get('grade_maximum',None)
         cat_weight = kwargs.get('cat_weight',None)
         element_count = kwargs.get('element_count',None)
-        use_best_count = kwargs.get('element_count',False)
-        self.__attribs = {  'controls_weight':  controls_weight,
+        use_best_count = kwargs.get('use_best_count',False)
+        self.__values = {   'controls_weight':  controls_weight,
                             'grade_weight':     grade_weight,
                             'controls_maximum': controls_maximum,
                             'grade_maximum':    grade_maximum,
@@ -576,94 +1572,85 @@ class Category(object):
         
         self.inited=SECURE
     
-    def ___Category__x_(s,**a): #p->pref;upref
-        if a and a.keys()[0][0] == 'p':return lambda z: '_%s%s'%(type(s)\
-        .__name__,z);return lambda z: z[len('_'+type(s).__name__+'__'):]\
-        if z.startswith('_'+type(s).__name__+'__') else z[2:] if \
-        z.startswith('__') else z
+    #Reads are plain properties; all writes go through __setattr__.
+    controls_weight = property(lambda self: self.__values['controls_weight'])
+    grade_weight = property(lambda self: self.__values['grade_weight'])
+    controls_maximum = property(lambda self: self.__values['controls_maximum'])
+    grade_maximum = property(lambda self: self.__values['grade_maximum'])
+    cat_weight = property(lambda self: self.__values['cat_weight'])
+    element_count = property(lambda self: self.__values['element_count'])
+    use_best_count = property(lambda self: self.__values['use_best_count'])
+    #specials (return COPIES)
+    __attribs = property(lambda self: copy.deepcopy(self.__values))
+    
+    @property
+    def __dict__(self):
+        return {'name':self.name,'parent':self.parent,'grades':self.grades,
+                'inited':self.inited,'_Category__attribs':self.__attribs}
     
     def __setattr__(self,name,value):
-        if not object.__getattribute__(self,'inited'):
-            object.__setattr__(self,name,value)
-        
-        elif object.__getattribute__(self,'inited'):
-            
-            undundSecret = {'__attribs'}
-            undundSecret |= set(map(self.___Category__x_(priv=1),undundSecret))
-            if name in ['name','parent'] and object.__getattribute__(self,name):
-                warnings.warn('Category {} is set at initializatio'\
-                                            'n.'.format(name),stacklevel=2)
-                return
-            if name == 'parent':
-                object.__setattr__(self,name,value)
-                return
-            if name == 'inited':
-                warnings.warn('\'inited\' is an internal class attribute.' \
-                                                                ,stacklevel=2)
-                return
-            if name in undundSecret:
-                wrn='\'{}\' must be modified by relevant functions of ' \
-                    'the class.'.format(self.___Category__x_(QT=3.14)(name))
-                warnings.warn(wrn,stacklevel=1)
-                return
-            if name in ['controls_weight','controls_maximum','use_best_count']:
-                value = bool(value)
-            elif name in ['grade_weight','grade_maximum','cat_weight']:
-                if not (isinstance(value,numbers.Number) or value is None):
-                    raise TypeError,'%s must be numeric or None.'%name
-                if value is not None: value=float(value)
-            elif name in ['element_count']:
-                if not (isinstance(value,int) or value==float('inf') or \
-                                                value is None):
-                    raise TypeError,'%s must be an integer, None, or (I ' \
-                        'suppose) infinity.'%name
-                if isinstance(value,int): value=int(value)
+        if not self.inited:
+            if name in Category._ATTRIBS:
+                self.__values[name]=value
+                self.grades._invalidate()
             else:
-                raise AttributeError,'Cannot set \'%s\' of \'%s\' object'% \
-                                     (name,type(self).__name__)
-            x = object.__getattribute__(self,self.___Category__x_(plot='no')('__attribs'))
-            if name not in x:
-                return
-            object.__getattribute__(self,self.___Category__x_(previous=True)('__attribs'))[name]=value
+                object.__setattr__(self,name,value)
+            return
+        
+        if name in ['name','parent'] and getattr(self,name,None):
+            warnings.warn('Category {} is set at initializatio'\
+                                        'n.'.format(name),stacklevel=2)
+            return
+        if name == 'parent':
+            object.__setattr__(self,name,value)
+            return
+        if name == 'inited':
+            warnings.warn('\'inited\' is an internal class attribute.' \
+                                                            ,stacklevel=2)
+            return
+        if name in ['__attribs','_Category__attribs','_Category__values']:
+            warnings.warn('\'attribs\' must be modified by relevant functions' \
+                          ' of the class.',stacklevel=1)
+            return
+        if name in ['controls_weight','controls_maximum','use_best_count']:
+            value = bool(value)
+        elif name in ['grade_weight','grade_maximum','cat_weight']:
+            if not (isinstance(value,numbers.Number) or value is None):
+                raise TypeError,'%s must be numeric or None.'%name
+            if value is not None: value=float(value)
+        elif name in ['element_count']:
+            if not (isinstance(value,int) or value==float('inf') or \
+                                            value is None):
+                raise TypeError,'%s must be an integer, None, or (I ' \
+                    'suppose) infinity.'%name
+            if isinstance(value,int): value=int(value)
+        else:
+            raise AttributeError,'Cannot set \'%s\' of \'%s\' object'% \
+                                 (name,type(self).__name__)
+        self.__values[name]=value
+        self.grades._invalidate()
+        self.grades._notify('category',self.name,name,value)
+    
+    def __reduce__(self):
+        #pickled without the parent Gradebook, with its Grades' own values
+        return (_restore_category,(self.name,self.__attribs,
+                        [(gr.name,gr.score,gr.maximum,gr.weight,
+                          gr.extra_credit,gr._timestamp,gr._overrides,
+                          gr._identifiers and dict(gr._identifiers))
+                         for gr in self.grades]))
     
     def get_grade_weight(self):
         """Returns weight of Grades in Category, assuming control."""
-        atr = self.__attribs
+        atr = self.__values
         if atr['controls_weight'] and (atr['cat_weight'] and atr['element_count'] or atr['grade_weight']):
             if atr['cat_weight'] and atr['element_count']:
                 return 1.0*atr['cat_weight']/atr['element_count']
             return atr['grade_weight']
         return False
     
-    def __getattribute__(self,name):
-        #safe/immutable (should return attribute with no question)
-        if name in ['info','name','__class__','__doc__','__module__','grades',
-                    '__weakref__','__hash__','_Category___Category__x_',
-                    'get_grade_weight','parent']:
-            return object.__getattribute__(self,name)
-        #specials (should return COPIES)
-        if name in ['__dict__']:
-            x = object.__getattribute__(self,name)
-            return copy.deepcopy(x)
-        #attribute getters
-        if name in ['get_grade_maximum']:
-            exx = self.__attribs[name[4:]]
-            return lambda: exx
-        intde = object.__getattribute__(self,'inited')
-        atrbs = self.___Category__x_(pr1nt=0)('__attribs')
-        
-        if not intde:
-            return object.__getattribute__(self,name)
-        if name == 'inited':
-            return bool(intde)
-        if name == atrbs or name == '__attribs':
-            return copy.deepcopy(object.__getattribute__(self,atrbs))
-        if name in object.__getattribute__(self, atrbs):
-            return object.__getattribute__(self, atrbs)[name]
-        else:
-            raise AttributeError,'\'%s\' object has no attribute \'%s\''% \
-                                 (type(self).__name__,name)
-    
+    def get_grade_maximum(self):
+        """Returns maximum of Grades in Category, assuming control."""
+        return self.__values['grade_maximum']
     
 
 
@@ -684,40 +1671,124 @@ class Gradebook(object):
         
         self.__categories = {}
         self.__weakgradeset = weakref.WeakSet()
-        self.get_stat = self.get_weighted_stat
+        self.__gradeindex = weakref.WeakValueDictionary()
+        self.__identindex = {}
+        self.__identloose = weakref.WeakSet()
+        self.__statcache = None
+        self.__timeindex = None
+        self._observers = []
     
     def add_category(self,*categories):
+        """Adds Categories with their Grades. A Category whose name, or
+        one of whose Grades' names, is already in the Gradebook is skipped,
+        and a NameError listing them is raised after the rest are added."""
         errList=[]
+        gradeErrs=[]
         for cat in categories:
             if type(cat) is Category:
                 if cat.name in self:
                     errList.append(cat.name)
                     continue
+                taken = [gr.name for gr in cat.grades
+                         if gr.name in self.__gradeindex]
+                if taken:
+                    errList.append(cat.name)
+                    gradeErrs.extend(taken)
+                    continue
                 cat.parent=self
                 self.__categories[cat.name]=cat
                 self.__weakgradeset.add(cat)
+                for gr in cat.grades:
+                    self._register_grade(gr)
+                self._invalidate()
+                self._invalidate_times()
+                if self._observers:
+                    self._notify( ('add_category',cat) )
         if errList:
             err = 'Attempt to add Categor(y/ies) named '
             err += list_to_str(errList)
-            err+=' failed. Names already in Gradebook.'
-            raise NameError,err
+            err+=' failed. Names already in Gradebook'
+            if gradeErrs:
+                err+=' (Grade(s) named '+list_to_str(gradeErrs)+')'
+            raise NameError,err+'.'
     
     def remove_category(self,cat):
         """cat may be a Category or a Category name"""
         if isinstance(cat,Category):
             cat = cat.name
-        if cat.name in self.__categories:
-            del self.__categories[cat.name]
+        if cat in self.__categories:
+            for gr in self.__categories[cat].grades:
+                self._unregister_grade(gr)
+            self.__weakgradeset.discard(self.__categories.pop(cat))
+            self._invalidate()
+            self._invalidate_times()
+            if self._observers:
+                self._notify( ('remove_category',cat) )
             return True
         else:
-            warnings.warn('Category \'{}\' is not in Gradebook.'.format(cat.name))
+            warnings.warn('Category \'{}\' is not in Gradebook.'.format(cat))
             return False
     
-    def __contains__(self,x):
-        for i in self.__weakgradeset:
-            if (x == i.name) or (x is i) or (x == i):
-                return True
-        return False
+    def add_observer(self,observer):
+        """Calls observer(gradebook,change) after every change to the
+        Gradebook, its Categories or their Grades (see Journal).
+        
+        change is a tuple, one of:
+            ('set',grade_name,attribute,value)  score, maximum, weight,
+                        extra_credit, timestamp, overrides or identifiers
+            ('rename',old_name,new_name)
+            ('add',category_name,grade)
+            ('remove',category_name,grade_name)
+            ('category',category_name,attribute,value)
+            ('add_category',category)
+            ('remove_category',category_name)
+        Grades' score etc. are only observed when assigned (or changed by
+        mod_overrides/mod_identifiers/update_scores, or for overrides and
+        identifiers, edited in place).
+        """
+        self._observers.append(observer)
+    
+    def remove_observer(self,observer):
+        self._observers.remove(observer)
+    
+    def _notify(self,change):
+        for observer in list(self._observers):
+            observer(self,change)
+    
+    def _register_grade(self,gr,name=None):
+        """Adds a Grade to the Gradebook's name index (used by gradelists)."""
+        self.__weakgradeset.add(gr)
+        self.__gradeindex[gr.name if name is None else name]=gr
+        self._index_identifiers(gr)
+    
+    def _unregister_grade(self,gr):
+        self.__weakgradeset.discard(gr)
+        if self.__gradeindex.get(gr.name) is gr:
+            del self.__gradeindex[gr.name]
+        self._unindex_identifiers(gr)
+    
+    def _index_identifiers(self,gr):
+        _index_identifiers(self.__identindex,self.__identloose,gr,weakref.WeakSet)
+    
+    def _unindex_identifiers(self,gr):
+        _unindex_identifiers(self.__identindex,self.__identloose,gr)
+    
+    def _invalidate(self):
+        self.__statcache = None
+    
+    def _invalidate_times(self):
+        self.__timeindex = None
+    
+    def __contains__(self,x):
+        if isinstance(x,Grade):
+            gr = self.get_grade(x.name)
+            return gr is not None and (gr is x or gr == x)
+        if isinstance(x,Category):
+            return self.__categories.get(x.name) is x
+        try:
+            return x in self.__categories or x in self.__gradeindex
+        except TypeError:
+            return False
     
     def __getitem__(self,x):
         ret = self.get_category(x)
@@ -733,10 +1804,10 @@ class Gradebook(object):
         return None
     
     def get_grade(self,name):
-        for cat in self.__categories.values():
-            if name in cat.grades:
-                return cat.grades[name]
-        return None
+        try:
+            return self.__gradeindex.get(name)
+        except TypeError:
+            return None
     
     def add_grade(self,cat_name,grade_arg):
         if cat_name not in self.__categories:
@@ -751,58 +1822,726 @@ class Gradebook(object):
             self.__categories[cat_name].grades.add_grade(Grade(grade_arg))
         return True
     
-    def get_weighted_stat(self,stat):
+    def add_grades_bulk(self,cat_name,grades,docopy=False):
+        """Adds an iterable of Grades (or Grade names) to Category cat_name.
+        
+        See _gradelist_for_Category.add_grades_bulk; duplicate names raise
+        NameError once all other Grades have been added.
+        """
+        if cat_name not in self.__categories:
+            raise ValueError,'Category \'{}\' not in Gradebook.'.format(cat_name)
+        self.__categories[cat_name].grades.add_grades_bulk(grades,docopy)
+    
+    def update_scores(self,scores,identifier=None):
+        """Sets the scores of many Grades in one pass.
+        
+        scores is a mapping or an iterable of (key,score) pairs, where keys
+        are Grade names or, if identifier is given, values of that
+        identifier, e.g.
+            gradebook.update_scores({1234:9.5},identifier='submission_id')
+        A key matching several Grades sets all of them. Cached statistics
+        are invalidated once per changed Category rather than per Grade.
+        Returns the list of keys that matched no Grade.
+        """
+        if hasattr(scores,'iteritems'):
+            scores = scores.iteritems()
+        unknown = []
+        changed = set()
+        for key,score in scores:
+            if identifier is None:
+                gr = self.get_grade(key)
+                grades = () if gr is None else (gr,)
+            else:
+                try:
+                    grades = self.__identindex.get((identifier,key),())
+                    if self.__identloose:
+                        grades = itertools.chain(grades,self.__identloose)
+                except TypeError: #unhashable value, has to be a scan
+                    grades = [gr for gr in self.__weakgradeset
+                              if isinstance(gr,Grade)]
+                grades = [gr for gr in grades if gr._identifiers and
+                          identifier in gr._identifiers and
+                          gr._identifiers[identifier]==key]
+            if not grades:
+                unknown.append(key)
+            for gr in grades:
+                object.__setattr__(gr,'score',score)
+                if isinstance(gr.parent,Category):
+                    changed.add(gr.parent.grades)
+                if self._observers:
+                    self._notify( ('set',gr.name,'score',score) )
+        for gradelist in changed:
+            gradelist._invalidate()
+        if changed:
+            self._invalidate()
+        return unknown
+    
+    def get_weighted_stat(self,stat,as_of=None):
         """Get information about Gradebook's grades.
         
         stat =      ( score | max[imum] | percent[age] )
+        as_of =     datetime (or epoch seconds); if given, only Grades
+                        timestamped at or before it are counted, as the
+                        Gradebook stood then (see _gradelist.get_stat).
+        The weighted totals are cached until a Category reports a change.
         """
-        if stat == 'score': statv=1
-        elif stat.startswith('max'): statv=2
-        elif stat.startswith('percent'): 
-            statv=3
-            stat='points'
-        else:
-            raise ValueError, 'Gradebook.get_weighted_stat passed unaccepted argument.'
+        statv = self._weighted_statv(stat)
+        if as_of is not None:
+            wpoints=0
+            wmax=0
+            for cat in self.__categories.values():
+                p = cat.grades.get_stat('points',weighted=True,counted=True,
+                                        as_of=as_of)
+                if p:
+                    wpoints+=p
+                m = cat.grades.get_stat('weights',counted=True,as_of=as_of)
+                if m:
+                    wmax+=m
+        elif self.__statcache is None:
+            wpoints=0
+            wmax=0
+            for cat in self.__categories.values():
+                p = cat.grades.get_stat('points',weighted=True,counted=True)
+                if p:
+                    wpoints+=p
+                m = cat.grades.get_stat('weights',counted=True)
+                if m:
+                    wmax+=m
+            self.__statcache = (wpoints,wmax)
+        if as_of is None:
+            wpoints,wmax = self.__statcache
+        if statv is 1:
+            return wpoints
+        if statv is 2:
+            return wmax
+        else:#percent
+            if wmax:
+                return 1.0*wpoints/wmax
+            else:
+                return None
+    
+    def get_stat(self,stat,as_of=None):
+        """Alias of get_weighted_stat."""
+        return self.get_weighted_stat(stat,as_of)
+    
+    def timestamp_select(self,start=None,end=None,docopy=False):
+        """Grades in any Category with start <= timestamp < end, in
+        timestamp order (see _gradelist.timestamp_select).
+        
+        Answered from the Gradebook's own timestamp index, built from the
+        Categories' on first use after a Grade is added or removed or a
+        timestamp is assigned.
+        """
+        if self.__timeindex is None:
+            pairs = []
+            for cat in self.__categories.values():
+                keys,grades = cat.grades._time_index()
+                pairs.extend(itertools.izip(keys,grades))
+            pairs.sort(key=operator.itemgetter(0))
+            self.__timeindex = ([p[0] for p in pairs],[p[1] for p in pairs])
+        found = _time_window(self.__timeindex,start,end)
+        if docopy:
+            return [gr.snapshot() for gr in found]
+        return found
+    
+    def project(self,scenarios,stat='percent'):
+        """Evaluates hypothetical scores without changing the Gradebook.
+        
+        scenarios is an iterable of {grade name: score} mappings for
+        ungraded (score None) Grades. Returns, for each, what
+        get_weighted_stat(stat) would be with those scores filled in,
+        under the same weight, maximum, extra_credit and best-count rules.
+        Categories a scenario doesn't touch use their cached stats, and
+        the others are recomputed from values read once per call.
+        """
+        statv = self._weighted_statv(stat)
+        prepared = {}
+        return [self._project(self._scenario_changes(scenario),statv,prepared)
+                for scenario in scenarios]
+    
+    def required_score(self,target,stat='percent',grades=None,upper=1.0,
+                       tolerance=1e-6):
+        """The lowest uniform score needed to reach a target.
+        
+        Returns the smallest fraction f (to within tolerance) such that if
+        every ungraded Grade (or each Grade named in grades) scored f of
+        its maximum, get_weighted_stat(stat) would be at least target.
+        Grades without a maximum would score f itself. Returns 0.0 if the
+        target is met even with zeros, and None if scoring `upper` doesn't
+        meet it. Found by bisection (with project's machinery, so nothing
+        is changed or copied), assuming the stat doesn't fall as scores
+        rise.
+        """
+        statv = self._weighted_statv(stat)
+        if grades is None:
+            grades = [gr.name for cat in self.__categories.values()
+                      for gr in cat.grades if gr.score is None]
+        maxima = []
+        for name in grades:
+            gr = self.get_grade(name)
+            maxima.append( (name,gr.getMaximum() if gr is not None else None) )
+        prepared = {}
+        def reaches(frac):
+            scenario = dict((name,frac*mx if mx else frac) for name,mx in maxima)
+            value = self._project(self._scenario_changes(scenario),statv,prepared)
+            return value is not None and value >= target
+        if reaches(0):
+            return 0.0
+        if not reaches(upper):
+            return None
+        low,high = 0.0,float(upper)
+        while high-low > tolerance:
+            mid = (low+high)/2
+            if reaches(mid):
+                high = mid
+            else:
+                low = mid
+        return high
+    
+    @staticmethod
+    def _weighted_statv(stat):
+        if stat == 'score': return 1
+        elif stat.startswith('max'): return 2
+        elif stat.startswith('percent'): return 3
+        raise ValueError, 'Gradebook.get_weighted_stat passed unaccepted argument.'
+    
+    def _scenario_changes(self,scenario):
+        """{Category: {grade name: score}} for a project() scenario."""
+        changes = {}
+        for name,score in scenario.iteritems():
+            gr = self.get_grade(name)
+            if gr is None or not isinstance(gr.parent,Category):
+                raise KeyError, 'Grade \'{}\' not found in Gradebook.'.format(name)
+            if gr.score is not None:
+                raise ValueError, 'Grade \'{}\' already has a score.'.format(name)
+            changes.setdefault(gr.parent,{})[name] = score
+        return changes
+    
+    def _project(self,changes,statv,prepared):
         wpoints=0
         wmax=0
         for cat in self.__categories.values():
-            p = cat.grades.get_stat('points',weighted=True,counted=True)
+            if cat in changes:
+                if cat not in prepared:
+                    grades = list(cat.grades)
+                    prepared[cat] = ([(gr.score,gr.getMaximum(),gr.getWeight(),
+                                       gr.extra_credit) for gr in grades],
+                                     dict((gr.name,i) for i,gr in enumerate(grades)))
+                rows,positions = prepared[cat]
+                rows = list(rows)
+                for name,score in changes[cat].iteritems():
+                    row = rows[positions[name]]
+                    rows[positions[name]] = (score,)+row[1:]
+                count = cat.grades._best_count()
+                p = _stat_of(rows,3,True,count)
+                m = _stat_of(rows,4,False,count)
+            else:
+                p = cat.grades.get_stat('points',weighted=True,counted=True)
+                m = cat.grades.get_stat('weights',counted=True)
             if p:
                 wpoints+=p
-            m = cat.grades.get_stat('weights',counted=True)
             if m:
                 wmax+=m
         if statv is 1:
             return wpoints
         if statv is 2:
             return wmax
-        else:#percent
-            if wmax:
-                return 1.0*wpoints/wmax
-            else:
-                return None
+        if wmax:
+            return 1.0*wpoints/wmax
+        return None
     
     def identifier_select(self,**kwargs):
-        retset=set()
-        for cat in self.__categories:
-            i = cat.grades.identifier_select(**kwargs)
-            if i:
-                retset |= i
-        return retset
+        """Grades in any Category whose identifiers match all of kwargs.
+        
+        Answered from the Gradebook's own inverted identifier index.
+        """
+        if not kwargs:
+            return set()
+        return _identifier_matches(self.__identindex,self.__identloose,
+                                   self.__weakgradeset,kwargs)
     
-    def select(self,aslist=False,**kwargs):
+    def select(self,aslist=False,docopy=False,query=None,**kwargs):
+        """Retrieves Grades from all Categories; see _gradelist[..].select.
+        
+        kwargs are compiled into a Query once for all Categories.
+        """
         if not aslist and 'aslist' in kwargs:
             aslist = kwargs['aslist']
             del kwargs['aslist']
+        if query is None:
+            query = Query(**kwargs)
+        elif kwargs:
+            raise ValueError,'Gradebook.select takes a query or keywords, ' \
+                    'not both.'
         retset=set()
         for cat in self.__categories.values():
-            i = cat.grades.select(**kwargs)
+            i = cat.grades.select(docopy=docopy,query=query)
             if i:
                 retset |= i
         if aslist:
             return list(retset)
         return retset
     
+    def __reduce__(self):
+        #pickled as plain tuples of slot values, e.g. for process pools.
+        #Observers aren't pickled (nor deep copied): they belong to the
+        #original Gradebook
+        cats = []
+        for cat in self.__categories.values():
+            cats.append( (cat.name,cat._Category__attribs,
+                          [(gr.name,gr.score,gr.maximum,gr.weight,
+                            gr.extra_credit,gr._timestamp,gr._overrides,
+                            gr._identifiers) for gr in cat.grades]) )
+        return (_restore_gradebook,(self.name,self.user,
+                        self.attribs.get('identifiers') or {},cats))
+    
+    def __deepcopy__(self,memo):
+        """A copy with its own Categories, Grades (copy-on-write, see
+        Grade.snapshot, but keeping their own maximum and weight) and
+        indexes. The copy starts with no observers."""
+        gb = Gradebook(self.name,self.user,
+                       identifiers=copy.deepcopy(self.attribs.get('identifiers')
+                                                 or {},memo))
+        memo[id(self)] = gb
+        for cat in self.__categories.values():
+            cat_copy = Category(cat.name,**cat._Category__attribs)
+            gb.add_category(cat_copy)
+            cat_copy.grades.add_grades_bulk([gr._shared_copy(None,gr.score,
+                            gr.maximum,gr.weight) for gr in cat.grades])
+        return gb
+
+def _restore_category(name,attribs,grades):
+    """Unpickles a Category from the state built by Category.__reduce__."""
+    cat = Category(name,**attribs)
+    cat.grades.add_grades_bulk([Grade._from_slots(gr[0],None,*gr[1:])
+                                for gr in grades])
+    return cat
+
+def _restore_gradebook(name,user,identifiers,cats):
+    """Unpickles a Gradebook from the state built by Gradebook.__reduce__."""
+    gb = Gradebook(name,user,identifiers=identifiers)
+    categories = [Category(cat_name,**attribs) for cat_name,attribs,g in cats]
+    gb.add_category(*categories)
+    from_slots = Grade._from_slots
+    for cat,(cat_name,attribs,grades) in zip(categories,cats):
+        cat.grades.add_grades_bulk([from_slots(gr[0],None,*gr[1:])
+                                    for gr in grades])
+    return gb
+    
+
+#Gradebooks inherited by forked Roster pool workers (see Roster.get_stat)
+_roster_shared = None
+
+def _roster_eval(task):
+    """Process-pool worker for Roster.get_stat.
+    
+    'elements' are returned as Grade names, which Roster.get_stat looks
+    up in its own Gradebooks: the worker's Grades are copies.
+    """
+    gradebook,stat,cat_name,kwargs = task
+    if not isinstance(gradebook,Gradebook):
+        gradebook = _roster_shared[gradebook]
+    if cat_name is None:
+        return gradebook.get_weighted_stat(stat)
+    cat = gradebook.get_category(cat_name)
+    if cat is None:
+        return None
+    value = cat.grades.get_stat(stat,**kwargs)
+    if isinstance(value,list):
+        return [gr.name for gr in value]
+    return value
+
+class Roster(object):
+    """A collection of Gradebooks, e.g. one per student in a course.
+    
+    Gradebooks are kept in insertion order and keyed by their 'user'.
+    Statistics for the whole Roster can be computed on a process pool
+    with get_stat.
+    """
+    def __init__(self,name,*gradebooks):
+        object.__init__(self)
+        self.name = name
+        self.__gradebooks = collections.OrderedDict()
+        self.add_gradebook(*gradebooks)
+    
+    def add_gradebook(self,*gradebooks):
+        errList=[]
+        for gb in gradebooks:
+            if type(gb) is Gradebook:
+                if gb.user in self.__gradebooks:
+                    errList.append(gb.user)
+                    continue
+                self.__gradebooks[gb.user]=gb
+        if errList:
+            err = 'Attempt to add Gradebook(s) for user(s) '
+            err += list_to_str(errList)
+            err+=' failed. Users already in Roster.'
+            raise NameError,err
+    
+    def remove_gradebook(self,gb):
+        """gb may be a Gradebook or a user"""
+        if isinstance(gb,Gradebook):
+            gb = gb.user
+        if gb in self.__gradebooks:
+            del self.__gradebooks[gb]
+            return True
+        warnings.warn('User \'{}\' is not in Roster.'.format(gb))
+        return False
+    
+    def get_gradebook(self,user):
+        return self.__gradebooks.get(user)
+    
+    def __getitem__(self,user):
+        gb = self.get_gradebook(user)
+        if gb is None:
+            raise KeyError, 'User \'{}\' not found in Roster.'.format(user)
+        return gb
+    
+    def __contains__(self,x):
+        if isinstance(x,Gradebook):
+            return self.__gradebooks.get(x.user) is x
+        return x in self.__gradebooks
+    
+    def __iter__(self):
+        return self.__gradebooks.itervalues()
+    
+    def __len__(self):
+        return len(self.__gradebooks)
+    
+    def get_stat(self,stat,category=None,processes=None,chunksize=None,**kwargs):
+        """Yields (user,value) for each Gradebook, in Roster order.
+        
+        Without `category`, value is Gradebook.get_weighted_stat(stat);
+        otherwise it is the named Category's grades.get_stat(stat,**kwargs)
+        (None for Gradebooks without that Category).
+        
+        processes   Size of the multiprocessing pool (default: one per
+                        CPU). With processes=1, everything runs in this
+                        process and nothing is pickled.
+        chunksize   Gradebooks sent to a worker at a time (default: about
+                        four chunks per process).
+        Results are streamed in order as workers finish their chunks.
+        Where processes are forked, workers inherit the Gradebooks and only
+        indexes are sent to them; elsewhere Gradebooks are pickled.
+        """
+        global _roster_shared
+        users = self.__gradebooks.keys()
+        gradebooks = self.__gradebooks.values()
+        def result(gb,value):
+            if isinstance(value,list):
+                grades = gb.get_category(category).grades
+                return [grades.get_grade(name) for name in value]
+            return value
+        if processes == 1 or len(users) < 2:
+            for user,gb in itertools.izip(users,gradebooks):
+                yield user,result(gb,_roster_eval((gb,stat,category,kwargs)))
+            return
+        import multiprocessing
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if chunksize is None:
+            chunksize = max(1,len(users)//(4*processes))
+        if hasattr(os,'fork'):
+            refs = xrange(len(gradebooks))
+            _roster_shared = gradebooks
+        else:
+            refs = gradebooks
+        try:
+            pool = multiprocessing.Pool(processes)
+        finally:
+            _roster_shared = None
+        tasks = ((ref,stat,category,kwargs) for ref in refs)
+        try:
+            for user,gb,value in itertools.izip(users,gradebooks,
+                        pool.imap(_roster_eval,tasks,chunksize)):
+                yield user,result(gb,value)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    
+    def summarize(self,track=False):
+        """RosterStats for the Roster's Gradebooks (see RosterStats)."""
+        return RosterStats(self,track=track)
+    
+
+class Summary(object):
+    """Running statistics of one column of values, e.g. a Grade's scores
+    across a Roster.
+    
+    The mean and variance are kept with Welford's algorithm (values are
+    removed by running it backwards); a sorted copy of the values answers
+    min, max, median, quantiles and histograms exactly.
+    """
+    __slots__ = ('count','mean','_m2','_values')
+    
+    def __init__(self,values=()):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self._values = []
+        for x in values:
+            self.add(x)
+    
+    def add(self,x):
+        self.count += 1
+        delta = x-self.mean
+        self.mean += delta/self.count
+        self._m2 += delta*(x-self.mean)
+        bisect.insort(self._values,x)
+    
+    def remove(self,x):
+        values = self._values
+        i = bisect.bisect_left(values,x)
+        if i == len(values) or values[i] != x:
+            raise ValueError, '{} is not in Summary.'.format(x)
+        del values[i]
+        self.count -= 1
+        if not self.count:
+            self.mean = 0.0
+            self._m2 = 0.0
+            return
+        delta = x-self.mean
+        self.mean -= delta/self.count
+        self._m2 = max(0.0,self._m2-delta*(x-self.mean))
+    
+    def __len__(self):
+        return self.count
+    
+    def variance(self,ddof=0):
+        """ddof=1 for the sample variance. None for too few values."""
+        if self.count <= ddof:
+            return None
+        return self._m2/(self.count-ddof)
+    
+    def std(self,ddof=0):
+        var = self.variance(ddof)
+        if var is None:
+            return None
+        return var**0.5
+    
+    @property
+    def min(self):
+        return self._values[0] if self._values else None
+    
+    @property
+    def max(self):
+        return self._values[-1] if self._values else None
+    
+    def quantile(self,q):
+        """q in [0,1], interpolating linearly between values."""
+        values = self._values
+        if not values:
+            return None
+        if not 0 <= q <= 1:
+            raise ValueError, 'quantile must be between 0 and 1.'
+        pos = q*(len(values)-1)
+        i = int(pos)
+        if i+1 == len(values):
+            return values[i]
+        return values[i]+(values[i+1]-values[i])*(pos-i)
+    
+    def median(self):
+        return self.quantile(0.5)
+    
+    def percentile(self,p):
+        return self.quantile(p/100.0)
+    
+    def histogram(self,bins=10,bounds=None):
+        """(counts,edges) for `bins` equal-width bins over bounds, a
+        (low,high) pair (default: min to max). The last bin includes its
+        upper edge; values outside bounds are not counted."""
+        values = self._values
+        if bounds is None:
+            if not values:
+                return [0]*bins,[]
+            bounds = (values[0],values[-1])
+        low,high = bounds
+        width = 1.0*(high-low)/bins
+        edges = [low+width*i for i in xrange(bins)]+[high]
+        cuts = [bisect.bisect_left(values,edge) for edge in edges[:-1]]
+        cuts.append(bisect.bisect_right(values,high))
+        counts = [cuts[i+1]-cuts[i] for i in xrange(bins)]
+        return counts,edges
+    
+
+def _category_percent(cat):
+    """The Category's share of Gradebook.get_weighted_stat('percent')."""
+    weights = cat.grades.get_stat('weights',counted=True)
+    if not weights:
+        return None
+    return 1.0*(cat.grades.get_stat('points',weighted=True,counted=True)
+                or 0)/weights
+
+class RosterStats(object):
+    """Class-wide statistics for every Grade and Category.
+    
+    Built in one pass over any iterable of Gradebooks (a Roster, or e.g.
+    the output of json_iterimport, which needn't be kept in memory).
+    get_grade(name) is a Summary of the scores of that Grade across all
+    the Gradebooks, get_category(name) of each Gradebook's percentage in
+    that Category (points over weights, as in get_weighted_stat), and
+    total() of get_weighted_stat('percent'). Ungraded Grades and empty
+    Categories are left out.
+    
+    Gradebooks can be added, removed and updated later. With track=True
+    the Gradebooks are kept and observed (see Gradebook.add_observer):
+    a changed Grade only updates its own and its Category's values, and
+    only when statistics are next read.
+    """
+    def __init__(self,gradebooks=(),track=False):
+        object.__init__(self)
+        self.track = track
+        self.__grades = {}
+        self.__categories = {}
+        self.__total = Summary()
+        self.__values = {}#user -> {(kind,name): value}
+        self.__tracked = {}
+        self.__dirty = set()
+        self.__changed = set()#(user,grade name)
+        for gb in gradebooks:
+            self.add_gradebook(gb)
+    
+    def add_gradebook(self,*gradebooks):
+        errList=[]
+        for gb in gradebooks:
+            if gb.user in self.__values:
+                errList.append(gb.user)
+                continue
+            self.__values[gb.user] = {}
+            self.__collect(gb)
+            if self.track:
+                self.__tracked[gb.user] = gb
+                gb.add_observer(self._observe)
+        if errList:
+            err = 'Attempt to add Gradebook(s) for user(s) '
+            err += list_to_str(errList)
+            err+=' failed. Users already in RosterStats.'
+            raise NameError,err
+    
+    def remove_gradebook(self,gb):
+        """gb may be a Gradebook or a user"""
+        user = gb.user if isinstance(gb,Gradebook) else gb
+        if user not in self.__values:
+            warnings.warn('User \'{}\' is not in RosterStats.'.format(user))
+            return False
+        for key in self.__values[user].keys():
+            self.__withdraw(user,key)
+        del self.__values[user]
+        tracked = self.__tracked.pop(user,None)
+        if tracked is not None:
+            tracked.remove_observer(self._observe)
+        self.__dirty.discard(user)
+        return True
+    
+    def update_gradebook(self,gb):
+        """Recounts all of an (untracked) Gradebook's values."""
+        values = self.__values.get(gb.user)
+        if values is None:
+            raise KeyError, 'User \'{}\' not found in RosterStats.'.format(gb.user)
+        for key in values.keys():
+            self.__withdraw(gb.user,key)
+        self.__collect(gb)
+    
+    def _observe(self,gradebook,change):
+        if self.__tracked.get(gradebook.user) is not gradebook:
+            return #no longer tracked
+        if change[0] == 'set':
+            self.__changed.add( (gradebook.user,change[1]) )
+        else:
+            self.__dirty.add(gradebook.user)
+    
+    def __collect(self,gb):
+        for cat in gb._Gradebook__categories.values():
+            self.__contribute(gb.user,('category',cat.name),
+                              _category_percent(cat))
+            for gr in cat.grades:
+                self.__contribute(gb.user,('grade',gr.name),gr.score)
+        self.__contribute(gb.user,('total',None),gb.get_weighted_stat('percent'))
+    
+    def __summary(self,key,create=False):
+        kind,name = key
+        if kind == 'total':
+            return self.__total
+        table = self.__grades if kind == 'grade' else self.__categories
+        summary = table.get(name)
+        if summary is None and create:
+            summary = table[name] = Summary()
+        return summary
+    
+    def __contribute(self,user,key,value):
+        if value is None:
+            return
+        self.__values[user][key] = value
+        self.__summary(key,True).add(value)
+    
+    def __withdraw(self,user,key):
+        value = self.__values[user].pop(key,None)
+        if value is None:
+            return
+        summary = self.__summary(key)
+        summary.remove(value)
+        if not summary.count and key[0] != 'total':
+            table = self.__grades if key[0] == 'grade' else self.__categories
+            del table[key[1]]
+    
+    def __refresh(self):
+        for user in self.__dirty:
+            self.update_gradebook(self.__tracked[user])
+        changed = [(user,name) for user,name in self.__changed
+                   if user not in self.__dirty and user in self.__tracked]
+        self.__dirty.clear()
+        self.__changed.clear()
+        touched = set()
+        for user,name in changed:
+            gb = self.__tracked[user]
+            gr = gb.get_grade(name)
+            self.__withdraw(user,('grade',name))
+            if gr is None:
+                continue
+            self.__contribute(user,('grade',name),gr.score)
+            touched.add( (user,gr.parent) )
+        for user,cat in touched:
+            self.__withdraw(user,('category',cat.name))
+            self.__contribute(user,('category',cat.name),_category_percent(cat))
+        for user in set(user for user,name in changed):
+            gb = self.__tracked[user]
+            self.__withdraw(user,('total',None))
+            self.__contribute(user,('total',None),gb.get_weighted_stat('percent'))
+    
+    def get_grade(self,name):
+        if self.__dirty or self.__changed:
+            self.__refresh()
+        return self.__grades.get(name)
+    
+    def get_category(self,name):
+        if self.__dirty or self.__changed:
+            self.__refresh()
+        return self.__categories.get(name)
+    
+    def total(self):
+        if self.__dirty or self.__changed:
+            self.__refresh()
+        return self.__total
+    
+    def grade_names(self):
+        if self.__dirty or self.__changed:
+            self.__refresh()
+        return self.__grades.keys()
+    
+    def category_names(self):
+        if self.__dirty or self.__changed:
+            self.__refresh()
+        return self.__categories.keys()
+    
+    def __len__(self):
+        return len(self.__values)
+    
+    def __contains__(self,x):
+        if isinstance(x,Gradebook):
+            return x.user in self.__values
+        return x in self.__values
+
 
 def json_import(json_file,import_types=['Gradelist','Category','Grade'],inherit=False):
     """Import JSON file holding representations of grading data structures.
@@ -814,6 +2553,7 @@ def json_import(json_file,import_types=['Gradelist','Category','Grade'],inherit=
         of a Category defined in the file.
        *ANY NON-CHILD NODES WILL NOT BE RETURNED.
        *Returns the Gradebook only.
+    For large or multi-Gradebook files, see json_iterimport.
     -
     SCHEMA:                                 REQUIRED (has #)
     {"grading":                                 #
@@ -924,12 +2664,18 @@ def json_import(json_file,import_types=['Gradelist','Category','Grade'],inherit=
                 ret_list.append(Grade(name,**attribs))
         return ret_list
     #for inherit
+    return _build_gradebook(grading_list)
+
+def _build_gradebook(grading_list):
+    """Builds a Gradebook (with children) from a list of grading items.
     
+    Implements json_import's inherit-mode; also used to unpickle Gradebooks.
+    """
     grbk = [x for x in grading_list if x.get('type','') == 'Gradebook']
     if not grbk:
         raise ValueError, 'json_import requires a Gradebook in the file for inherit-mode.'
     grbk = grbk[0]
-    grbknm = grbk.pop('name')
+    grbknm = grbk.get('name')
     grbk = Gradebook(grbknm,grbk.get('user'),identifiers=grbk.get('identifiers',{}))
     cat_dict = {}
     for itm in grading_list:
@@ -945,6 +2691,7 @@ def json_import(json_file,import_types=['Gradelist','Category','Grade'],inherit=
             cat_dict[itm['name']]=Category(itm['name'],**attribs)
     grbk.add_category(*cat_dict.values())
     
+    cat_grades = dict((cat_name,[]) for cat_name in cat_dict)
     for itm in grading_list:
         if itm.get('type','') == 'Grade':
             if 'name' not in itm:
@@ -953,42 +2700,436 @@ def json_import(json_file,import_types=['Gradelist','Category','Grade'],inherit=
             if 'parent' not in itm or itm['parent'] not in cat_dict:
                 dbg('Grade parent does not match Category name')
                 continue
-            grbk.add_grade(itm['parent'],Grade(itm['name'],**attribs))
+            cat_grades[itm['parent']].append(Grade(itm['name'],**attribs))
+    for cat_name in cat_grades:
+        try:
+            grbk.add_grades_bulk(cat_name,cat_grades[cat_name])
+        except NameError, err:
+            dbg(err)
     return grbk
 
+#JSON whitespace, for walking the grading array by hand
+_JSON_WS = re.compile(r'[ \t\n\r]*')
 
+class _GradingItemParser(object):
+    """Incrementally decodes the items of a {"grading": [...]} document.
+    
+    feed(data) takes the next piece of the document and returns the items
+    completed by it; close() checks that the document ended. Only the
+    item being decoded is buffered. An item that doesn't decode yet is
+    retried once the buffer has doubled, so a big item split over many
+    pieces isn't re-decoded for every one.
+    """
+    def __init__(self):
+        import json
+        object.__init__(self)
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._state = 'start'
+        self._retry_at = 0
+    
+    def _char(self):
+        #next non-whitespace character (without consuming it), or None
+        self._pos = _JSON_WS.match(self._buf,self._pos).end()
+        if self._pos < len(self._buf):
+            return self._buf[self._pos]
+        return None
+    
+    def _expect(self,chars):
+        c = self._char()
+        if c is None:
+            return None
+        if c not in chars:
+            raise ValueError, 'Expected {!r} at {!r} in JSON grading ' \
+                    'document.'.format(chars,self._buf[self._pos:][:20])
+        self._pos += 1
+        return c
+    
+    def _decode(self,final=False):
+        if self._char() is None:
+            return False,None
+        if len(self._buf) < self._retry_at and not final:
+            return False,None
+        try:
+            obj,end = self._decoder.raw_decode(self._buf,self._pos)
+        except ValueError:
+            if final:
+                raise
+            self._retry_at = 2*len(self._buf)
+            return False,None
+        self._pos = end
+        self._retry_at = 0
+        return True,obj
+    
+    def feed(self,data,final=False):
+        self._buf = self._buf[self._pos:]+data
+        self._pos = 0
+        items = []
+        while self._state != 'done':
+            state = self._state
+            if state == 'start':
+                if self._expect('{') is None: break
+                self._state = 'key'
+            elif state == 'key':
+                #the array's key; json_import likewise takes the first value
+                if not self._decode(final)[0]: break
+                self._state = 'colon'
+            elif state == 'colon':
+                if self._expect(':') is None: break
+                self._state = 'open'
+            elif state == 'open':
+                if self._expect('[') is None: break
+                self._state = 'first'
+            elif state == 'first':
+                c = self._char()
+                if c is None: break
+                if c == ']':
+                    self._pos += 1
+                    self._state = 'done'
+                else:
+                    self._state = 'item'
+            elif state == 'item':
+                done,obj = self._decode(final)
+                if not done: break
+                items.append(obj)
+                self._state = 'sep'
+            elif state == 'sep':
+                c = self._expect(',]')
+                if c is None: break
+                self._state = 'item' if c == ',' else 'done'
+        return items
+    
+    def close(self):
+        items = self.feed('',final=True)
+        if self._state != 'done':
+            raise ValueError, 'Unexpected end of JSON grading document.'
+        return items
 
-def json_export(json_file,gradebook):
-    """Output a Gradebook to the file json_file
+def _iter_grading_items(json_file,chunk_size=65536):
+    """Yields the decoded items of a {"grading": [...]} document one at a
+    time, reading json_file in chunks.
     
-    json_file can be a writeable file-like object, or a filepath.
-    WILL overwrite file!
+    Only the item being decoded (plus one chunk) is held in memory.
     """
+    parser = _GradingItemParser()
+    while True:
+        data = json_file.read(chunk_size)
+        if not data:
+            break
+        for item in parser.feed(data):
+            yield item
+        if parser._state == 'done':
+            return
+    for item in parser.close():
+        yield item
+
+class _GradingAssembler(object):
+    """Turns json_import items into objects, as json_iterimport yields
+    them; add(item) and finish() return the objects completed."""
+    def __init__(self,import_types,inherit):
+        object.__init__(self)
+        if isinstance(import_types,basestring):
+            import_types = [import_types]
+        self.import_types = import_types
+        self.inherit = inherit
+        self.cats = {}           #Category name -> latest Category
+        self.orphan_cats = {}    #Gradebook name -> [Category]
+        self.orphan_grades = {}  #Category name -> [Grade]
+        self.current = None
+        self.items_first = None  #json_export layout; set by the 1st Gradebook
     
+    def add(self,obj):
+        if not isinstance(obj,dict):
+            raise TypeError, 'Unexpected type in grading array: \'{}\''.format(type(obj))
+        typ = obj.get('type')
+        if typ not in ['Gradebook','Category','Grade']:
+            raise ValueError, 'type value "{}" is not an accepted value.'.format(typ)
+        if 'name' not in obj:
+            raise KeyError, 'Could not find \'name\' key in structure.'
+        name = obj['name']
+        attribs = obj.get('attribs',{})
+        if not isinstance(attribs,dict):
+            raise ValueError, 'attribs of \'{}\' is not an object as expected.'.format(name)
+        
+        if not self.inherit:
+            if typ not in self.import_types:
+                return []
+            if typ == 'Gradebook':
+                identifs = obj.get('identifiers',{})
+                if not isinstance(identifs,dict):
+                    identifs = {}
+                return [Gradebook(name,obj.get('user'),identifiers=identifs)]
+            elif typ == 'Category':
+                return [Category(name,**attribs)]
+            return [Grade(name,**attribs)]
+        
+        done = []
+        cats = self.cats
+        parent = obj.get('parent')
+        if typ == 'Gradebook':
+            #a Gradebook item is a book boundary in both layouts: it closes
+            #the previous book (parent first) or its own (json_export)
+            if self.items_first is None:
+                self.items_first = bool(self.cats or self.orphan_cats or
+                                        self.orphan_grades)
+            if self.current is not None:
+                done.append(self.current)
+                self.current = None
+            identifs = obj.get('identifiers',{})
+            if not isinstance(identifs,dict):
+                identifs = {}
+            gradebook = Gradebook(name,obj.get('user'),identifiers=identifs)
+            adopted = self.orphan_cats.pop(name,[])
+            try:
+                gradebook.add_category(*adopted)
+            except NameError, err:
+                dbg(err)
+            if self.orphan_cats or self.orphan_grades:
+                dbg('json_iterimport dropped items whose parents were not found')
+            self.cats = {}
+            self.orphan_cats = {}
+            self.orphan_grades = {}
+            if self.items_first:
+                done.append(gradebook)
+            else:
+                self.current = gradebook
+        elif typ == 'Category':
+            cat = Category(name,**attribs)
+            cats[name] = cat
+            _add_orphans(cat,self.orphan_grades.pop(name,[]))
+            if self.current is not None and parent == self.current.name:
+                try:
+                    self.current.add_category(cat)
+                except NameError, err:
+                    dbg(err)
+            else:
+                self.orphan_cats.setdefault(parent,[]).append(cat)
+        else:
+            gr = Grade(name,**attribs)
+            if parent in cats:
+                _add_orphans(cats[parent],[gr])
+            else:
+                self.orphan_grades.setdefault(parent,[]).append(gr)
+        return done
+    
+    def finish(self):
+        if self.orphan_cats or self.orphan_grades:
+            dbg('json_iterimport dropped items whose parents were not found')
+        if self.current is not None:
+            current,self.current = self.current,None
+            return [current]
+        return []
+
+def json_iterimport(json_file,import_types=['Gradebook','Category','Grade'],
+                    inherit=False,chunk_size=65536):
+    """Incrementally import a JSON file in json_import's schema.
+    
+    Reads through the 'grading' array chunk by chunk instead of decoding
+    the whole document, so memory is bounded by the objects being built
+    rather than by the size of the file.
+    
+    Without inherit, yields each Gradebook, Category and Grade (of the
+    import_types) as soon as it is read, unlinked.
+    With inherit, links Categories to Gradebooks and Grades to Categories
+    by their 'parent' names and yields each Gradebook once it is complete
+    (when the next Gradebook starts, or at the end of the file). Children
+    that appear before their parent are buffered only until the parent
+    shows up; any still orphaned at the end are dropped.
+    A file may hold many Gradebooks, each with its items either all after
+    it (as json_iterexport writes them) or all before it (as json_export
+    does). The Gradebook items separate the books, so a Category or Grade
+    is only ever attached within its own book, even when names repeat.
+    The layout is taken from the first Gradebook: if no items come before
+    it, the file is read parent-first.
+    For non-blocking sources, see GradingFeedParser.
+    """
     try:
         import json
     except ImportError:
-        warnings.warn('Failed to import json module. Cannot execute json_export')
+        warnings.warn('Failed to import json module. Cannot execute json_iterimport')
         return
-    if not hasattr(json_file,'write'):
-        if not isinstance(json_file,basestring) or not \
-                os.path.exists(os.path.dirname(os.path.abspath(json_file))):
+    close = False
+    if not hasattr(json_file,'read'):
+        if not isinstance(json_file,basestring) or not os.path.exists(json_file):
             raise ValueError, 'Argument \'json_file\' is not readable, ' \
                     'and could not be validated as a file path.'
+        json_file = open(json_file)
+        close = True
+    
+    assembler = _GradingAssembler(import_types,inherit)
+    try:
+        for obj in _iter_grading_items(json_file,chunk_size):
+            for done in assembler.add(obj):
+                yield done
+        for done in assembler.finish():
+            yield done
+    finally:
+        if close:
+            json_file.close()
+
+class GradingFeedParser(object):
+    """A push parser for json_import documents, for event-driven I/O.
+    
+    Instead of reading a file, it is fed the document piece by piece as
+    the data arrives (e.g. from a non-blocking socket or stream), and
+    returns the objects json_iterimport would yield as they complete:
+        parser = GradingFeedParser(inherit=True)
+        for data in chunks:
+            for gradebook in parser.feed(data):
+                ...
+        gradebooks = parser.close()
+    Each feed() does work proportional to the data given (plus the item
+    it completes), so feeding bounded pieces keeps every step short
+    enough to run on an event loop, or on a worker thread of an executor.
+    close() raises ValueError if the document is incomplete or invalid.
+    """
+    def __init__(self,import_types=['Gradebook','Category','Grade'],inherit=False):
+        object.__init__(self)
+        self._items = _GradingItemParser()
+        self._assembler = _GradingAssembler(import_types,inherit)
+    
+    def feed(self,data):
+        done = []
+        for obj in self._items.feed(data):
+            done.extend(self._assembler.add(obj))
+        return done
+    
+    def close(self):
+        done = []
+        for obj in self._items.close():
+            done.extend(self._assembler.add(obj))
+        return done+self._assembler.finish()
+
+def _add_orphans(cat,grades):
+    try:
+        cat.grades.add_grades_bulk(grades)
+    except NameError, err:
+        dbg(err)
+
+def _json_load_batch(paths):
+    """Imports json_export files for json_iterimport_files (in a worker).
+    
+    Returns [(path,gradebook,error)]; Gradebooks are pickled as tuples of
+    their Grades' values (see Gradebook.__reduce__).
+    """
+    results = []
+    for path in paths:
+        try:
+            with open(path) as json_file:
+                gb = json_import(json_file,inherit=True)
+        except Exception as err:
+            results.append( (path,None,'{}: {}'.format(type(err).__name__,err)) )
         else:
-            json_file = open(json_file,'w+')
+            results.append( (path,gb,None) )
+    return results
+
+def json_iterimport_files(paths,processes=None,batch_size=None):
+    """Import many single-Gradebook json_export files on a process pool.
     
-    if not isinstance(gradebook,Gradebook):
-        raise TypeError, 'gradebook argument must be a Gradebook objcet.'
+    paths is a directory (all of its *.json files), a glob pattern, or an
+    iterable of file paths. Each file is read as json_import(inherit=True)
+    would, and lists of (path,gradebook,error) are yielded in path order,
+    one per batch of batch_size files; a file that fails to load has
+    gradebook None and error a message, and doesn't stop the others.
+    
+    processes   Size of the multiprocessing pool (default: one per CPU).
+                    With processes=1, files are loaded in this process.
+    batch_size  Files per worker task (default: about four batches per
+                    process, at most 256).
+    Workers parse and validate; Gradebooks are sent back as tuples of
+    Grade values and rebuilt here without re-validation.
+    """
+    import glob
+    if isinstance(paths,basestring):
+        if os.path.isdir(paths):
+            paths = os.path.join(paths,'*.json')
+        paths = sorted(glob.glob(paths))
+    else:
+        paths = list(paths)
+    if not paths:
+        return
+    import multiprocessing
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if batch_size is None:
+        batch_size = min(256,max(1,len(paths)//(4*processes)))
+    batches = [paths[i:i+batch_size] for i in xrange(0,len(paths),batch_size)]
+    if processes == 1 or len(batches) < 2:
+        for batch in batches:
+            yield _json_load_batch(batch)
+        return
+    pool = multiprocessing.Pool(min(processes,len(batches)))
+    try:
+        for results in pool.imap(_json_load_batch,batches):
+            yield results
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def json_import_files(paths,processes=None,batch_size=None):
+    """Import many json_export files; see json_iterimport_files.
+    
+    Returns (gradebooks,errors): the Gradebooks in path order and a dict
+    of {path: error message} for the files that failed.
+    """
+    gradebooks,errors = [],{}
+    for results in json_iterimport_files(paths,processes,batch_size):
+        for path,gb,err in results:
+            if err is None:
+                gradebooks.append(gb)
+            else:
+                errors[path] = err
+    return gradebooks,errors
+
+def _grade_attribs(gr,raw=False):
+    """A Grade's json_export 'attribs' (resolved maximum and weight, or
+    the Grade's own if raw)."""
+    attribs = {}
+    attribs['score'] = gr.score
+    attribs['maximum'] = gr.maximum if raw else gr.getMaximum()
+    attribs['weight'] = gr.weight if raw else gr.getWeight()
+    attribs['extra_credit'] = gr.extra_credit
+    if gr._overrides:
+        attribs['overrides'] = [ovrrd for ovrrd in gr._overrides
+                                if isinstance(ovrrd,basestring)]
+    tmstmp = gr._timestamp_epoch()
+    if tmstmp is not None:
+        attribs['timestamp'] = tmstmp
+    if gr._identifiers:
+        attribs['identifiers'] = dict(gr._identifiers)
+    return attribs
+
+def _export_items(gradebook,parent_first=False,extra=None):
+    """Yields the json_export representation of a Gradebook, item by item.
     
-    cat_dict = dict(gradebook._Gradebook__categories)
-    all_items = []
-    for cat_name in cat_dict:
-        gr_leest = cat_dict[cat_name].grades.select(docopy=True,aslist=True)
-        for i in gr_leest:
+    Grades are read in place (no copies), with their resolved maximum and
+    weight. By default each Category's Grades come before the Category and
+    the Gradebook is last; with parent_first, the Gradebook comes first and
+    each Category is followed by its Grades. extra is a dict of further
+    keys for the Gradebook item (ignored by json_import).
+    """
+    cat_dict = gradebook._Gradebook__categories
+    grbk = {'type':'Gradebook','name':gradebook.name,'user':gradebook.user}
+    if gradebook.attribs.get('identifiers'):
+        grbk['identifiers'] = dict(gradebook.attribs['identifiers'])
+    if extra:
+        grbk.update(extra)
+    if parent_first:
+        yield grbk
+    for cat_name in cat_dict.keys():
+        cat = cat_dict[cat_name]
+        catt = {'type':'Category','name':cat_name}
+        if cat.parent is not None:
+            catt['parent'] = cat.parent.name
+        else:
+            catt['parent'] = None
+        catt['attribs'] = dict(cat._Category__attribs)
+        if parent_first:
+            yield catt
+        for i in list(cat.grades):
             x = {}
-            if not isinstance(i,Grade):
-                continue
             x['type']='Grade'
             x['name']=i.name
             if i.parent is not None:
@@ -996,38 +3137,1233 @@ def json_export(json_file,gradebook):
                     x['parent'] = i.parent.name
                 else:
                     x['parent'] = None
-            attribs = {}
-            attribs['score'] = i.score
-            attribs['maximum'] = i.maximum
-            attribs['weight'] = i.weight
-            attribs['extra_credit'] = i.extra_credit
-            if i.overrides:
-                attribs['overrides'] = list(i.overrides)
-                for ovrrd in i.overrides:
-                    if not isinstance(overrd,basestring):
-                        attribs['overrides'].remove(overrd)
-            if i.timestamp and isinstance(i.timestamp,datetime.datetime):
-                tmstmp = calendar.timegm(i.timestamp.utctimetuple())
-                attribs['timestamp'] = tmstmp
-            if i.identifiers:
-                attribs['identifiers'] = dict(i.identifiers)
-            
-            x['attribs'] = attribs
-            all_items.append(x)
-        catt = {'type':'Category','name':cat_name}
-        if cat_dict[cat_name].parent is not None:
-            catt['parent'] = cat_dict[cat_name].parent.name
+            x['attribs'] = _grade_attribs(i)
+            yield x
+        if not parent_first:
+            yield catt
+    
+    if not parent_first:
+        yield grbk
+
+def json_iterencode(gradebooks,indent=None,chunk_size=65536):
+    """Yields the json_iterexport document of gradebooks as strings of
+    about chunk_size characters (one item may make a chunk longer).
+    
+    Each chunk is encoded only when asked for, so a caller writing to a
+    non-blocking stream can send each one before encoding the next.
+    gradebooks may be a Gradebook or an iterable of them (e.g. a Roster).
+    """
+    if isinstance(gradebooks,Gradebook):
+        gradebooks = [gradebooks]
+    def items():
+        for gradebook in gradebooks:
+            if not isinstance(gradebook,Gradebook):
+                raise TypeError, 'gradebooks must be Gradebook objects.'
+            for item in _export_items(gradebook,parent_first=True):
+                yield item
+    return _encode_items(items(),indent,chunk_size)
+
+def _encode_items(items,indent=None,chunk_size=65536):
+    """Yields the {"grading": [...]} document of an iterable of items in
+    chunks, as described in json_iterencode."""
+    import json
+    encoder = json.JSONEncoder(indent=indent,separators=(', ',': '))
+    sep = '\n' if indent is None else '\n'+' '*indent
+    parts,size = ['{"grading": ['],0
+    first = True
+    for item in items:
+        enc = encoder.encode(item).replace('\n',sep)
+        parts.append(sep if first else ','+sep)
+        parts.append(enc)
+        size += len(enc)
+        first = False
+        if size >= chunk_size:
+            yield ''.join(parts)
+            parts,size = [],0
+    parts.append('\n]}\n')
+    yield ''.join(parts)
+
+def json_iterexport(json_file,gradebooks,indent=None):
+    """Write one or many Gradebooks to json_file, item by item.
+    
+    Produces the same {"grading": [...]} document as json_export, but
+    reads Grades without copying them and writes each chunk as soon as it
+    is encoded (see json_iterencode), so memory doesn't grow with the size
+    of the Gradebooks.
+    gradebooks may be a Gradebook or an iterable of them (e.g. a Roster).
+    Items are written parent-first, as json_iterimport expects for
+    multi-Gradebook files.
+    json_file can be a writeable file-like object (left open), or a
+    filepath (overwritten).
+    """
+    try:
+        import json
+    except ImportError:
+        warnings.warn('Failed to import json module. Cannot execute json_iterexport')
+        return
+    close = False
+    if not hasattr(json_file,'write'):
+        if not isinstance(json_file,basestring) or not \
+                os.path.exists(os.path.dirname(os.path.abspath(json_file))):
+            raise ValueError, 'Argument \'json_file\' is not writeable, ' \
+                    'and could not be validated as a file path.'
+        json_file = open(json_file,'w')
+        close = True
+    try:
+        for chunk in json_iterencode(gradebooks,indent):
+            json_file.write(chunk)
+    finally:
+        if close:
+            json_file.close()
+
+
+
+def json_export(json_file,gradebook):
+    """Output a Gradebook to the file json_file
+    
+    json_file can be a writeable file-like object (left open), or a
+    filepath (WILL overwrite file!).
+    """
+    
+    try:
+        import json
+    except ImportError:
+        warnings.warn('Failed to import json module. Cannot execute json_export')
+        return
+    close = False
+    if not hasattr(json_file,'write'):
+        if not isinstance(json_file,basestring) or not \
+                os.path.exists(os.path.dirname(os.path.abspath(json_file))):
+            raise ValueError, 'Argument \'json_file\' is not readable, ' \
+                    'and could not be validated as a file path.'
         else:
-            catt['parent'] = None
-        catt['attribs'] = dict(cat_dict[cat_name]._Category__attribs)
-        all_items.append(catt)
+            json_file = open(json_file,'w+')
+            close = True
     
-    grbk = {'type':'Gradebook','name':gradebook.name,'user':gradebook.user}
-    all_items.append(grbk)
+    if not isinstance(gradebook,Gradebook):
+        raise TypeError, 'gradebook argument must be a Gradebook objcet.'
+    
+    all_items = list(_export_items(gradebook))
     enc_me = {"grading": all_items}
     
     encoder = json.JSONEncoder(indent=4,separators=(', ',': '))
     enc = encoder.encode(enc_me)
     
     json_file.write(enc)
-    json_file.close()
+    if close:
+        json_file.close()
+
+
+def _journal_value(value):
+    """A change's value as JSON (datetimes as epoch seconds, sets as lists)."""
+    if isinstance(value,datetime.datetime):
+        return calendar.timegm(value.utctimetuple()) + value.microsecond/1e6
+    if isinstance(value,(set,frozenset)):
+        return sorted(value)
+    return value
+
+def _journal_record(change):
+    """The journal line for a Gradebook observer change.
+    
+    Added Grades are recorded with their own maximum and weight, not the
+    ones their Category resolves them to.
+    """
+    op = change[0]
+    if op == 'add':
+        gr = change[2]
+        return [op,change[1],gr.name,_grade_attribs(gr,raw=True)]
+    if op == 'add_category':
+        cat = change[1]
+        return [op,cat.name,cat._Category__attribs,
+                [[gr.name,_grade_attribs(gr,raw=True)] for gr in cat.grades]]
+    if op in ('set','category'):
+        return [op,change[1],change[2],_journal_value(change[3])]
+    return list(change)
+
+def journal_replay(gradebook,journal_file,after=0):
+    """Applies the changes recorded by a Journal to gradebook.
+    
+    Records numbered at or below after (the number Journal.compact saves
+    in its snapshot) are already in the snapshot and are skipped.
+    Changes that no longer apply (e.g. adding a Grade that exists, or
+    setting one that doesn't) are skipped too. A torn last line, as left
+    by a crash mid-write, is ignored.
+    journal_file can be a readable file-like object (left open), or a
+    filepath. Returns the number of changes applied.
+    """
+    import json
+    close = False
+    if not hasattr(journal_file,'read'):
+        if not os.path.exists(journal_file):
+            return 0
+        journal_file = open(journal_file,'rb')
+        close = True
+    applied = 0
+    try:
+        for line in journal_file:
+            if not line.endswith('\n'):
+                break
+            rec = json.loads(line)
+            if isinstance(rec[0],(int,long)):   #numbered record
+                if rec[0] <= after:
+                    continue
+                rec = rec[1:]
+            op = rec[0]
+            if op == 'set':
+                gr = gradebook.get_grade(rec[1])
+                if gr is None:
+                    continue
+                if rec[2] == 'overrides':
+                    Grade.overrides.fset(gr,set(rec[3]))
+                    if isinstance(gr.parent,Category):
+                        gr.parent.grades._invalidate()
+                else:
+                    setattr(gr,rec[2],rec[3])
+            elif op == 'rename':
+                gr = gradebook.get_grade(rec[1])
+                if gr is None or rec[2] in gradebook:
+                    continue
+                gr.name = rec[2]
+            elif op == 'add':
+                cat = gradebook.get_category(rec[1])
+                if cat is None or rec[2] in gradebook:
+                    continue
+                cat.grades.add_grades_bulk([Grade(rec[2],**rec[3])])
+            elif op == 'remove':
+                cat = gradebook.get_category(rec[1])
+                if cat is None or cat.grades.get_grade(rec[2]) is None:
+                    continue
+                cat.grades.remove_grades(rec[2])
+            elif op == 'category':
+                cat = gradebook.get_category(rec[1])
+                if cat is None:
+                    continue
+                setattr(cat,rec[2],rec[3])
+            elif op == 'add_category':
+                if rec[1] in gradebook:
+                    continue
+                cat = Category(rec[1],**rec[2])
+                gradebook.add_category(cat)
+                cat.grades.add_grades_bulk([Grade(name,**attribs)
+                            for name,attribs in rec[3]
+                            if name not in gradebook])
+            elif op == 'remove_category':
+                if gradebook.get_category(rec[1]) is None:
+                    continue
+                gradebook.remove_category(rec[1])
+            else:
+                raise ValueError, 'Unknown journal record \'{}\'.'.format(op)
+            applied += 1
+    finally:
+        if close:
+            journal_file.close()
+    return applied
+
+class Journal(object):
+    """An append-only log of a Gradebook's changes, for cheap saving.
+    
+    Every change the Gradebook reports to its observers (score and other
+    Grade assignments, Grades added/removed/renamed, Category attribute
+    changes, Categories added/removed) is appended to journal_file as one
+    JSON line and flushed, so saving costs time proportional to the
+    number of changes. The full state is the last json_export snapshot
+    plus the journal replayed on top of it (see journal_open), and
+    compact() folds the journal into a fresh snapshot. Replay before
+    attaching a Journal, or the replayed changes are journaled again.
+    With sync=True every record is also fsync'd.
+    Records are numbered, continuing from seq or from the last record
+    already in journal_file, whichever is higher; a torn last record is
+    cut off before appending.
+    """
+    def __init__(self,gradebook,journal_file,snapshot_file=None,sync=False,
+                 seq=0):
+        object.__init__(self)
+        if not isinstance(gradebook,Gradebook):
+            raise TypeError, 'gradebook argument must be a Gradebook object.'
+        self.gradebook = gradebook
+        self.journal_file = journal_file
+        self.snapshot_file = snapshot_file
+        self.sync = sync
+        self._file = open(journal_file,'ab')
+        self.seq = max(seq,self._last_seq())
+        gradebook.add_observer(self.record)
+    
+    def _last_seq(self):
+        """Number of the journal's last complete record (0 if none);
+        drops a torn last line."""
+        import json
+        last,end = 0,0
+        with open(self.journal_file,'rb') as journal:
+            for line in journal:
+                if not line.endswith('\n'):
+                    break
+                end += len(line)
+                rec = json.loads(line)
+                if isinstance(rec[0],(int,long)):
+                    last = rec[0]
+        if end < os.path.getsize(self.journal_file):
+            self._file.truncate(end)
+        return last
+    
+    def record(self,gradebook,change):
+        """Gradebook observer: appends one change to the journal."""
+        import json
+        self.seq += 1
+        self._file.write(json.dumps([self.seq]+_journal_record(change),
+                                    separators=(',',':'))+'\n')
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+    
+    def compact(self,snapshot_file=None):
+        """Writes the Gradebook to a fresh snapshot and empties the journal.
+        
+        The snapshot is written to a temporary file and renamed over the
+        old one, so a crash leaves either the old snapshot and its journal
+        or the new snapshot. The snapshot's Gradebook item records the
+        number of the last record it includes ("journal"), and
+        journal_open skips the records up to it if a crash left them in
+        the journal.
+        """
+        snapshot_file = snapshot_file or self.snapshot_file
+        if snapshot_file is None:
+            raise ValueError, 'Journal has no snapshot file to compact into.'
+        tmp = snapshot_file+'.tmp'
+        with open(tmp,'w') as out:
+            for chunk in _encode_items(_export_items(self.gradebook,True,
+                                                     {'journal':self.seq})):
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+        os.rename(tmp,snapshot_file)
+        self.snapshot_file = snapshot_file
+        self._file.truncate(0)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+    
+    def close(self):
+        if self.record in self.gradebook._observers:
+            self.gradebook.remove_observer(self.record)
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,*exc):
+        self.close()
+
+def journal_open(snapshot_file,journal_file,sync=False):
+    """Loads a json_export snapshot, replays its journal on top and
+    returns a Journal recording further changes (its Gradebook is
+    Journal.gradebook)."""
+    import json
+    with open(snapshot_file) as snap:
+        items = json.load(snap).values()[0]
+    gradebook = _build_gradebook(items)
+    seq = [x.get('journal',0) for x in items if x.get('type') == 'Gradebook']
+    seq = seq[0] if seq else 0
+    journal_replay(gradebook,journal_file,seq)
+    return Journal(gradebook,journal_file,snapshot_file,sync,seq)
+
+def _csv_score(cell):
+    """Parses a CSV cell as a score; blank or non-numeric cells are None."""
+    cell = cell.strip()
+    if not cell:
+        return None
+    try:
+        return int(cell)
+    except ValueError:
+        try:
+            return float(cell)
+        except ValueError:
+            return None
+
+def _csv_cell(value):
+    if value is None:
+        return ''
+    if isinstance(value,float):
+        return repr(value)
+    if isinstance(value,unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+def csv_iterimport(csv_file,template,user_column='user',columns=None):
+    """Read an LMS-style CSV (one row per student, one column per Grade),
+    yielding one Gradebook per row.
+    
+    template is a Gradebook whose Categories and Grades give every
+    Gradebook its structure: a column named like a template Grade sets
+    that Grade's score, and template Grades without a column are copied
+    as they are. columns may map other headers to the Category their
+    Grades should go in, e.g. {'Quiz 9':'Quizzes'}; remaining columns
+    are ignored. Blank or non-numeric cells give a score of None.
+    Rows are read one at a time, so memory doesn't grow with the file.
+    csv_file can be a readable file-like object (left open), or a filepath.
+    """
+    import csv
+    close = False
+    if not hasattr(csv_file,'read'):
+        if not isinstance(csv_file,basestring) or not os.path.isfile(csv_file):
+            raise ValueError, 'Argument \'csv_file\' is not readable, ' \
+                    'and could not be validated as a file path.'
+        csv_file = open(csv_file,'rb')
+        close = True
+    if not isinstance(template,Gradebook):
+        raise TypeError, 'template argument must be a Gradebook object.'
+    columns = columns or {}
+    
+    categories = template._Gradebook__categories
+    cat_names = list(categories)
+    cat_attribs = [categories[c]._Category__attribs for c in cat_names]
+    try:
+        reader = csv.reader(csv_file)
+        header = next(reader,None)
+        if header is None:
+            return
+        if user_column not in header:
+            raise ValueError, 'CSV has no \'{}\' column.'.format(user_column)
+        user_at = header.index(user_column)
+        #plan: (column,category index,template Grade or name)
+        plan,seen = [],set()
+        for i,head in enumerate(header):
+            gr = template.get_grade(head)
+            if gr is not None and isinstance(gr.parent,Category):
+                plan.append( (i,cat_names.index(gr.parent.name),gr) )
+                seen.add(gr)
+            elif head in columns:
+                if columns[head] not in categories:
+                    raise ValueError, 'Category \'{}\' not in template.'.format(columns[head])
+                plan.append( (i,cat_names.index(columns[head]),head) )
+        for c,cat_name in enumerate(cat_names):
+            for gr in categories[cat_name].grades:
+                if gr not in seen:
+                    plan.append( (None,c,gr) )
+        
+        identifiers = template.attribs.get('identifiers') or {}
+        for row in reader:
+            if not row:
+                continue
+            gb = Gradebook(template.name,row[user_at],
+                           identifiers=copy.deepcopy(identifiers))
+            cats = [Category(name,**attribs)
+                    for name,attribs in zip(cat_names,cat_attribs)]
+            per_cat = [[] for cat in cats]
+            for i,c,gr in plan:
+                score = _csv_score(row[i]) if i is not None and i < len(row) \
+                        else None
+                if type(gr) is Grade:
+                    gr = gr._shared_copy(None,gr.score if i is None else score,
+                                         gr.maximum,gr.weight)
+                else:
+                    gr = Grade(gr,score=score)
+                per_cat[c].append(gr)
+            gb.add_category(*cats)
+            for cat,grades in zip(cats,per_cat):
+                cat.grades.add_grades_bulk(grades)
+            yield gb
+    finally:
+        if close:
+            csv_file.close()
+
+def csv_import(csv_file,template,user_column='user',columns=None,name=None):
+    """Read an LMS-style CSV into a Roster; see csv_iterimport.
+    
+    The Roster is named name, or after the template Gradebook.
+    """
+    return Roster(template.name if name is None else name,
+                  *csv_iterimport(csv_file,template,user_column,columns))
+
+def csv_export(csv_file,gradebooks,user_column='user',columns=None):
+    """Write Gradebooks as an LMS-style CSV, one row per Gradebook.
+    
+    gradebooks may be a Gradebook or an iterable of them (e.g. a Roster);
+    each row is written as soon as its Gradebook is read. columns lists
+    the Grade names to write, by default those of the first Gradebook,
+    sorted by Category name and then Grade name. Missing Grades and
+    unscored ones are left blank.
+    csv_file can be a writeable file-like object (left open), or a
+    filepath (overwritten).
+    """
+    import csv
+    close = False
+    if not hasattr(csv_file,'write'):
+        if not isinstance(csv_file,basestring) or not \
+                os.path.exists(os.path.dirname(os.path.abspath(csv_file))):
+            raise ValueError, 'Argument \'csv_file\' is not writeable, ' \
+                    'and could not be validated as a file path.'
+        csv_file = open(csv_file,'wb')
+        close = True
+    if isinstance(gradebooks,Gradebook):
+        gradebooks = [gradebooks]
+    gradebooks = iter(gradebooks)
+    try:
+        first = next(gradebooks,None)
+        if columns is None:
+            columns = []
+            if first is not None:
+                categories = first._Gradebook__categories
+                for cat_name in sorted(categories):
+                    columns.extend(sorted(gr.name for gr in
+                                          categories[cat_name].grades))
+        writer = csv.writer(csv_file)
+        writer.writerow([_csv_cell(c) for c in [user_column]+list(columns)])
+        if first is None:
+            return
+        for gradebook in itertools.chain([first],gradebooks):
+            if not isinstance(gradebook,Gradebook):
+                raise TypeError, 'gradebooks must be Gradebook objects.'
+            row = [_csv_cell(gradebook.user)]
+            for col in columns:
+                gr = gradebook.get_grade(col)
+                row.append('' if gr is None else _csv_cell(gr.score))
+            writer.writerow(row)
+    finally:
+        if close:
+            csv_file.close()
+
+
+#Binary snapshots (see snapshot_export):
+#   header, string offsets (uint64 x n_strings+1), string blob,
+#   Category records, Grade records; all little-endian.
+_SNAP_MAGIC = 'GRDSNAP1'
+_SNAP_VERSION = 1
+_SNAP_HEADER = struct.Struct('<8sIIIIQQQQ')
+_SNAP_CATEGORY = struct.Struct('<II')           #name, attribs
+_SNAP_GRADE = struct.Struct('<IIIIIIdddd')      #name, category, identifiers,
+                                                # overrides, flags, (pad),
+                                                # score, maximum, weight,
+                                                # timestamp
+_SNAP_NONE = 0xFFFFFFFF
+#Grade record flags
+_SNAP_SCORE,_SNAP_SCORE_INT = 1,2
+_SNAP_MAX,_SNAP_MAX_INT = 4,8
+_SNAP_WEIGHT,_SNAP_WEIGHT_INT = 16,32
+_SNAP_EXTRA = 64
+_SNAP_TIME,_SNAP_TIME_INT = 128,256
+
+def _snap_number(value,has,is_int,field):
+    """Packs an optional number as (flags,float)."""
+    if value is None:
+        return 0,0.0
+    if not isinstance(value,numbers.Real):
+        raise TypeError, '{} {!r} cannot be stored in a snapshot.'.format(field,value)
+    return has|(is_int if isinstance(value,numbers.Integral) else 0),float(value)
+
+def snapshot_export(snapshot_file,gradebook):
+    """Write a Gradebook to a binary snapshot that snapshot_open can map.
+    
+    Each Grade is a fixed-width record (score, maximum, weight, timestamp
+    as doubles, plus flags), with names, identifiers, overrides and
+    Category attribs in a string table of JSON values. Unlike json_export,
+    Grades keep their own maximum/weight (Category control is restored
+    from the Category records).
+    snapshot_file can be a writeable binary file-like object (left open),
+    or a filepath (overwritten).
+    """
+    import json
+    if not isinstance(gradebook,Gradebook):
+        raise TypeError, 'gradebook argument must be a Gradebook object.'
+    close = False
+    if not hasattr(snapshot_file,'write'):
+        if not isinstance(snapshot_file,basestring) or not \
+                os.path.exists(os.path.dirname(os.path.abspath(snapshot_file))):
+            raise ValueError, 'Argument \'snapshot_file\' is not writeable, ' \
+                    'and could not be validated as a file path.'
+        snapshot_file = open(snapshot_file,'wb')
+        close = True
+    
+    strings,string_ids = [],{}
+    def _strref(value):
+        if value is None:
+            return _SNAP_NONE
+        enc = json.dumps(value,sort_keys=True)
+        if enc not in string_ids:
+            string_ids[enc] = len(strings)
+            strings.append(enc)
+        return string_ids[enc]
+    _strref({'name':gradebook.name,'user':gradebook.user,
+            'identifiers':gradebook.attribs.get('identifiers') or {}})
+    
+    cat_records,grade_records = [],[]
+    for cat in gradebook._Gradebook__categories.values():
+        cat_records.append(_SNAP_CATEGORY.pack(_strref(cat.name),
+                                               _strref(cat._Category__attribs)))
+        for gr in cat.grades:
+            flags,score = _snap_number(gr.score,_SNAP_SCORE,_SNAP_SCORE_INT,'score')
+            f,maximum = _snap_number(gr.maximum,_SNAP_MAX,_SNAP_MAX_INT,'maximum')
+            flags |= f
+            f,weight = _snap_number(gr.weight,_SNAP_WEIGHT,_SNAP_WEIGHT_INT,'weight')
+            flags |= f
+            tmstmp = gr._timestamp
+            if isinstance(tmstmp,datetime.datetime):
+                tmstmp = calendar.timegm(tmstmp.utctimetuple()) + \
+                         tmstmp.microsecond/1e6
+            f,tmstmp = _snap_number(tmstmp,_SNAP_TIME,_SNAP_TIME_INT,'timestamp')
+            flags |= f
+            if gr.extra_credit:
+                flags |= _SNAP_EXTRA
+            grade_records.append(_SNAP_GRADE.pack(_strref(gr.name),
+                        len(cat_records)-1,_strref(gr._identifiers or None),
+                        _strref(sorted(gr._overrides) if gr._overrides else None),
+                        flags,0,score,maximum,weight,tmstmp))
+    
+    blob = [s.encode('utf-8') if isinstance(s,unicode) else s for s in strings]
+    offsets = [0]
+    for s in blob:
+        offsets.append(offsets[-1]+len(s))
+    strings_at = _SNAP_HEADER.size
+    cats_at = strings_at + 8*len(offsets) + offsets[-1]
+    grades_at = cats_at + _SNAP_CATEGORY.size*len(cat_records)
+    try:
+        snapshot_file.write(_SNAP_HEADER.pack(_SNAP_MAGIC,_SNAP_VERSION,
+                    len(strings),len(cat_records),len(grade_records),
+                    strings_at,cats_at,grades_at,0))
+        snapshot_file.write(struct.pack('<%dQ'%len(offsets),*offsets))
+        for s in blob:
+            snapshot_file.write(s)
+        snapshot_file.writelines(cat_records)
+        snapshot_file.writelines(grade_records)
+    finally:
+        if close:
+            snapshot_file.close()
+
+def snapshot_open(snapshot_file):
+    """Open a snapshot written by snapshot_export; see GradebookSnapshot."""
+    return GradebookSnapshot(snapshot_file)
+
+class GradebookSnapshot(object):
+    """A read-only, memory-mapped view of a snapshot_export file.
+    
+    Opening only reads the header; records and strings are decoded when
+    accessed, and a Grade object is only built by grade()/get_grade()/
+    to_gradebook(). column() reads a numeric field of every Grade (as a
+    NumPy array when NumPy is available). Nothing returned refers to the
+    mapping, so results stay valid after close(); using the snapshot
+    itself after close() raises ValueError.
+    
+    snapshot_file can be a filepath or a file object with a fileno()
+    (left open by close()).
+    """
+    _COLUMNS = {'score':6,'maximum':7,'weight':8,'timestamp':9}
+    
+    def __init__(self,snapshot_file):
+        import mmap
+        object.__init__(self)
+        self._close_file = False
+        if not hasattr(snapshot_file,'fileno'):
+            snapshot_file = open(snapshot_file,'rb')
+            self._close_file = True
+        self._file = snapshot_file
+        self.closed = False
+        self._map = mmap.mmap(snapshot_file.fileno(),0,access=mmap.ACCESS_READ)
+        head = _SNAP_HEADER.unpack_from(self._map,0)
+        if head[0] != _SNAP_MAGIC or head[1] != _SNAP_VERSION:
+            self.close()
+            raise ValueError, 'Not a grading snapshot (version {}).'.format(_SNAP_VERSION)
+        (self._n_strings,self._n_categories,self._n_grades,self._strings_at,
+                    self._cats_at,self._grades_at) = head[2:8]
+        self._blob_at = self._strings_at + 8*(self._n_strings+1)
+        self._names = None
+        self._categories = None
+        meta = self._string(0)
+        self.name,self.user = meta['name'],meta['user']
+        self.identifiers = meta['identifiers']
+    
+    def close(self):
+        self.closed = True
+        self._map.close()
+        if self._close_file:
+            self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,*exc):
+        self.close()
+    
+    def __len__(self):
+        return self._n_grades
+    
+    def _string(self,i):
+        import json
+        if i == _SNAP_NONE:
+            return None
+        start,end = struct.unpack_from('<QQ',self._map,self._strings_at+8*i)
+        return json.loads(self._map[self._blob_at+start:self._blob_at+end])
+    
+    def _record(self,i):
+        if not 0 <= i < self._n_grades:
+            raise IndexError, 'Grade record {} out of range.'.format(i)
+        return _SNAP_GRADE.unpack_from(self._map,
+                                       self._grades_at+_SNAP_GRADE.size*i)
+    
+    def category_names(self):
+        return [self._string(_SNAP_CATEGORY.unpack_from(self._map,
+                    self._cats_at+_SNAP_CATEGORY.size*c)[0])
+                for c in xrange(self._n_categories)]
+    
+    def grade(self,i):
+        """Builds the i-th Grade (unattached to any Category)."""
+        name,cat,idents,overrides,flags,_,score,maximum,weight,tmstmp = \
+                    self._record(i)
+        def number(value,has,is_int):
+            if not flags & has:
+                return None
+            return int(value) if flags & is_int else value
+        return Grade(self._string(name),
+                     score=number(score,_SNAP_SCORE,_SNAP_SCORE_INT),
+                     maximum=number(maximum,_SNAP_MAX,_SNAP_MAX_INT),
+                     weight=number(weight,_SNAP_WEIGHT,_SNAP_WEIGHT_INT),
+                     timestamp=number(tmstmp,_SNAP_TIME,_SNAP_TIME_INT),
+                     extra_credit=bool(flags & _SNAP_EXTRA),
+                     identifiers=self._string(idents),
+                     overrides=self._string(overrides))
+    
+    def grade_category(self,i):
+        """Name of the Category the i-th Grade belongs to."""
+        if self._categories is None:
+            self._categories = self.category_names()
+        return self._categories[self._record(i)[1]]
+    
+    def get_grade(self,name):
+        """Builds the Grade named name, or returns None."""
+        if self._names is None:
+            self._names = dict((self._string(self._record(i)[0]),i)
+                               for i in xrange(self._n_grades))
+        i = self._names.get(name)
+        return None if i is None else self.grade(i)
+    
+    def column(self,field):
+        """All Grades' values of score, maximum, weight or timestamp, with
+        NaN where unset."""
+        if field not in self._COLUMNS:
+            raise ValueError, '{} is not a snapshot column.'.format(field)
+        idx = self._COLUMNS[field]
+        has = {6:_SNAP_SCORE,7:_SNAP_MAX,8:_SNAP_WEIGHT,9:_SNAP_TIME}[idx]
+        if numpy is not None:
+            if self.closed:
+                raise ValueError, 'Snapshot is closed.'
+            #a view of the mapping, only used while it is open: Python 2's
+            #mmap doesn't know about it, so close() wouldn't wait for it
+            recs = numpy.frombuffer(self._map,dtype=numpy.dtype([
+                        ('ids','<u4',(4,)),('flags','<u4'),('pad','<u4'),
+                        ('vals','<f8',(4,))]),
+                        count=self._n_grades,offset=self._grades_at)
+            vals = recs['vals'][:,idx-6].copy()
+            vals[(recs['flags'] & has) == 0] = numpy.nan
+            return vals
+        vals = []
+        for i in xrange(self._n_grades):
+            rec = self._record(i)
+            vals.append(rec[idx] if rec[4] & has else float('nan'))
+        return vals
+    
+    def to_gradebook(self):
+        """Builds the whole Gradebook."""
+        gb = Gradebook(self.name,self.user,identifiers=self.identifiers)
+        cats = []
+        for c in xrange(self._n_categories):
+            name,attribs = _SNAP_CATEGORY.unpack_from(self._map,
+                                    self._cats_at+_SNAP_CATEGORY.size*c)
+            cats.append(Category(self._string(name),**self._string(attribs)))
+        gb.add_category(*cats)
+        per_cat = [[] for c in cats]
+        for i in xrange(self._n_grades):
+            per_cat[self._record(i)[1]].append(self.grade(i))
+        for cat,grades in zip(cats,per_cat):
+            cat.grades.add_grades_bulk(grades)
+        return gb
+
+
+#SQLite storage (see SQLiteStore)
+_SQL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS gradebooks (
+    id INTEGER PRIMARY KEY, name, user, identifiers TEXT,
+    UNIQUE (name,user));
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY, gradebook_id INTEGER NOT NULL, name,
+    attribs TEXT, controls_maximum INTEGER, grade_maximum, grade_weight,
+    best_count, UNIQUE (gradebook_id,name));
+CREATE TABLE IF NOT EXISTS grades (
+    id INTEGER PRIMARY KEY, category_id INTEGER NOT NULL,
+    gradebook_id INTEGER NOT NULL, name, score, maximum, weight,
+    extra_credit INTEGER, timestamp, overrides TEXT, identifiers TEXT,
+    override_maximum INTEGER, override_weight INTEGER,
+    UNIQUE (gradebook_id,name));
+CREATE INDEX IF NOT EXISTS grades_category_score ON grades (category_id,score);
+CREATE TABLE IF NOT EXISTS grade_identifiers (
+    grade_id INTEGER NOT NULL, key, value);
+CREATE INDEX IF NOT EXISTS grade_identifiers_key ON grade_identifiers (key,value);
+CREATE INDEX IF NOT EXISTS grade_identifiers_grade ON grade_identifiers (grade_id);
+"""
+#Grade.getMaximum/getWeight/getPercent over grades g JOIN categories c;
+# categories store their resolved get_grade_weight() (NULL if falsy)
+_SQL_MAXIMUM = '(CASE WHEN c.controls_maximum AND NOT g.override_maximum ' \
+               'THEN c.grade_maximum ELSE g.maximum END)'
+_SQL_WEIGHT = '(CASE WHEN c.grade_weight IS NOT NULL AND NOT g.override_weight ' \
+              'THEN c.grade_weight ELSE g.weight END)'
+_SQL_PERCENT = '(CASE WHEN typeof(g.score) IN (\'integer\',\'real\') AND ' \
+               '{0} THEN g.score*1.0/{0} END)'.format(_SQL_MAXIMUM)
+_SQL_COLUMNS = {'score':'g.score','maximum':_SQL_MAXIMUM,'weight':_SQL_WEIGHT,
+                'percent':_SQL_PERCENT,'extra_credit':'g.extra_credit'}
+#score, maximum, points and weights of every unloaded Category, as
+# _gradelist_for_Category.get_stat computes them (best-count keeps the
+# highest values, ties going to the earlier saved Grade, as _best_of does)
+_SQL_STATS = """
+WITH v AS (
+    SELECT g.id AS id, g.category_id AS cat, g.score AS score,
+        g.extra_credit AS xtra, {mx} AS mx, {wgt} AS wgt, c.best_count AS best
+    FROM grades g JOIN categories c ON c.id=g.category_id
+    WHERE c.gradebook_id=:gradebook AND c.id NOT IN ({loaded})),
+s AS (
+    SELECT *, CASE WHEN :weighted AND wgt THEN score*wgt ELSE score END AS scr,
+        CASE WHEN score IS NOT NULL THEN
+            (CASE WHEN mx THEN score*1.0/mx ELSE score END) *
+            (CASE WHEN :weighted AND wgt THEN wgt ELSE 1 END) END AS val
+    FROM v),
+r AS (
+    SELECT *, ROW_NUMBER() OVER (PARTITION BY cat ORDER BY val DESC, id) AS rn,
+        COUNT(*) OVER (PARTITION BY cat) AS n
+    FROM s)
+SELECT cat, SUM(scr),
+    SUM(CASE WHEN mx THEN (CASE WHEN :weighted THEN mx*wgt ELSE mx END) ELSE 0 END),
+    SUM(CASE WHEN mx THEN scr*1.0/mx ELSE scr END),
+    SUM(CASE WHEN xtra THEN 0 ELSE wgt END)
+FROM r
+WHERE score IS NOT NULL AND (NOT :counted OR best IS NULL OR
+    rn <= CASE WHEN best >= 0 THEN best ELSE n+best END)
+GROUP BY cat
+""".format(mx=_SQL_MAXIMUM,wgt=_SQL_WEIGHT,loaded='{loaded}')
+
+def _sql_term(op,attr,VALUE):
+    """Translates one select() term into a SQL condition and parameters.
+    
+    Returns None for terms SQL can't answer; the condition may match a
+    superset (Grades are re-checked with the Query once loaded).
+    """
+    if attr == 'identifiers' and op in ['IN','NIN'] and \
+                isinstance(VALUE,basestring):
+        clause = 'EXISTS (SELECT 1 FROM grade_identifiers i ' \
+                 'WHERE i.grade_id=g.id AND i.key=?)'
+        return ('NOT '+clause if op=='NIN' else clause),[VALUE]
+    if attr == 'name' and not op and isinstance(VALUE,basestring) and VALUE:
+        return 'g.name = ?',[VALUE]
+    col = _SQL_COLUMNS.get(attr)
+    real = lambda v: isinstance(v,numbers.Real) and v == v
+    if col is None:
+        return None
+    if op == 'BTWN':
+        if type(VALUE) is tuple and len(VALUE) >= 2 and \
+                    real(VALUE[0]) and real(VALUE[1]):
+            return '{0} > ? AND {0} < ?'.format(col),[VALUE[0],VALUE[1]]
+        return None
+    if not real(VALUE):
+        return None
+    if not op and VALUE:
+        return '{} = ?'.format(col),[VALUE]
+    if op == 'N' and VALUE:
+        return '({0} IS NULL OR {0} != ?)'.format(col),[VALUE]
+    if op == 'GT' or (op == 'GTE' and VALUE):
+        return '{} {} ?'.format(col,'>' if op=='GT' else '>='),[VALUE]
+    if op == 'LT' or (op == 'LTE' and VALUE):
+        #None sorts below numbers, as in Python 2
+        return '({0} {1} ? OR {0} IS NULL)'.format(col,
+                    '<' if op=='LT' else '<='),[VALUE]
+    return None
+
+def _sql_scalar(value):
+    """value if SQLite can store and compare it natively, else None."""
+    if type(value) in (str,unicode,int,long,float,bool):
+        return value
+    return None
+
+class SQLiteStore(object):
+    """Persists Gradebooks in a SQLite database (standard sqlite3 module).
+    
+    Gradebooks, Categories and Grades are kept in indexed tables, with a
+    (key,value) table for Grade identifiers:
+        store = SQLiteStore('grades.db')
+        store.save(gradebook)
+        gb = store.open('Course','student-1')  #a StoredGradebook
+        gb.select(GTpercent=0.9)
+    save() replaces everything stored for that Gradebook's name and user.
+    """
+    def __init__(self,path=':memory:'):
+        import sqlite3
+        object.__init__(self)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(_SQL_SCHEMA)
+    
+    def close(self):
+        self.connection.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,*exc):
+        self.close()
+    
+    def gradebooks(self):
+        """(name,user) of every stored Gradebook."""
+        return self.connection.execute(
+                    'SELECT name,user FROM gradebooks ORDER BY id').fetchall()
+    
+    def save(self,gradebook):
+        """Writes (or rewrites) a Gradebook and all of its Categories."""
+        import json
+        if isinstance(gradebook,StoredGradebook):
+            return gradebook.save()
+        if not isinstance(gradebook,Gradebook):
+            raise TypeError, 'gradebook argument must be a Gradebook object.'
+        with self.connection as db:
+            gb_id = self._gradebook_id(gradebook.name,gradebook.user)
+            identifiers = json.dumps(gradebook.attribs.get('identifiers') or {})
+            if gb_id is None:
+                gb_id = db.execute('INSERT INTO gradebooks (name,user,identifiers) '
+                            'VALUES (?,?,?)',(gradebook.name,gradebook.user,
+                            identifiers)).lastrowid
+            else:
+                db.execute('UPDATE gradebooks SET identifiers=? WHERE id=?',
+                           (identifiers,gb_id))
+                self._delete_categories(gb_id)
+            for cat in gradebook._Gradebook__categories.values():
+                self._insert_category(gb_id,cat)
+    
+    def delete(self,name,user):
+        """Removes a stored Gradebook; returns False if there was none."""
+        with self.connection as db:
+            gb_id = self._gradebook_id(name,user)
+            if gb_id is None:
+                return False
+            self._delete_categories(gb_id)
+            db.execute('DELETE FROM gradebooks WHERE id=?',(gb_id,))
+        return True
+    
+    def open(self,name,user):
+        """A StoredGradebook over the stored Gradebook (None if missing)."""
+        gb_id = self._gradebook_id(name,user)
+        if gb_id is None:
+            return None
+        return StoredGradebook(self,gb_id)
+    
+    def load(self,name,user):
+        """The whole stored Gradebook, as an in-memory Gradebook."""
+        stored = self.open(name,user)
+        return None if stored is None else stored.load()
+    
+    def _gradebook_id(self,name,user):
+        row = self.connection.execute('SELECT id FROM gradebooks WHERE '
+                    'name=? AND user IS ?',(name,user)).fetchone()
+        return None if row is None else row[0]
+    
+    def _delete_categories(self,gb_id,cat_ids=None):
+        db = self.connection
+        where,params = 'gradebook_id=?',[gb_id]
+        if cat_ids is not None:
+            where += ' AND category_id IN ({})'.format(','.join('?'*len(cat_ids)))
+            params += cat_ids
+        db.execute('DELETE FROM grade_identifiers WHERE grade_id IN '
+                   '(SELECT id FROM grades WHERE {})'.format(where),params)
+        db.execute('DELETE FROM grades WHERE {}'.format(where),params)
+        db.execute('DELETE FROM categories WHERE {}'.format(
+                    where.replace('category_id','id')),params)
+    
+    def _insert_category(self,gb_id,cat):
+        import json
+        db = self.connection
+        best = cat.grades._best_count()
+        cat_id = db.execute('INSERT INTO categories (gradebook_id,name,attribs,'
+                    'controls_maximum,grade_maximum,grade_weight,best_count) '
+                    'VALUES (?,?,?,?,?,?,?)',(gb_id,cat.name,
+                    json.dumps(cat._Category__attribs),
+                    bool(cat.controls_maximum),cat.grade_maximum,
+                    cat.get_grade_weight() or None,best)).lastrowid
+        ident_rows = []
+        for gr in cat.grades:
+            overrides = gr._overrides or ()
+            tmstmp = gr._timestamp
+            if isinstance(tmstmp,datetime.datetime):
+                tmstmp = calendar.timegm(tmstmp.utctimetuple()) + \
+                         tmstmp.microsecond/1e6
+            gr_id = db.execute('INSERT INTO grades (category_id,gradebook_id,'
+                    'name,score,maximum,weight,extra_credit,timestamp,overrides,'
+                    'identifiers,override_maximum,override_weight) VALUES '
+                    '(?,?,?,?,?,?,?,?,?,?,?,?)',(cat_id,gb_id,gr.name,gr.score,
+                    gr.maximum,gr.weight,bool(gr.extra_credit),tmstmp,
+                    json.dumps(sorted(overrides)) if overrides else None,
+                    json.dumps(gr._identifiers) if gr._identifiers else None,
+                    'maximum' in overrides,'weight' in overrides)).lastrowid
+            for key,val in (gr._identifiers or {}).iteritems():
+                ident_rows.append( (gr_id,key,_sql_scalar(val)) )
+        db.executemany('INSERT INTO grade_identifiers (grade_id,key,value) '
+                       'VALUES (?,?,?)',ident_rows)
+        return cat_id
+
+class StoredGradebook(object):
+    """A Gradebook kept in a SQLiteStore, loading Categories on demand.
+    
+    Offers the Gradebook lookup, select and statistics API. Categories
+    (with all their Grades) are loaded into an in-memory Gradebook the
+    first time they are needed, and can then be used and changed like
+    any other; save() writes the loaded Categories back. select(),
+    identifier_select() and the statistics are answered in SQL for the
+    Categories that aren't loaded, and only load the Categories of
+    matched Grades.
+    """
+    def __init__(self,store,gradebook_id):
+        import json
+        object.__init__(self)
+        self.store = store
+        self._id = gradebook_id
+        name,user,identifiers = self._execute('SELECT name,user,identifiers '
+                    'FROM gradebooks WHERE id=?',(gradebook_id,)).fetchone()
+        self.gradebook = Gradebook(name,user,
+                                   identifiers=json.loads(identifiers or '{}'))
+        self._loaded = {}   #category id -> Category
+    
+    name = property(lambda self: self.gradebook.name)
+    user = property(lambda self: self.gradebook.user)
+    attribs = property(lambda self: self.gradebook.attribs)
+    
+    def _execute(self,sql,params=()):
+        return self.store.connection.execute(sql,params)
+    
+    def _load_category(self,cat_id,name,attribs):
+        import json
+        cat = Category(name,**json.loads(attribs))
+        grades = []
+        for row in self._execute('SELECT name,score,maximum,weight,extra_credit,'
+                    'timestamp,overrides,identifiers FROM grades '
+                    'WHERE category_id=?',(cat_id,)):
+            name,score,maximum,weight,extra,tmstmp,overrides,identifiers = row
+            grades.append(Grade._from_slots(name,None,score,maximum,weight,
+                        bool(extra),tmstmp,
+                        set(json.loads(overrides)) if overrides else None,
+                        json.loads(identifiers) if identifiers else None))
+        self.gradebook.add_category(cat)
+        cat.grades.add_grades_bulk(grades)
+        self._loaded[cat_id] = cat
+        return cat
+    
+    def _load_ids(self,cat_ids):
+        cat_ids = [c for c in set(cat_ids) if c not in self._loaded]
+        if cat_ids:
+            for row in self._execute('SELECT id,name,attribs FROM categories '
+                        'WHERE id IN ({})'.format(','.join('?'*len(cat_ids))),
+                        cat_ids).fetchall():
+                self._load_category(*row)
+    
+    def _unloaded(self):
+        """SQL fragment (and params) excluding the loaded Categories."""
+        return ','.join('?'*len(self._loaded)),list(self._loaded)
+    
+    def _categories(self):
+        """The in-memory Gradebook's Categories: the loaded ones that are
+        still in it and the ones added since it was opened."""
+        return self.gradebook._Gradebook__categories.values()
+    
+    def category_names(self):
+        current = self._categories()
+        names = []
+        for cat_id,name in self._execute('SELECT id,name FROM categories '
+                    'WHERE gradebook_id=? ORDER BY id',(self._id,)):
+            cat = self._loaded.get(cat_id)
+            if cat is None:
+                names.append(name)
+            elif cat in current:
+                names.append(cat.name)
+        loaded = self._loaded.values()
+        return names+[cat.name for cat in current if cat not in loaded]
+    
+    def get_category(self,name):
+        cat = self.gradebook.get_category(name)
+        if cat is None:
+            row = self._execute('SELECT id,name,attribs FROM categories WHERE '
+                        'gradebook_id=? AND name=?',(self._id,name)).fetchone()
+            if row is not None and row[0] not in self._loaded:
+                cat = self._load_category(*row)
+        return cat
+    
+    def get_grade(self,name):
+        import sqlite3
+        gr = self.gradebook.get_grade(name)
+        if gr is None:
+            excluded,params = self._unloaded()
+            try:
+                row = self._execute('SELECT category_id FROM grades WHERE '
+                            'gradebook_id=? AND name=? AND category_id NOT IN '
+                            '({})'.format(excluded),[self._id,name]+params).fetchone()
+            except sqlite3.InterfaceError: #name SQLite can't bind
+                return None
+            if row is not None:
+                self._load_ids([row[0]])
+                gr = self.gradebook.get_grade(name)
+        return gr
+    
+    def __contains__(self,x):
+        if isinstance(x,(Grade,Category)):
+            return x in self.gradebook
+        return self.get_category(x) is not None or self.get_grade(x) is not None
+    
+    def __getitem__(self,x):
+        ret = self.get_category(x) or self.get_grade(x)
+        if not ret:
+            raise KeyError, 'Name \'{}\' not found in Gradebook.'.format(x)
+        return ret
+    
+    def add_category(self,*categories):
+        categories = [cat for cat in categories if type(cat) is Category]
+        for cat in categories:
+            self.get_category(cat.name) #loaded, so add_category sees it
+        #as are the stored Categories holding Grades of the same names
+        self._load_grade_names([gr.name for cat in categories
+                                for gr in cat.grades])
+        self.gradebook.add_category(*categories)
+    
+    def _load_grade_names(self,names):
+        """Loads the unloaded Categories holding Grades named names."""
+        import sqlite3
+        for i in xrange(0,len(names),500):
+            chunk = names[i:i+500]
+            excluded,params = self._unloaded()
+            try:
+                rows = self._execute('SELECT DISTINCT category_id FROM grades '
+                            'WHERE gradebook_id=? AND name IN ({}) AND '
+                            'category_id NOT IN ({})'.format(
+                            ','.join('?'*len(chunk)),excluded),
+                            [self._id]+chunk+params).fetchall()
+            except sqlite3.InterfaceError: #names SQLite can't bind
+                for name in chunk:
+                    self.get_grade(name)
+                continue
+            self._load_ids([row[0] for row in rows])
+    
+    def add_grade(self,cat_name,grade_arg):
+        name = grade_arg.name if isinstance(grade_arg,Grade) else grade_arg
+        if self.get_grade(name) is not None:
+            return False
+        self.get_category(cat_name)
+        return self.gradebook.add_grade(cat_name,grade_arg)
+    
+    def load(self):
+        """Loads every Category; returns the in-memory Gradebook."""
+        excluded,params = self._unloaded()
+        for row in self._execute('SELECT id,name,attribs FROM categories WHERE '
+                    'gradebook_id=? AND id NOT IN ({})'.format(excluded),
+                    [self._id]+params).fetchall():
+            self._load_category(*row)
+        return self.gradebook
+    
+    def save(self):
+        """Writes the Gradebook's identifiers and its loaded (or added)
+        Categories back to the store."""
+        import json
+        store = self.store
+        with store.connection as db:
+            db.execute('UPDATE gradebooks SET identifiers=? WHERE id=?',
+                       (json.dumps(self.attribs.get('identifiers') or {}),self._id))
+            cats = self.gradebook._Gradebook__categories.values()
+            store._delete_categories(self._id,list(self._loaded))
+            #and stored Categories that have been replaced or renamed
+            store._delete_categories(self._id,[row[0] for row in
+                        db.execute('SELECT id FROM categories WHERE '
+                        'gradebook_id=? AND name IN ({})'.format(
+                        ','.join('?'*len(cats))),
+                        [self._id]+[cat.name for cat in cats]).fetchall()])
+            self._loaded = dict((store._insert_category(self._id,cat),cat)
+                                for cat in cats)
+    
+    def select(self,aslist=False,docopy=False,query=None,**kwargs):
+        """Retrieves Grades from all Categories; see Gradebook.select.
+        
+        Terms SQL can answer narrow the unloaded Categories' Grades in the
+        database; the Categories of the remaining rows are loaded and
+        their Grades checked against the whole Query.
+        """
+        if query is None:
+            query = Query(**kwargs)
+        elif kwargs:
+            raise ValueError,'select takes a query or keywords, not both.'
+        clauses,params = [],[]
+        for term in query.terms:
+            sql = _sql_term(*term)
+            if sql is not None:
+                clauses.append(sql[0])
+                params.extend(sql[1])
+        excluded,ex_params = self._unloaded()
+        self._load_ids([row[0] for row in self._execute(
+                    'SELECT DISTINCT g.category_id FROM grades g JOIN categories c '
+                    'ON c.id=g.category_id WHERE g.gradebook_id=? AND '
+                    'g.category_id NOT IN ({}){}'.format(excluded,''.join(
+                    ' AND '+cl for cl in clauses)),[self._id]+ex_params+params)])
+        return self.gradebook.select(aslist=aslist,docopy=docopy,query=query)
+    
+    def identifier_select(self,**kwargs):
+        """Grades in any Category whose identifiers match all of kwargs."""
+        if not kwargs:
+            return set()
+        excluded,params = self._unloaded()
+        sql = 'SELECT DISTINCT g.category_id FROM grades g WHERE ' \
+              'g.gradebook_id=? AND g.category_id NOT IN ({})'.format(excluded)
+        params = [self._id]+params
+        for key,val in kwargs.iteritems():
+            if _sql_scalar(val) is None:
+                sql += ' AND g.identifiers IS NOT NULL'
+                continue
+            sql += ' AND EXISTS (SELECT 1 FROM grade_identifiers i WHERE ' \
+                   'i.grade_id=g.id AND i.key=? AND i.value=?)'
+            params += [key,val]
+        self._load_ids([row[0] for row in self._execute(sql,params)])
+        return self.gradebook.identifier_select(**kwargs)
+    
+    def category_stats(self,weighted=False,counted=False):
+        """{Category name: {'score','maximum','points','weights'}} as
+        grades.get_stat would return them. In-memory Categories (loaded or
+        not yet saved) answer for themselves; the others are totalled by
+        SQL aggregates, which can differ from get_stat in the last bits
+        of float sums (they're added in another order)."""
+        stats = {}
+        for cat in self._categories():
+            stats[cat.name] = dict((stat,cat.grades.get_stat(stat,
+                        weighted=weighted,counted=counted)) for stat in
+                        ('score','maximum','points','weights'))
+        excluded,params = self._unloaded()
+        names = dict(self._execute('SELECT id,name FROM categories WHERE '
+                    'gradebook_id=? AND id NOT IN ({})'.format(excluded),
+                    [self._id]+params).fetchall())
+        for cat_id in names:
+            stats[names[cat_id]] = {'score':0,'maximum':0,'points':None,
+                                    'weights':0}
+        loaded = ','.join(str(int(cat_id)) for cat_id in self._loaded)
+        for cat_id,score,maximum,points,weights in self._execute(
+                    _SQL_STATS.format(loaded=loaded),{'gradebook':self._id,
+                    'weighted':weighted,'counted':counted}):
+            stats[names[cat_id]] = {'score':score,'maximum':maximum,
+                        'points':1.0*points if maximum else None,
+                        'weights':weights}
+        return stats
+    
+    def get_weighted_stat(self,stat):
+        """See Gradebook.get_weighted_stat."""
+        statv = Gradebook._weighted_statv(stat)
+        points = self.category_stats(weighted=True,counted=True)
+        weights = self.category_stats(counted=True)
+        wpoints=0
+        wmax=0
+        for name in points:
+            if points[name]['points']:
+                wpoints+=points[name]['points']
+            if weights[name]['weights']:
+                wmax+=weights[name]['weights']
+        if statv is 1:
+            return wpoints
+        if statv is 2:
+            return wmax
+        if wmax:
+            return 1.0*wpoints/wmax
+        return None
+    
+    def get_stat(self,stat):
+        """Alias of get_weighted_stat."""
+        return self.get_weighted_stat(stat)
@@ -0,0 +1,768 @@
+#!/usr/bin/env python
+"""Behavior tests for grading.py. Run with `python -m unittest test_grading`."""
+
+import unittest,copy,datetime,os,pickle,shutil,tempfile,threading,random
+from StringIO import StringIO
+
+import grading
+from grading import Grade,Category,Gradebook,Roster,Query
+
+
+def make_book(user='student',n=12,seed=0,timestamps=False):
+    """A Gradebook with a plain Category, a controlled one and a
+    best-count one, with a few unscored Grades. Scores are distinct, since
+    which of two tied Grades best-count drops depends on set order."""
+    rnd = random.Random(seed)
+    gb = Gradebook('Course',user)
+    hw = Category('Homework',controls_maximum=True,grade_maximum=10)
+    quiz = Category('Quizzes',use_best_count=True,element_count=-1)
+    exam = Category('Exams',controls_weight=True,grade_weight=3)
+    gb.add_category(hw,quiz,exam)
+    for i in xrange(n):
+        cat = (hw,quiz,exam)[i%3]
+        score = None if i%5 == 4 else round(rnd.uniform(0,10),3)
+        gr = Grade('g%d'%i,score=score,maximum=rnd.choice([10,20]),
+                   weight=rnd.choice([1,2]),extra_credit=(i == 7),
+                   identifiers={'lms_id':1000+i})
+        if timestamps:
+            gr.timestamp = 1500000000+3600*i
+        cat.grades.add_grades(gr)
+    return gb
+
+def ungraded(gb):
+    return [gr for name in ('Homework','Quizzes','Exams')
+            for gr in gb.get_category(name).grades if gr.score is None]
+
+def scan_stat(gb,stat):
+    """get_weighted_stat computed from scratch on a deep copy."""
+    return copy.deepcopy(gb).get_weighted_stat(stat)
+
+
+class TestNameIndex(unittest.TestCase):
+    #user-001
+    def test_lookup_rename_remove(self):
+        gb = make_book()
+        gr = gb.get_grade('g4')
+        self.assertIs(gr.parent.grades.get_grade('g4'),gr)
+        self.assertTrue('g4' in gb)
+        gr.name = 'renamed'
+        self.assertIsNone(gb.get_grade('g4'))
+        self.assertIs(gb.get_grade('renamed'),gr)
+        self.assertRaises(NameError,setattr,gr,'name','g5')
+        gr.parent.grades.remove_grades(gr)
+        self.assertFalse('renamed' in gb)
+        self.assertRaises(KeyError,gb.__getitem__,'renamed')
+
+    def test_add_category_checks_grade_names(self):
+        gb = make_book()
+        clash,fresh = Category('Labs'),Category('Projects')
+        clash.grades.add_grades(Grade('lab'),Grade('g3'))
+        fresh.grades.add_grades(Grade('project'))
+        self.assertRaises(NameError,gb.add_category,clash,fresh)
+        self.assertIsNone(gb.get_category('Labs'))
+        self.assertIsNone(gb.get_grade('lab'))
+        self.assertIs(gb.get_grade('g3').parent,gb.get_category('Homework'))
+        self.assertIs(gb.get_grade('project').parent,fresh)
+
+
+class TestBulkAdd(unittest.TestCase):
+    #user-002
+    def test_bulk_add_reports_taken_names(self):
+        gb = make_book()
+        grades = [Grade('new%d'%i,score=i) for i in xrange(5)]+[Grade('g0')]
+        self.assertRaises(NameError,gb.add_grades_bulk,'Homework',grades)
+        for i in xrange(5):
+            self.assertIs(gb.get_grade('new%d'%i).parent,gb.get_category('Homework'))
+        self.assertIsNot(gb.get_grade('g0'),grades[-1])
+
+
+class TestCachedStats(unittest.TestCase):
+    #user-003, user-004
+    def test_stats_follow_changes(self):
+        gb = make_book()
+        before = gb.get_weighted_stat('percent')
+        self.assertAlmostEqual(before,scan_stat(gb,'percent'),12)
+        gb.get_grade('g0').score = 0.5
+        gb.get_category('Homework').grade_maximum = 20
+        self.assertAlmostEqual(gb.get_weighted_stat('percent'),
+                               scan_stat(gb,'percent'),12)
+        self.assertNotEqual(gb.get_weighted_stat('percent'),before)
+
+    def test_overrides_edited_in_place(self):
+        gb = make_book()
+        changes = []
+        gb.add_observer(lambda book,change: changes.append(change))
+        gr = gb.get_grade('g0')
+        gr.maximum = 40
+        before = gb.get_weighted_stat('percent')
+        gr.overrides.add('maximum')
+        self.assertEqual(gr.getMaximum(),40)
+        self.assertAlmostEqual(gb.get_weighted_stat('percent'),
+                               scan_stat(gb,'percent'),12)
+        self.assertNotEqual(gb.get_weighted_stat('percent'),before)
+        ovrrds = gr.overrides
+        ovrrds -= set(['maximum'])
+        self.assertIs(ovrrds,gr.overrides)
+        self.assertEqual(gb.get_weighted_stat('percent'),before)
+        self.assertEqual(changes[-2:],[('set','g0','overrides',set(['maximum'])),
+                                       ('set','g0','overrides',set())])
+        self.assertIs(type(gr.overrides|set(['weight'])),set)
+        self.assertIs(type(copy.deepcopy(gr.overrides)),set)
+
+    def test_best_count(self):
+        cat = Category('Quizzes',use_best_count=True,element_count=2)
+        cat.grades.add_grades(*[Grade('q%d'%i,score=s,maximum=10)
+                                for i,s in enumerate([4,9,1,7])])
+        best = cat.grades.get_stat('elements',counted=True)
+        self.assertEqual(sorted(gr.score for gr in best),[7,9])
+        self.assertEqual(cat.grades.get_stat('score',counted=True),16)
+        cat.element_count = -1
+        self.assertEqual(cat.grades.get_stat('score',counted=True),20)
+
+
+class TestInstrumentation(unittest.TestCase):
+    #user-015
+    def setUp(self):
+        self.inst = grading.Instrumentation()
+
+    def tearDown(self):
+        self.inst.disable()
+
+    def test_aliases_are_counted(self):
+        cat = Category('Homework')
+        self.inst.enable()
+        cat.grades.add_grades(Grade('a',score=1))
+        cat.grades.add_grade(Grade('b',score=2))
+        cat.grades.add(Grade('c',score=3))
+        cat.grades.remove(cat.grades.get_grade('a'))
+        self.assertEqual(self.inst.calls['_gradelist_for_Category.add_grades'],3)
+        self.assertEqual(self.inst.calls['_gradelist_for_Category.remove_grades'],1)
+        self.inst.disable()
+        attrs = vars(grading._gradelist_for_Category)
+        self.assertTrue(attrs['add'] is attrs['add_grades'])
+        cat.grades.add(Grade('d',score=4))
+        self.assertEqual(self.inst.calls['_gradelist_for_Category.add_grades'],3)
+
+    def test_select_predicates_are_counted(self):
+        cat = Category('Homework')
+        cat.grades.add_grades(*[Grade('g%d'%i,score=i,maximum=10,weight=1)
+                                for i in xrange(4)])
+        self.inst.enable()
+        self.assertEqual(len(cat.grades.select(weight=1,GTmaximum=5)),4)
+        self.assertEqual(self.inst.calls['Grade.getWeight'],4)
+        #the range index is built from getMaximum, then each match rechecked
+        self.assertEqual(self.inst.calls['Grade.getMaximum'],8)
+
+
+class TestCopyOnWrite(unittest.TestCase):
+    #user-016
+    def test_copies_are_detached(self):
+        gb = make_book()
+        changes = []
+        gb.add_observer(lambda book,change: changes.append(change))
+        before = gb.get_weighted_stat('percent')
+        copy_ = gb.select(docopy=True,name='g0').pop()
+        snap = gb.get_grade('g3').snapshot()
+        copy_.score = 99
+        copy_.name = 'other'
+        copy_.mod_overrides('maximum')
+        snap.identifiers = {'lms_id':'x'}
+        snap.identifiers['section'] = 2
+        self.assertEqual(changes,[])
+        self.assertEqual(gb.get_weighted_stat('percent'),before)
+        self.assertEqual(gb.get_grade('g3').identifiers,{'lms_id':1003})
+        self.assertFalse(gb.identifier_select(lms_id='x'))
+        self.assertIsNotNone(gb.get_grade('g0'))
+
+
+@unittest.skipIf(grading.numpy is None,'NumPy is not installed')
+class TestColumnar(unittest.TestCase):
+    #user-005
+    def tearDown(self):
+        grading.COLUMNAR = False
+
+    def stats(self,cat,columnar):
+        grading.COLUMNAR = columnar
+        cat.grades._invalidate()
+        return [cat.grades.get_stat(stat,weighted=w,counted=c)
+                for stat in ('score','maximum','points','weights')
+                for w in (False,True) for c in (False,True)]
+
+    def test_matches_object_path_values_and_types(self):
+        rnd = random.Random(3)
+        for trial in xrange(200):
+            cat = Category('c',use_best_count=rnd.random() < 0.5,
+                           element_count=rnd.choice([None,-2,-1,1,3]))
+            number = lambda: rnd.choice([0,1,2,7,10,0.0,2.5,1/3.0])
+            cat.grades.add_grades(*[Grade('g%d'%i,
+                        score=rnd.choice([None,number()]),
+                        maximum=rnd.choice([None,number()]),
+                        weight=number(),extra_credit=rnd.random() < 0.2)
+                        for i in xrange(rnd.randint(0,8))])
+            objects,columns = self.stats(cat,False),self.stats(cat,True)
+            self.assertEqual(objects,columns)
+            self.assertEqual(map(type,objects),map(type,columns))
+
+
+class TestSelect(unittest.TestCase):
+    #user-007
+    def test_query_matches_scan(self):
+        gb = make_book(n=30)
+        grades = [gr for name in ('Homework','Quizzes','Exams')
+                  for gr in gb.get_category(name).grades]
+        for kwargs in ({'GTEscore':5},{'GTscore':3,'LTEscore':9},
+                       {'BTWNpercent':(0.2,0.8)},{'LTmaximum':15,'score':None},
+                       {'INidentifiers':'lms_id','GTscore':0}):
+            q = Query(**kwargs)
+            expected = set(gr for gr in grades if q.matches(gr))
+            self.assertEqual(gb.select(query=q) or set(),expected)
+            self.assertEqual(gb.select(**kwargs) or set(),expected)
+
+    def test_select_keeps_copies_shared(self):
+        gb = copy.deepcopy(make_book())
+        gr = gb.get_grade('g0')
+        self.assertTrue(gr._shared)
+        self.assertEqual(gb.select(INidentifiers='lms_id',name='g0'),set([gr]))
+        self.assertEqual(gb.select(identifiers={'lms_id':1000}),set([gr]))
+        self.assertFalse(gb.select(INoverrides='maximum'))
+        self.assertTrue(gr._shared)
+
+
+class TestIdentifierIndex(unittest.TestCase):
+    #user-008
+    def test_in_place_edits_are_reindexed(self):
+        gb = make_book()
+        gr = gb.get_grade('g2')
+        cat = gr.parent
+        gr.identifiers['lms_id'] = 'x'
+        self.assertEqual(gb.identifier_select(lms_id='x'),set([gr]))
+        self.assertEqual(cat.grades.identifier_select(lms_id='x'),set([gr]))
+        self.assertFalse(gb.identifier_select(lms_id=1002))
+        self.assertEqual(gb.select(INidentifiers='lms_id',name='g2'),set([gr]))
+        gr.identifiers.update(section=4)
+        gr.identifiers.setdefault('term','fall')
+        self.assertEqual(gb.identifier_select(section=4,term='fall'),set([gr]))
+        self.assertEqual(gr.identifiers.pop('section'),4)
+        del gr.identifiers['term']
+        self.assertRaises(KeyError,gr.identifiers.__delitem__,'term')
+        self.assertFalse(gb.identifier_select(section=4))
+        self.assertEqual(gb.identifier_select(lms_id='x'),set([gr]))
+        gb.update_scores({'x':8},identifier='lms_id')
+        self.assertEqual(gr.score,8)
+        gr.identifiers.clear()
+        self.assertFalse(gb.identifier_select(lms_id='x'))
+
+    def test_identifiers_copy_as_plain_dicts(self):
+        import pickle,json
+        gr = make_book().get_grade('g1')
+        for other in (copy.copy(gr.identifiers),copy.deepcopy(gr.identifiers),
+                      pickle.loads(pickle.dumps(gr.identifiers,2)),
+                      gr.identifiers.copy()):
+            self.assertIs(type(other),dict)
+            self.assertEqual(other,{'lms_id':1001})
+        self.assertEqual(json.loads(json.dumps(gr.identifiers)),{'lms_id':1001})
+
+
+class TestJsonStreaming(unittest.TestCase):
+    #user-009, user-010, user-022
+    def assertSameBook(self,a,b):
+        self.assertEqual((a.name,a.user),(b.name,b.user))
+        for name in ('Homework','Quizzes','Exams'):
+            ga = dict((gr.name,gr) for gr in a.get_category(name).grades)
+            gb = dict((gr.name,gr) for gr in b.get_category(name).grades)
+            self.assertEqual(ga,gb)
+        #sums run in set order, which differs between copies
+        self.assertAlmostEqual(a.get_weighted_stat('percent'),
+                               b.get_weighted_stat('percent'),12)
+
+    def test_export_iterimport_round_trip(self):
+        gb = make_book()
+        out = StringIO()
+        grading.json_export(out,gb)
+        books = list(grading.json_iterimport(StringIO(out.getvalue()),inherit=True))
+        self.assertEqual(len(books),1)
+        self.assertSameBook(gb,books[0])
+
+    def test_iterexport_matches_export(self):
+        gb = make_book()
+        out = StringIO()
+        grading.json_iterexport(out,gb)
+        self.assertSameBook(gb,grading.json_import(StringIO(out.getvalue()),
+                                                   inherit=True))
+
+    def test_many_books_in_both_layouts(self):
+        import json
+        books = [make_book('s%d'%i,seed=i) for i in xrange(3)]
+        books.insert(1,Gradebook('Course','empty'))
+        child_first = json.dumps({'grading':[item for gb in books
+                                for item in grading._export_items(gb)]})
+        out = StringIO()
+        grading.json_iterexport(out,books)
+        for data in (child_first,out.getvalue()):
+            found = list(grading.json_iterimport(StringIO(data),inherit=True))
+            parser = grading.GradingFeedParser(inherit=True)
+            fed = parser.feed(data[:len(data)//3])
+            fed += parser.feed(data[len(data)//3:])+parser.close()
+            for imported in (found,fed):
+                self.assertEqual([gb.user for gb in imported],
+                                 ['s0','empty','s1','s2'])
+                for gb,orig in zip(imported,books):
+                    if orig.user == 'empty':
+                        self.assertFalse(gb._Gradebook__categories)
+                        continue
+                    self.assertSameBook(orig,gb)
+                    self.assertEqual(sum(len(list(cat.grades)) for cat in
+                                     gb._Gradebook__categories.values()),12)
+
+    def test_feed_parser_byte_by_byte(self):
+        gb = make_book()
+        data = ''.join(grading.json_iterencode([gb]))
+        parser = grading.GradingFeedParser(inherit=True)
+        books = []
+        for ch in data:
+            books.extend(parser.feed(ch))
+        books.extend(parser.close())
+        self.assertEqual(len(books),1)
+        self.assertSameBook(gb,books[0])
+        parser = grading.GradingFeedParser(inherit=True)
+        parser.feed(data[:len(data)//2])
+        self.assertRaises(ValueError,parser.close)
+
+
+class TestCompactObjects(unittest.TestCase):
+    #user-011, user-012
+    def test_grade_slots_and_lazy_containers(self):
+        gr = Grade('a',score=1,timestamp=1500000000)
+        self.assertFalse(hasattr(gr,'__dict__'))
+        self.assertIsNone(gr._overrides)
+        self.assertEqual(gr.timestamp,datetime.datetime.utcfromtimestamp(1500000000))
+        self.assertEqual(gr.identifiers,{})
+
+    def test_category_attributes(self):
+        cat = Category('c',controls_maximum=True,grade_maximum=5)
+        cat.grades.add_grades(Grade('a',score=4,maximum=10))
+        self.assertEqual(cat.grades.get_grade('a').getMaximum(),5)
+        cat.grade_maximum = 8
+        self.assertEqual(cat.grades.get_grade('a').getMaximum(),8)
+        self.assertEqual(cat.grades.get_stat('maximum'),8)
+
+    def test_pickle_round_trip(self):
+        gb = make_book()
+        gr = gb.get_grade('g0')
+        gr.mod_overrides('weight')
+        gr.timestamp = 1500000000
+        for protocol in (0,1,2):
+            copied = pickle.loads(pickle.dumps(gr,protocol))
+            self.assertIsNone(copied.parent)
+            self.assertEqual((copied.name,copied.score,copied.maximum,
+                              copied.weight,copied.overrides,copied.identifiers,
+                              copied._timestamp),
+                             (gr.name,gr.score,gr.getMaximum(),gr.getWeight(),
+                              gr.overrides,gr.identifiers,gr._timestamp))
+            cat = pickle.loads(pickle.dumps(gr.parent,protocol))
+            self.assertEqual(cat.grade_maximum,10)
+            self.assertEqual(sorted(g.name for g in cat.grades),
+                             sorted(g.name for g in gr.parent.grades))
+            self.assertAlmostEqual(cat.grades.get_stat('points'),
+                                   gr.parent.grades.get_stat('points'),12)
+
+
+class TestRoster(unittest.TestCase):
+    #user-006
+    def test_get_stat_in_process(self):
+        roster = Roster('r',*[make_book('s%d'%i,seed=i) for i in xrange(4)])
+        self.assertEqual(list(roster.get_stat('percent',processes=1)),
+                         [(gb.user,gb.get_weighted_stat('percent'))
+                          for gb in roster])
+
+    def test_get_stat_on_a_pool(self):
+        roster = Roster('r',*[make_book('s%d'%i,seed=i) for i in xrange(4)])
+        results = []
+        def run():
+            for stat,kwargs in (('points',{}),('elements',{'counted':True})):
+                results.append(list(roster.get_stat(stat,processes=2,
+                                    category='Quizzes',**kwargs)))
+        worker = threading.Thread(target=run)
+        worker.daemon = True
+        worker.start()
+        worker.join(60)
+        self.assertFalse(worker.is_alive(),'get_stat on a pool hung')
+        for (stat,kwargs),got in zip((('points',{}),
+                                      ('elements',{'counted':True})),results):
+            self.assertEqual(got,[(gb.user,gb.get_category('Quizzes').grades.
+                                   get_stat(stat,**kwargs)) for gb in roster])
+        for user,grades in results[1]:
+            for gr in grades:
+                self.assertIs(roster[user].get_grade(gr.name),gr)
+
+
+class TestCopyAndPickle(unittest.TestCase):
+    #user-006
+    def test_deepcopy_keeps_structure_and_indexes(self):
+        gb = make_book()
+        changes = []
+        observer = lambda book,change: changes.append((book,change))
+        gb.add_observer(observer)
+        book = copy.deepcopy(gb)
+        self.assertEqual(sorted(book._Gradebook__categories),
+                         ['Exams','Homework','Quizzes'])
+        self.assertEqual(book.get_category('Quizzes').element_count,-1)
+        for i in xrange(12):
+            gr,orig = book.get_grade('g%d'%i),gb.get_grade('g%d'%i)
+            self.assertIsNot(gr,orig)
+            self.assertIs(gr.parent,book.get_category(orig.parent.name))
+            self.assertEqual((gr.score,gr.maximum,gr.weight,gr.identifiers),
+                             (orig.score,orig.maximum,orig.weight,orig.identifiers))
+        self.assertEqual(book.identifier_select(lms_id=1003),
+                         set([book.get_grade('g3')]))
+        self.assertAlmostEqual(book.get_weighted_stat('percent'),
+                               gb.get_weighted_stat('percent'),12)
+        self.assertEqual(book._observers,[])
+        book.get_grade('g0').score = 1.5
+        book.get_grade('g0').identifiers['lms_id'] = 1
+        self.assertEqual(changes,[])
+        self.assertNotEqual(gb.get_grade('g0').score,1.5)
+        self.assertEqual(gb.get_grade('g0').identifiers,{'lms_id':1000})
+
+    def test_pickle_round_trip(self):
+        import pickle
+        gb = make_book(timestamps=True)
+        gb.add_observer(lambda book,change: None)
+        book = pickle.loads(pickle.dumps(gb,2))
+        self.assertEqual(book._observers,[])
+        self.assertEqual(book.identifier_select(lms_id=1005),
+                         set([book.get_grade('g5')]))
+        self.assertAlmostEqual(book.get_weighted_stat('percent'),
+                               gb.get_weighted_stat('percent'),12)
+        self.assertEqual(book.get_grade('g5').timestamp,
+                         gb.get_grade('g5').timestamp)
+
+
+class TestSnapshot(unittest.TestCase):
+    #user-013
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        gb = make_book(timestamps=True)
+        path = os.path.join(self.dir,'book.snap')
+        grading.snapshot_export(path,gb)
+        with grading.snapshot_open(path) as snap:
+            self.assertEqual(len(snap),12)
+            gr,orig = snap.get_grade('g3'),gb.get_grade('g3')
+            for attr in ('name','score','maximum','weight','extra_credit',
+                         'timestamp','identifiers'):
+                self.assertEqual(getattr(gr,attr),getattr(orig,attr))
+            back = snap.to_gradebook()
+        self.assertAlmostEqual(back.get_weighted_stat('percent'),
+                               gb.get_weighted_stat('percent'),12)
+
+    def test_close_leaves_callers_file_open(self):
+        path = os.path.join(self.dir,'book.snap')
+        grading.snapshot_export(path,make_book())
+        with open(path,'rb') as f:
+            with grading.snapshot_open(f) as snap:
+                self.assertEqual(len(snap),12)
+            self.assertFalse(f.closed)
+            with grading.snapshot_open(f) as snap:
+                self.assertEqual(snap.get_grade('g3').name,'g3')
+            self.assertFalse(f.closed)
+        snap = grading.snapshot_open(path)
+        snap.close()
+        self.assertTrue(snap._file.closed)
+
+    @unittest.skipIf(grading.numpy is None,'NumPy is not installed')
+    def test_columns_outlive_close(self):
+        gb = make_book(timestamps=True)
+        path = os.path.join(self.dir,'book.snap')
+        grading.snapshot_export(path,gb)
+        snap = grading.snapshot_open(path)
+        scores = snap.column('score')
+        names = [snap.grade(i).name for i in xrange(len(snap))]
+        snap.close()
+        self.assertIsNone(scores.base)
+        for name,score in zip(names,scores):
+            if gb.get_grade(name).score is None:
+                self.assertNotEqual(score,score)
+            else:
+                self.assertEqual(score,gb.get_grade(name).score)
+        self.assertRaises(ValueError,snap.column,'score')
+        self.assertRaises(ValueError,snap.grade,0)
+
+
+class TestUpdateScores(unittest.TestCase):
+    #user-017
+    def test_by_name_and_identifier(self):
+        gb = make_book()
+        unknown = gb.update_scores({'g0':1,'nope':2})
+        self.assertEqual(list(unknown),['nope'])
+        self.assertEqual(gb.get_grade('g0').score,1)
+        gb.update_scores({1001:6},identifier='lms_id')
+        self.assertEqual(gb.get_grade('g1').score,6)
+        self.assertAlmostEqual(gb.get_weighted_stat('percent'),
+                               scan_stat(gb,'percent'),12)
+
+    def test_unhashable_identifier(self):
+        gb = make_book()
+        gr = gb.get_grade('g3')
+        gr.identifiers['sections'] = [1,2]
+        changes = []
+        gb.add_observer(lambda book,change: changes.append(change))
+        unknown = gb.update_scores([([1,2],8),([3],9)],identifier='sections')
+        self.assertEqual(unknown,[[3]])
+        self.assertEqual(gr.score,8)
+        self.assertEqual(changes,[('set','g3','score',8)])
+
+
+class TestCsv(unittest.TestCase):
+    #user-018
+    def test_round_trip(self):
+        template = make_book('template')
+        books = [make_book('s%d'%i,seed=i) for i in xrange(3)]
+        out = StringIO()
+        grading.csv_export(out,books)
+        roster = grading.csv_import(StringIO(out.getvalue()),template)
+        self.assertEqual([gb.user for gb in roster],['s0','s1','s2'])
+        for gb in books:
+            for i in xrange(12):
+                self.assertEqual(roster[gb.user].get_grade('g%d'%i).score,
+                                 gb.get_grade('g%d'%i).score)
+
+
+class TestImportFiles(unittest.TestCase):
+    #user-019
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_loads_books_and_reports_errors(self):
+        paths = []
+        for i in xrange(3):
+            paths.append(os.path.join(self.dir,'s%d.json'%i))
+            grading.json_export(paths[-1],make_book('s%d'%i,seed=i))
+        paths.append(os.path.join(self.dir,'broken.json'))
+        with open(paths[-1],'w') as out:
+            out.write('{"grading": [')
+        books,errors = grading.json_import_files(paths,processes=1)
+        self.assertEqual(sorted(gb.user for gb in books),['s0','s1','s2'])
+        self.assertEqual(errors.keys(),[paths[-1]])
+
+
+class TestStoredGradebook(unittest.TestCase):
+    #user-020
+    def setUp(self):
+        self.store = grading.SQLiteStore()
+
+    def tearDown(self):
+        self.store.close()
+
+    def assertSameStats(self,stored,gb):
+        #SQL and loaded Categories sum floats in their own order
+        same = lambda a,b: self.assertAlmostEqual(a,b,12)
+        for weighted in (False,True):
+            for counted in (False,True):
+                stats = stored.category_stats(weighted,counted)
+                self.assertEqual(sorted(stats),sorted(gb._Gradebook__categories))
+                for name,values in stats.iteritems():
+                    grades = gb.get_category(name).grades
+                    for stat,value in values.iteritems():
+                        expected = grades.get_stat(stat,weighted=weighted,
+                                                   counted=counted)
+                        self.assertEqual(type(value),type(expected))
+                        same(value,expected)
+        for stat in ('score','maximum','percent'):
+            same(stored.get_weighted_stat(stat),gb.get_weighted_stat(stat))
+
+    def test_stats_match_in_memory(self):
+        gb = make_book(n=30)
+        gb.get_category('Quizzes').element_count = -2
+        self.store.save(gb)
+        stored = self.store.open('Course','student')
+        self.assertSameStats(stored,gb)
+        stored.get_category('Homework')
+        self.assertSameStats(stored,gb)
+
+    def test_unsaved_categories_count(self):
+        gb = make_book()
+        self.store.save(gb)
+        stored = self.store.open('Course','student')
+        for book in (gb,stored):
+            extra = Category('Labs')
+            extra.grades.add_grades(Grade('lab',score=1.0,maximum=4.0))
+            book.add_category(extra)
+        self.assertEqual(sorted(stored.category_names()),
+                         sorted(gb._Gradebook__categories))
+        self.assertSameStats(stored,gb)
+
+    def test_add_category_checks_stored_grade_names(self):
+        #user-001
+        self.store.save(make_book())
+        stored = self.store.open('Course','student')
+        clash = Category('Labs')
+        clash.grades.add_grades(Grade('g3'))
+        self.assertRaises(NameError,stored.add_category,clash)
+        self.assertFalse('Labs' in stored.category_names())
+        self.assertIs(stored.get_grade('g3').parent,
+                      stored.get_category('Homework'))
+
+
+class TestJournal(unittest.TestCase):
+    #user-021
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.snap = os.path.join(self.dir,'book.json')
+        self.log = os.path.join(self.dir,'book.journal')
+        grading.json_export(self.snap,make_book())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_replay_after_reopen(self):
+        with grading.journal_open(self.snap,self.log) as journal:
+            gb = journal.gradebook
+            gb.get_grade('g0').score = 9.5
+            gb.get_category('Homework').grades.add_grades(Grade('new',score=2))
+            gb.get_grade('g1').name = 'renamed'
+            expected = gb.get_weighted_stat('percent')
+        with grading.journal_open(self.snap,self.log) as journal:
+            gb = journal.gradebook
+            self.assertEqual(gb.get_grade('g0').score,9.5)
+            self.assertIsNotNone(gb.get_grade('renamed'))
+            self.assertAlmostEqual(gb.get_weighted_stat('percent'),expected,12)
+            #the Category's maximum, not the Grade's own, is resolved
+            self.assertIsNone(gb.get_grade('new').maximum)
+            self.assertEqual(gb.get_grade('new').getMaximum(),10)
+
+    def test_copies_are_not_journaled(self):
+        with grading.journal_open(self.snap,self.log) as journal:
+            gb = journal.gradebook
+            gb.select(docopy=True,name='g0').pop().score = 99
+            snap = gb.get_grade('g1').snapshot()
+            snap.identifiers = {'lms_id':'x'}
+            gb.get_grade('g2').score = 7
+        with open(self.log) as log:
+            self.assertEqual(len(log.readlines()),1)
+        with grading.journal_open(self.snap,self.log) as journal:
+            gb = journal.gradebook
+            self.assertNotEqual(gb.get_grade('g0').score,99)
+            self.assertEqual(gb.get_grade('g1').identifiers,{'lms_id':1001})
+            self.assertEqual(gb.get_grade('g2').score,7)
+
+    def test_crash_before_truncating_journal(self):
+        journal = grading.journal_open(self.snap,self.log)
+        gb = journal.gradebook
+        gb.get_grade('g0').score = 5
+        gb.get_grade('g0').name = 'old'
+        gb.get_category('Homework').grades.add_grades(Grade('g0'))
+        with open(self.log,'rb') as log:
+            records = log.read()
+        journal.compact()
+        gb.get_grade('g3').score = 1
+        journal.close()
+        #as if the journal weren't emptied by compact
+        with open(self.log,'rb') as log:
+            after = log.read()
+        with open(self.log,'wb') as log:
+            log.write(records+after)
+        with grading.journal_open(self.snap,self.log) as journal:
+            gb = journal.gradebook
+            self.assertIsNone(gb.get_grade('g0').score)
+            self.assertEqual(gb.get_grade('old').score,5)
+            self.assertEqual(gb.get_grade('g3').score,1)
+            gb.get_grade('g3').score = 2
+            self.assertEqual(journal.seq,5)
+
+
+class TestProjection(unittest.TestCase):
+    #user-023
+    def test_project_matches_assignment(self):
+        gb = make_book(n=30)
+        names = [gr.name for gr in ungraded(gb)]
+        scenarios = [dict((name,s+0.01*i) for i,name in enumerate(names))
+                     for s in (0,5,9)]
+        scenarios.append({names[0]:7})
+        for scenario,value in zip(scenarios,gb.project(scenarios)):
+            book = copy.deepcopy(gb)
+            for name,score in scenario.items():
+                book.get_grade(name).score = score
+            self.assertAlmostEqual(value,book.get_weighted_stat('percent'),12)
+        self.assertRaises(ValueError,gb.project,[{'g0':1}])
+        self.assertRaises(KeyError,gb.project,[{'nope':1}])
+
+    def test_required_score(self):
+        gb = make_book(n=30)
+        low = gb.project([dict((gr.name,0.01*i) for i,gr in
+                               enumerate(ungraded(gb)))])[0]
+        frac = gb.required_score(low+0.05)
+        scenario = dict((gr.name,frac*gr.getMaximum())
+                        for gr in ungraded(gb))
+        self.assertGreaterEqual(gb.project([scenario])[0],low+0.05)
+        self.assertEqual(gb.required_score(low-0.01),0.0)
+        self.assertIsNone(gb.required_score(2))
+
+
+class TestRosterStats(unittest.TestCase):
+    #user-024
+    def test_summary_moments_and_quantiles(self):
+        values = [3,1,4,1,5,9,2,6]
+        s = grading.Summary(values)
+        mean = sum(values)/8.0
+        self.assertAlmostEqual(s.mean,mean)
+        self.assertAlmostEqual(s.variance(),sum((v-mean)**2 for v in values)/8)
+        self.assertEqual(s.median(),3.5)
+        self.assertEqual((s.min,s.max),(1,9))
+        s.remove(9)
+        self.assertAlmostEqual(s.mean,22/7.0)
+        self.assertEqual(s.quantile(1),6)
+        self.assertEqual(s.histogram(2,bounds=(0,6)),([3,4],[0,3.0,6]))
+        self.assertEqual(s.histogram(2)[0],[4,3])
+
+    def test_tracks_changes(self):
+        books = [make_book('s%d'%i,seed=i) for i in xrange(5)]
+        stats = grading.RosterStats(books,track=True)
+        books[0].get_grade('g0').score = 2
+        scores = [gb.get_grade('g0').score for gb in books
+                  if gb.get_grade('g0').score is not None]
+        self.assertAlmostEqual(stats.get_grade('g0').mean,
+                               sum(scores)/float(len(scores)))
+        self.assertAlmostEqual(stats.total().mean,sum(
+                    gb.get_weighted_stat('percent') for gb in books)/5.0)
+
+
+class TestTimestamps(unittest.TestCase):
+    #user-025
+    def test_window_and_as_of(self):
+        gb = make_book(n=30,timestamps=True)
+        start = datetime.datetime.utcfromtimestamp(1500000000+3600*5)
+        end = start+datetime.timedelta(hours=4)
+        window = gb.timestamp_select(start,end)
+        self.assertEqual([gr.name for gr in window],['g5','g6','g7','g8'])
+        self.assertEqual(set(gb.select(GTEtimestamp=start,LTtimestamp=end)),
+                         set(window))
+        book = copy.deepcopy(gb)
+        for name in ('Homework','Quizzes','Exams'):
+            grades = book.get_category(name).grades
+            grades.remove_grades(*[gr for gr in grades if gr.timestamp > end])
+        self.assertAlmostEqual(gb.get_weighted_stat('percent',as_of=end),
+                               book.get_weighted_stat('percent'),12)
+
+    def test_indexes_keep_numeric_timestamps(self):
+        gb = make_book(timestamps=True)
+        gb.get_grade('g1').timestamp = None
+        start = datetime.datetime.utcfromtimestamp(1500000000)
+        window = gb.timestamp_select(start,1500000000+3600*3)
+        self.assertEqual([gr.name for gr in window],['g0','g2'])
+        self.assertEqual(set(gb.select(LTEtimestamp=1500000000+3600*3,
+                                       GTEtimestamp=0)),set(window+[gb['g3']]))
+        gb.get_weighted_stat('percent',as_of=start)
+        self.assertEqual(gb.get_grade('g0')._timestamp,1500000000)
+        self.assertRaises(TypeError,gb.select,GTscore=start)
+
+
+if __name__ == '__main__':
+    unittest.main()